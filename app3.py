@@ -1,10 +1,14 @@
 import os
+import sys
 import time
 import json
 import logging
 from flask import Flask, request, jsonify
 from supabase import create_client, Client
-from sentence_transformers import SentenceTransformer
+# embedding_backends.py lives with the server in rag-app-hf/app (the Docker build context)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag-app-hf', 'app'))
+from embedding_backends import load_embedding_backend, configured_onnx_model_dir
+from caches import EmbeddingCache
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -20,6 +24,9 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # --- Configuration ---
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 EXPECTED_EMBEDDING_DIMENSION = 384
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower() # "torch", "onnx" (ONNX Runtime, see embedding_backends.py) or "stub" (tests only)
+ONNX_MODEL_DIR = configured_onnx_model_dir() # Same default as the server and the indexer
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() in ("1", "true", "yes")
 # *** NEW: Separate Retrieval and Final Counts ***
 DB_RETRIEVAL_COUNT = 6      # Fetch top 6 candidates from Supabase
 MAX_FINAL_RECOMMENDATIONS = 3 # Ask LLM to return at most 3
@@ -30,6 +37,11 @@ MAX_QUERY_RETRIES = 2
 RETRY_QUERY_DELAY = 3
 GEMINI_QUERY_EXPANSION_TEMP = 0.6
 GEMINI_JSON_GENERATION_TEMP = 0.1 # Keep low for structured JSON
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1024)) # 0 disables the cache
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 6 * 3600))
+
+# --- Query Embedding Cache (shared with the server in rag-app-hf/app/caches.py) ---
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_TTL_SECONDS)
 
 # --- Initialize Clients (Global Scope) ---
 supabase_client = None
@@ -42,9 +54,7 @@ try:
     supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
     logging.info("Supabase client initialized.")
     logging.info(f"Loading embedding model '{EMBEDDING_MODEL_NAME}'...")
-    embed_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-    actual_dimension = embed_model.get_sentence_embedding_dimension()
-    if actual_dimension != EXPECTED_EMBEDDING_DIMENSION: raise ValueError(f"Model dim mismatch! Expected {EXPECTED_EMBEDDING_DIMENSION}, got {actual_dimension}.")
+    embed_model = load_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EXPECTED_EMBEDDING_DIMENSION, onnx_model_dir=ONNX_MODEL_DIR, onnx_quantized=ONNX_QUANTIZED)
     logging.info(f"Embedding model loaded.")
     logging.info("Initializing Gemini client...")
     if not GEMINI_API_KEY: raise ValueError("Gemini API Key missing")
@@ -110,7 +120,7 @@ def get_product_recommendation_backend_robust(original_query: str):
         expanded_query = expand_query_with_llm(original_query)
 
         # 2. Embed Expanded Query
-        logging.info(f"Embedding expanded query for retrieval..."); query_embedding = embed_model.encode(expanded_query).tolist()
+        logging.info(f"Embedding expanded query for retrieval..."); query_embedding = embedding_cache.get_or_compute(expanded_query, embed_model.encode).tolist()
 
         # 3. Query Supabase using Expanded Query Embedding (Retrieve top N candidates)
         logging.info(f"Searching for top {DB_RETRIEVAL_COUNT} relevant products...")
@@ -243,7 +253,7 @@ def recommend_assessments():
 @app.route('/health', methods=['GET'])
 def health_check():
     if initialization_error_message: return jsonify({"status": "unhealthy", "reason": initialization_error_message}), 503
-    if supabase_client and embed_model and gen_model: return jsonify({"status": "healthy"}), 200
+    if supabase_client and embed_model and gen_model: return jsonify({"status": "healthy", "embedding_cache": embedding_cache.stats()}), 200
     else: return jsonify({"status": "unhealthy", "reason": "One or more components failed to initialize"}), 503
 
 # --- Run Flask App ---
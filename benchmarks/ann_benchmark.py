@@ -0,0 +1,111 @@
+"""Recall and latency of the IVF (approximate) local index against exact search.
+
+Builds synthetic catalogs of broad, overlapping topics (see overlapping_embeddings), trains
+an IVFVectorIndex on each and reports recall@k against exact float32 search, plus p50/p99
+single-query latency, for a range of nprobe values. Queries are drawn independently of the
+catalog rows. The 1M catalog needs about 5 GiB of RAM while it is generated.
+
+    python benchmarks/ann_benchmark.py [--sizes 10000,100000,1000000] [--nprobes 1,4,8,16,32]
+    python benchmarks/ann_benchmark.py --sizes 100000 --storage int8 --queries 500
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app'))
+from vector_index import LocalVectorIndex
+from ann_index import IVFVectorIndex
+
+
+def overlapping_embeddings(n_rows, dimension, n_topics, draw_seed, topic_seed=0, latent_dimension=64, spread=1.5):
+    """Rows drawn from a mixture of broad, overlapping topics in a low-dimensional latent space.
+
+    Sentence embeddings behave more like this than like tight, well-separated clusters: a
+    topic's rows spread as far as the distance between topics, so a query's neighbours fall
+    in several IVF lists. Catalog and queries share `topic_seed` but use different `draw_seed`s.
+    """
+    topic_rng = np.random.default_rng(topic_seed)
+    centers = topic_rng.standard_normal((n_topics, latent_dimension)).astype(np.float32)
+    projection = topic_rng.standard_normal((latent_dimension, dimension)).astype(np.float32) / np.sqrt(latent_dimension)
+    rng = np.random.default_rng(draw_seed)
+    embeddings = np.empty((n_rows, dimension), dtype=np.float32)
+    for start in range(0, n_rows, 100000):
+        count = min(100000, n_rows - start)
+        latent = centers[rng.integers(0, n_topics, count)] + spread * rng.standard_normal((count, latent_dimension)).astype(np.float32)
+        embeddings[start:start + count] = latent @ projection + 0.2 * rng.standard_normal((count, dimension)).astype(np.float32)
+    return embeddings
+
+
+def unit_rows(matrix):
+    # In place, so the 1M catalog is not held twice
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def time_queries(index, queries, k):
+    results, timings = [], []
+    for query in queries:
+        start_time = time.perf_counter()
+        matches = index.search(query, -1.0, k)
+        timings.append(time.perf_counter() - start_time)
+        results.append({match['product_id'] for match in matches})
+    timings_ms = np.array(timings) * 1e3
+    return results, float(np.percentile(timings_ms, 50)), float(np.percentile(timings_ms, 99))
+
+
+def recall_at_k(results, baseline, k):
+    return float(np.mean([len(found & expected) / k for found, expected in zip(results, baseline)]))
+
+
+def benchmark_size(n_products, args):
+    n_topics = max(8, n_products // 1000)
+    embeddings = unit_rows(overlapping_embeddings(n_products, args.dimension, n_topics, draw_seed=1))
+    records = [{'product_id': f"p{i}"} for i in range(n_products)]
+    # Drawn independently of the catalog rows, like real queries
+    queries = unit_rows(overlapping_embeddings(args.queries, args.dimension, n_topics, draw_seed=2))
+
+    exact = LocalVectorIndex(embeddings, records, normalized=True)
+    baseline, exact_p50, exact_p99 = time_queries(exact, queries, args.k)
+    print(f"\n{n_products} vectors x {args.dimension} dims, {len(queries)} queries, recall@{args.k} vs exact float32")
+    print(f"{'index':<22}{'recall':>9}{'p50 ms':>9}{'p99 ms':>9}{'speedup':>9}")
+    print(f"{'exact':<22}{1.0:>9.4f}{exact_p50:>9.2f}{exact_p99:>9.2f}{1.0:>8.1f}x")
+
+    start_time = time.perf_counter()
+    ivf = IVFVectorIndex(embeddings, records, normalized=True, n_lists=args.n_lists or None, storage=args.storage)
+    build_seconds = time.perf_counter() - start_time
+    del exact
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Round trip through save/load, the way the server gets the index from its cache
+        cache_path = os.path.join(tmp_dir, 'index.npz')
+        ivf.save(cache_path)
+        ivf = IVFVectorIndex.load(cache_path, storage=args.storage, n_lists=args.n_lists or None)
+        assert not ivf.trained_on_init
+        for nprobe in (int(value) for value in args.nprobes.split(',')):
+            ivf.nprobe = nprobe
+            results, p50, p99 = time_queries(ivf, queries, args.k)
+            label = f"ivf{ivf.n_lists} nprobe={nprobe}"
+            print(f"{label:<22}{recall_at_k(results, baseline, args.k):>9.4f}{p50:>9.2f}{p99:>9.2f}{exact_p99 / p99:>8.1f}x")
+        print(f"IVF training: {build_seconds:.1f}s, {ivf.memory_bytes()['ivf_bytes'] / 2**20:.1f} MiB of list data")
+        del ivf
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF vs exact local index benchmark")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated catalog sizes")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--n-lists", type=int, default=0, help="0 = about sqrt(catalog size)")
+    parser.add_argument("--nprobes", default="1,4,8,16,32")
+    parser.add_argument("--storage", default="float32", choices=LocalVectorIndex.STORAGE_FORMATS)
+    args = parser.parse_args()
+
+    for n_products in (int(size) for size in args.sizes.split(',')):
+        benchmark_size(n_products, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Time from server process start to the first successful /recommend, per startup configuration.
+
+Starts `rag-app-hf/app/main.py` as a fresh process for every run, polls /recommend until it
+returns 200, then reads the per-phase startup timings from /health. The server needs the
+same environment it runs with in production (.env with the Supabase and Gemini keys).
+
+    python benchmarks/cold_start_benchmark.py [--runs 3]
+    python benchmarks/cold_start_benchmark.py --config "snapshot=SNAPSHOT_DIR=rag-app-hf/app/snapshot"
+
+Default configurations: 'baseline' (serial initialization, no snapshot, lazy start on the
+first request) and 'optimized' (the defaults: eager, parallel, snapshot if one was built).
+Clear the Hugging Face cache (HF_HOME) between runs to include the model download.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import numpy as np
+import requests
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app', 'main.py')
+DEFAULT_CONFIGS = [
+    "baseline=EAGER_INITIALIZATION=false,STARTUP_WORKERS=1,SNAPSHOT_DIR=",
+    "optimized="
+]
+
+
+def parse_config(spec):
+    name, _, assignments = spec.partition('=')
+    env = {}
+    for assignment in filter(None, assignments.split(',')):
+        key, _, value = assignment.partition('=')
+        env[key] = value
+    return name, env
+
+
+def measure(env_overrides, port, query, timeout):
+    env = dict(os.environ, PORT=str(port), **env_overrides)
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, APP_PATH], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        while time.perf_counter() - start_time < timeout:
+            try:
+                response = requests.post(f"{url}/recommend", json={"query": query}, timeout=60)
+                if response.status_code == 200:
+                    first_success = time.perf_counter() - start_time
+                    startup = requests.get(f"{url}/health", timeout=10).json().get("startup", {})
+                    return first_success, startup
+            except requests.ConnectionError:
+                pass # Not listening yet
+            time.sleep(0.1)
+        raise TimeoutError(f"No successful /recommend within {timeout}s.")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark for the Flask server")
+    parser.add_argument("--config", action="append", help="name=KEY=VALUE,KEY=VALUE (repeatable)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--query", default="Java developer who can collaborate with business teams")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    for spec in args.config or DEFAULT_CONFIGS:
+        name, env = parse_config(spec)
+        timings = []
+        for run in range(args.runs):
+            first_success, startup = measure(env, args.port, args.query, args.timeout)
+            timings.append(first_success)
+            print(f"{name} run {run + 1}: first success after {first_success:.2f}s; phases {json.dumps(startup.get('phases', {}))}")
+        print(f"{name}: median time to first successful recommendation {np.median(timings):.2f}s over {args.runs} runs\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Single-query and batch latency of the embedding backends.
+
+Times every backend that can be loaded here (torch needs sentence-transformers, onnx needs
+onnxruntime and an exported model directory) on product texts from the catalog, and reports
+how closely each backend's vectors agree with the torch model.
+
+    python benchmarks/embedding_benchmark.py [--backends torch,onnx,stub] [--queries 200] [--batch-size 64]
+    python rag-app-hf/app/embedding_backends.py export --output rag-app-hf/app/snapshot/model
+    python benchmarks/embedding_benchmark.py --backends torch,onnx --onnx-float32
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app')
+sys.path.insert(0, APP_DIR)
+from embedding_backends import load_embedding_backend, BACKENDS
+from vector_index import load_catalog
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EXPECTED_EMBEDDING_DIMENSION = 384
+
+
+def catalog_texts(path):
+    products = load_catalog(path)
+    queries = [product.get('product_name') or '' for product in products]
+    documents = [f"{product.get('product_name', '')}. {product.get('description', '')}" for product in products]
+    return [query for query in queries if query], documents
+
+
+def time_single(model, queries):
+    timings = []
+    for query in queries:
+        start_time = time.perf_counter()
+        model.encode(query)
+        timings.append(time.perf_counter() - start_time)
+    timings_ms = np.array(timings) * 1e3
+    return float(np.percentile(timings_ms, 50)), float(np.percentile(timings_ms, 99))
+
+
+def time_batch(model, documents, batch_size):
+    start_time = time.perf_counter()
+    embeddings = model.encode(documents, batch_size=batch_size)
+    return len(documents) / (time.perf_counter() - start_time), embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend latency benchmark")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--catalog", default=os.path.join(APP_DIR, '..', 'data', 'merged_shl_product_data.json'))
+    parser.add_argument("--onnx-model-dir", default=os.path.join(APP_DIR, 'snapshot', 'model'))
+    parser.add_argument("--onnx-float32", action="store_true", help="Use model.onnx instead of the int8 model")
+    parser.add_argument("--queries", type=int, default=200, help="Single-query encodes to time")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    queries, documents = catalog_texts(args.catalog)
+    queries = (queries * (args.queries // max(1, len(queries)) + 1))[:args.queries]
+    print(f"{len(queries)} single queries, {len(documents)} catalog texts in batches of {args.batch_size}\n")
+    print(f"{'backend':<34}{'load s':>8}{'p50 ms':>9}{'p99 ms':>9}{'batch texts/s':>15}{'cos vs torch':>14}")
+
+    reference = None
+    for backend in args.backends.split(','):
+        try:
+            start_time = time.perf_counter()
+            model = load_embedding_backend(
+                backend, EMBEDDING_MODEL_NAME, EXPECTED_EMBEDDING_DIMENSION,
+                onnx_model_dir=args.onnx_model_dir, onnx_quantized=not args.onnx_float32
+            )
+            load_seconds = time.perf_counter() - start_time
+        except Exception as e:
+            print(f"{backend:<34}skipped: {e}")
+            continue
+        model.encode(queries[0]) # Warm-up
+        p50, p99 = time_single(model, queries)
+        texts_per_second, embeddings = time_batch(model, documents, args.batch_size)
+        if backend == 'torch':
+            reference = embeddings
+        agreement = '-'
+        if reference is not None and backend != 'torch':
+            unit = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            unit_reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+            agreement = f"{float(np.mean(np.sum(unit * unit_reference, axis=1))):.4f}"
+        label = f"{backend} ({model.model_id})"
+        print(f"{label:<34}{load_seconds:>8.1f}{p50:>9.2f}{p99:>9.2f}{texts_per_second:>15.0f}{agreement:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Throughput of concurrent query embedding with and without the micro-batching encoder.
+
+N threads each embed distinct queries, either calling the model directly (one forward pass per
+query, all contending for the same cores) or through MicroBatchEncoder. Also reports
+single-thread latency, which batching should leave unchanged.
+
+The default 'synthetic' model is a numpy stand-in with the shape of a 6-layer MiniLM forward
+pass, so the benchmark runs without torch; pass --backend torch or onnx for the real model.
+
+    python benchmarks/micro_batch_benchmark.py [--threads 1,4,8,16] [--queries-per-thread 40]
+    python benchmarks/micro_batch_benchmark.py --backend torch --max-batch-size 32
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app')
+sys.path.insert(0, APP_DIR)
+from embedding_backends import load_embedding_backend, StubEmbeddingBackend
+from micro_batching import MicroBatchEncoder
+
+
+class SyntheticTransformer(StubEmbeddingBackend):
+    """Stub embeddings plus the matrix work of a small transformer over 32 tokens per text."""
+
+    def __init__(self, dimension=384, layers=6, tokens=32):
+        super().__init__(dimension)
+        rng = np.random.default_rng(0)
+        self.tokens = tokens
+        self.weights = [
+            (rng.standard_normal((dimension, 4 * dimension)).astype(np.float32) * 0.02,
+             rng.standard_normal((4 * dimension, dimension)).astype(np.float32) * 0.02)
+            for _ in range(layers)
+        ]
+
+    def _encode_batch(self, texts):
+        hidden = np.ones((len(texts) * self.tokens, self._dimension), dtype=np.float32)
+        for up, down in self.weights:
+            hidden = hidden + np.maximum(hidden @ up, 0) @ down
+        return super()._encode_batch(texts)
+
+
+def run_threads(encode_fn, n_threads, queries_per_thread):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(thread_id):
+        local = []
+        for i in range(queries_per_thread):
+            start_time = time.perf_counter()
+            encode_fn(f"query {thread_id} {i} java developer with sql skills")
+            local.append(time.perf_counter() - start_time)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(n_threads)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+    latencies_ms = np.array(latencies) * 1e3
+    return len(latencies) / elapsed, float(np.percentile(latencies_ms, 50)), float(np.percentile(latencies_ms, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching query encoder benchmark")
+    parser.add_argument("--backend", default="synthetic", help="synthetic, torch, onnx or stub")
+    parser.add_argument("--onnx-model-dir", default=os.path.join(APP_DIR, 'snapshot', 'model'))
+    parser.add_argument("--threads", default="1,4,8,16")
+    parser.add_argument("--queries-per-thread", type=int, default=40)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.backend == "synthetic":
+        model = SyntheticTransformer()
+    else:
+        model = load_embedding_backend(args.backend, 'all-MiniLM-L6-v2', 384, onnx_model_dir=args.onnx_model_dir)
+    model.encode("warm-up")
+
+    print(f"backend={args.backend}, max batch {args.max_batch_size}, max wait {args.max_wait_ms} ms, {args.queries_per_thread} queries per thread\n")
+    print(f"{'threads':>8}{'mode':>14}{'embeds/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'avg batch':>11}")
+    for n_threads in (int(value) for value in args.threads.split(',')):
+        encoder = MicroBatchEncoder(
+            lambda texts: model.encode(texts, batch_size=len(texts)),
+            max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms
+        )
+        for mode, encode_fn in (("direct", model.encode), ("micro-batch", encoder.encode)):
+            throughput, p50, p99 = run_threads(encode_fn, n_threads, args.queries_per_thread)
+            average_batch = f"{encoder.stats()['average_batch_size']:.1f}" if mode == "micro-batch" else "-"
+            print(f"{n_threads:>8}{mode:>14}{throughput:>11.0f}{p50:>9.2f}{p99:>9.2f}{average_batch:>11}")
+
+
+if __name__ == "__main__":
+    main()
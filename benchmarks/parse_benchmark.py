@@ -0,0 +1,220 @@
+"""Parsing benchmark for SHL product pages.
+
+Parses the saved HTML fixtures with the original BeautifulSoup extractor and with
+shl_scraper.parse_product_page, checks that both produce identical records, and reports
+pages/sec for each.
+
+    python benchmarks/parse_benchmark.py [--iterations 200]
+"""
+import os
+import sys
+import json
+import re
+import time
+import argparse
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shl_scraper import parse_product_page
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'product_pages')
+
+
+def legacy_parse_product_page(html, product_info):
+    """The original extract_product_details body (two row scans over the full soup), kept for parity checks"""
+    url = product_info["url"]
+    soup = BeautifulSoup(html, 'lxml')
+
+    # Initialize product data with basic info
+    product_data = {
+        "product_id": product_info["product_id"],
+        "product_name": product_info["product_name"],
+        "url": url,
+        "solution_type": product_info["product_type"],
+        "remote_testing": False,
+        "adaptive_irt": False,
+        "product_type_keys": [],
+        "product_type": [],
+        "description": "",
+        "target_audience": [],
+        "measured_constructs": [],
+        "job_roles": [],
+        "industry": [],
+        "features": [],
+        "duration_minutes": 0
+    }
+    
+    # Look for table rows containing Remote Testing text
+    for row in soup.find_all('tr'):
+        row_text = row.get_text().strip()
+        if 'Remote Testing' in row_text:
+            # Check if there's a green dot or checkmark in the next cell
+            cells = row.find_all('td')
+            if len(cells) > 1:
+                # Check for green dot image or any indicator
+                img = cells[1].find('img')
+                if img and ('green' in img.get('src', '').lower() or 'check' in img.get('src', '').lower()):
+                    product_data["remote_testing"] = True
+                # Also check for text indicators like 'Yes' or '✓'
+                cell_text = cells[1].get_text().strip()
+                if cell_text and ('yes' in cell_text.lower() or '✓' in cell_text):
+                    product_data["remote_testing"] = True
+        
+        if 'Adaptive/IRT' in row_text or 'Adaptive' in row_text:
+            # Similar check for Adaptive/IRT
+            cells = row.find_all('td')
+            if len(cells) > 1:
+                img = cells[1].find('img')
+                if img and ('green' in img.get('src', '').lower() or 'check' in img.get('src', '').lower()):
+                    product_data["adaptive_irt"] = True
+                cell_text = cells[1].get_text().strip()
+                if cell_text and ('yes' in cell_text.lower() or '✓' in cell_text):
+                    product_data["adaptive_irt"] = True
+    
+    # Fallback to original selectors if not found
+    if not product_data["remote_testing"]:
+        remote_testing_element = soup.select_one('.remote-testing .green-dot')
+        if remote_testing_element:
+            product_data["remote_testing"] = True
+            
+    if not product_data["adaptive_irt"]:
+        adaptive_irt_element = soup.select_one('.adaptive-irt .green-dot')
+        if adaptive_irt_element:
+            product_data["adaptive_irt"] = True
+    
+    # Look for Test Type row
+    for row in soup.find_all('tr'):
+        row_text = row.get_text().strip()
+        if 'Test Type' in row_text:
+            cells = row.find_all('td')
+            if len(cells) > 1:
+                # Check for test type indicators in the cell
+                type_cell = cells[1]
+                type_text = type_cell.get_text().strip()
+                
+                # Define type mapping
+                type_mapping = {
+                    'A': "Ability & Aptitude",
+                    'K': "Knowledge & Skills",
+                    'P': "Personality & Behavior"
+                }
+                
+                # Check for type indicators in text
+                for key, value in type_mapping.items():
+                    if key in type_text or value in type_text:
+                        if key not in product_data["product_type_keys"]:
+                            product_data["product_type_keys"].append(key)
+                        if value not in product_data["product_type"]:
+                            product_data["product_type"].append(value)
+                
+                # Also check for images with alt text
+                for img in type_cell.find_all('img'):
+                    alt_text = img.get('alt', '')
+                    for key, value in type_mapping.items():
+                        if key in alt_text or value in alt_text:
+                            if key not in product_data["product_type_keys"]:
+                                product_data["product_type_keys"].append(key)
+                            if value not in product_data["product_type"]:
+                                product_data["product_type"].append(value)
+    
+    # Fallback to the original method if no test types found yet
+    if not product_data["product_type_keys"]:
+        test_type_elements = soup.select('.test-type img')
+        type_mapping = {
+            'A': "Ability & Aptitude",
+            'K': "Knowledge & Skills",
+            'P': "Personality & Behavior"
+        }
+        
+        for element in test_type_elements:
+            alt_text = element.get('alt', '')
+            for key, value in type_mapping.items():
+                if key in alt_text or value in alt_text:
+                    if key not in product_data["product_type_keys"]:
+                        product_data["product_type_keys"].append(key)
+                    if value not in product_data["product_type"]:
+                        product_data["product_type"].append(value)
+    
+    # Extract description
+    description_element = soup.select_one('.product-description')
+    if description_element:
+        product_data["description"] = description_element.text.strip()
+    
+    # Extract other details from sections
+    sections = soup.select('.product-details-section')
+    for section in sections:
+        heading = section.select_one('h3')
+        if not heading:
+            continue
+            
+        heading_text = heading.text.strip().lower()
+        list_items = section.select('li')
+        
+        if 'target audience' in heading_text:
+            product_data["target_audience"] = [item.text.strip() for item in list_items]
+        elif 'measured constructs' in heading_text or 'what it measures' in heading_text:
+            product_data["measured_constructs"] = [item.text.strip() for item in list_items]
+        elif 'job roles' in heading_text or 'job titles' in heading_text:
+            product_data["job_roles"] = [item.text.strip() for item in list_items]
+        elif 'industry' in heading_text:
+            product_data["industry"] = [item.text.strip() for item in list_items]
+        elif 'features' in heading_text:
+            product_data["features"] = [item.text.strip() for item in list_items]
+    
+    # Extract duration if available
+    duration_pattern = r'(\d+)\s*minutes'
+    for feature in product_data["features"]:
+        match = re.search(duration_pattern, feature)
+        if match:
+            product_data["duration_minutes"] = int(match.group(1))
+            break
+    
+    return product_data
+
+
+def load_fixtures():
+    with open(os.path.join(FIXTURES_DIR, 'index.json'), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    fixtures = []
+    for filename, product_info in sorted(index.items()):
+        with open(os.path.join(FIXTURES_DIR, filename), 'r', encoding='utf-8') as f:
+            fixtures.append((filename, f.read(), product_info))
+    return fixtures
+
+
+def time_parser(parse_fn, fixtures, iterations):
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        for _, html, product_info in fixtures:
+            parse_fn(html, product_info)
+    elapsed = time.perf_counter() - start_time
+    return iterations * len(fixtures) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SHL product page parsing")
+    parser.add_argument("--iterations", type=int, default=200, help="Passes over the fixture set per parser")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    mismatches = 0
+    for filename, html, product_info in fixtures:
+        expected = legacy_parse_product_page(html, product_info)
+        actual = parse_product_page(html, product_info)
+        if expected != actual:
+            mismatches += 1
+            print(f"MISMATCH {filename}:")
+            for key in expected:
+                if expected[key] != actual.get(key):
+                    print(f"  {key}: legacy={expected[key]!r} new={actual.get(key)!r}")
+    print(f"Parity: {len(fixtures) - mismatches}/{len(fixtures)} fixtures identical")
+
+    legacy_rate = time_parser(legacy_parse_product_page, fixtures, args.iterations)
+    new_rate = time_parser(parse_product_page, fixtures, args.iterations)
+    print(f"Legacy BeautifulSoup parser: {legacy_rate:8.1f} pages/sec")
+    print(f"Single-pass lxml parser:     {new_rate:8.1f} pages/sec ({new_rate / legacy_rate:.1f}x)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
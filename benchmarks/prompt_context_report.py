@@ -0,0 +1,48 @@
+"""Size of the generation prompt's candidate context: indented JSON vs the compact, token-budgeted form.
+
+Takes consecutive groups of DB_RETRIEVAL_COUNT catalog products as stand-ins for retrieved
+candidates, builds the context the server passes to Gemini, and reports estimated tokens
+(CHARS_PER_TOKEN characters per token) for the previous `json.dumps(indent=2)` form and for
+build_prompt_context at each budget.
+
+    python benchmarks/prompt_context_report.py [--budgets 0,400,800,1200]
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app'))
+os.environ["EAGER_INITIALIZATION"] = "false" # Only the prompt helpers are needed
+import main
+from vector_index import load_catalog
+
+
+def main_report():
+    parser = argparse.ArgumentParser(description="Generation prompt context size report")
+    parser.add_argument("--catalog", default=main.PRODUCT_CATALOG_PATH)
+    parser.add_argument("--budgets", default="0,400,800,1200", help="LLM_CONTEXT_TOKEN_BUDGET values (0 = compact, no limit)")
+    args = parser.parse_args()
+
+    products = load_catalog(args.catalog)
+    size = main.DB_RETRIEVAL_COUNT
+    contexts = [
+        main.build_llm_context([dict(product, similarity=1.0 - rank / size) for rank, product in enumerate(products[start:start + size])])
+        for start in range(0, len(products) - size + 1, size)
+    ]
+    print(f"{len(contexts)} contexts of {size} catalog products\n")
+    print(f"{'context':<22}{'mean tokens':>13}{'p90 tokens':>12}{'vs indented':>13}{'shortened':>11}")
+
+    indented = np.array([main.estimate_tokens(json.dumps(context, indent=2)) for context in contexts])
+    print(f"{'indented JSON':<22}{indented.mean():>13.0f}{np.percentile(indented, 90):>12.0f}{'1.00x':>13}{'-':>11}")
+    for budget in (int(value) for value in args.budgets.split(',')):
+        results = [main.build_prompt_context(context, budget) for context in contexts]
+        tokens = np.array([stats['estimated_tokens'] for _, stats in results])
+        shortened = np.mean([stats['descriptions_truncated'] for _, stats in results])
+        label = f"compact, budget {budget}" if budget else "compact, no budget"
+        print(f"{label:<22}{tokens.mean():>13.0f}{np.percentile(tokens, 90):>12.0f}{tokens.mean() / indented.mean():>12.2f}x{shortened:>11.1f}")
+
+
+if __name__ == "__main__":
+    main_report()
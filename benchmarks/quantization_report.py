@@ -0,0 +1,100 @@
+"""Memory and recall report for the local vector index storage formats.
+
+Compares float32 (baseline), float16 and int8-with-per-row-scale storage, each with an exact
+float32 re-rank of the coarse top candidates, against exact float32 search. Also shows what
+the same matrix costs as Python float lists (the `.tolist()` form) and as JSON text.
+
+    python benchmarks/quantization_report.py [--products 20000] [--queries 500] [--k 6]
+    python benchmarks/quantization_report.py --index /tmp/.cache/shl_product_index.npz
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app'))
+from vector_index import LocalVectorIndex
+
+
+def synthetic_embeddings(n_products, dimension, seed=0):
+    """Clustered unit vectors, closer to real catalog embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n_products // 50), dimension)).astype(np.float32)
+    assignment = rng.integers(0, len(centers), n_products)
+    return centers[assignment] + 0.6 * rng.standard_normal((n_products, dimension)).astype(np.float32)
+
+
+def make_queries(embeddings, n_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    base = embeddings[rng.integers(0, len(embeddings), n_queries)]
+    return base + 0.8 * rng.standard_normal(base.shape).astype(np.float32) * np.abs(base).mean()
+
+
+def python_list_bytes(matrix):
+    row = matrix[0].tolist()
+    per_row = sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return per_row * len(matrix)
+
+
+def json_bytes(matrix, sample=200):
+    sample_rows = matrix[:sample]
+    return int(np.mean([len(json.dumps(row.tolist())) for row in sample_rows]) * len(matrix))
+
+
+def evaluate(index, baseline, queries, k):
+    recall = []
+    start_time = time.perf_counter()
+    for query in queries:
+        found = {match['product_id'] for match in index.search(query, -1.0, k)}
+        recall.append(len(found & baseline[len(recall)]) / k)
+    elapsed = time.perf_counter() - start_time
+    return float(np.mean(recall)), elapsed / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local vector index quantization report")
+    parser.add_argument("--index", default=None, help="Cached LocalVectorIndex (.npz) to use instead of synthetic data")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--rerank-factors", default="1,2,4,8")
+    args = parser.parse_args()
+
+    if args.index:
+        embeddings = np.asarray(LocalVectorIndex.load(args.index).embeddings, dtype=np.float32)
+    else:
+        embeddings = synthetic_embeddings(args.products, args.dimension)
+    records = [{'product_id': f"p{i}"} for i in range(len(embeddings))]
+    queries = make_queries(embeddings, args.queries)
+
+    exact = LocalVectorIndex(embeddings, records)
+    baseline = [{match['product_id'] for match in exact.search(query, -1.0, args.k)} for query in queries]
+    _, exact_us = evaluate(exact, baseline, queries, args.k)
+
+    print(f"{len(embeddings)} vectors x {embeddings.shape[1]} dims, {len(queries)} queries, recall@{args.k} vs exact float32\n")
+    print(f"{'format':<26}{'resident MiB':>14}{'vs float32':>12}{'recall':>10}{'us/query':>11}")
+    float32_bytes = exact.memory_bytes()['resident_bytes']
+    for label, size in (("python float lists", python_list_bytes(embeddings)), ("JSON text", json_bytes(embeddings))):
+        print(f"{label:<26}{size / 2**20:>14.1f}{size / float32_bytes:>11.1f}x{'-':>10}{'-':>11}")
+    print(f"{'float32 (exact)':<26}{float32_bytes / 2**20:>14.1f}{1.0:>11.2f}x{1.0:>10.4f}{exact_us:>11.0f}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = os.path.join(tmp_dir, 'index.npz')
+        exact.save(cache_path)
+        for storage in ('float16', 'int8'):
+            for rerank_factor in (int(factor) for factor in args.rerank_factors.split(',')):
+                # Loaded from disk, so the float32 matrix used for re-ranking is memory-mapped
+                index = LocalVectorIndex.load(cache_path, storage=storage, rerank_factor=rerank_factor)
+                recall, us_per_query = evaluate(index, baseline, queries, args.k)
+                resident = index.memory_bytes()['resident_bytes']
+                label = f"{storage} + rerank x{rerank_factor}"
+                print(f"{label:<26}{resident / 2**20:>14.1f}{resident / float32_bytes:>11.2f}x{recall:>10.4f}{us_per_query:>11.0f}")
+                del index
+
+
+if __name__ == "__main__":
+    main()
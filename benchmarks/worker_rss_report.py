@@ -0,0 +1,112 @@
+"""Per-worker and total memory of 1/2/4 server workers holding the local index, heap vs memory-mapped.
+
+Saves a synthetic index (catalog-sized records, 384-d embeddings) once, then for each worker
+count starts that many fresh processes, like gunicorn workers without --preload. Each loads the
+index with LOCAL_INDEX_MMAP off ('heap') or on ('mmap'), runs searches that touch the whole
+matrix, and waits while its memory is read from /proc/<pid>/smaps_rollup (Linux only).
+
+RSS counts shared page-cache pages in every worker that maps them; PSS splits them between
+the workers, so total PSS is what the workers cost together. Only the index is loaded here:
+the embedding model, BM25 postings and quantized codes stay per-worker either way.
+
+    python benchmarks/worker_rss_report.py [--products 200000] [--workers 1,2,4] [--storage float32]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rag-app-hf', 'app'))
+from vector_index import LocalVectorIndex
+from quantization_report import synthetic_embeddings, make_queries
+
+
+def synthetic_records(n_products, seed=0):
+    rng = np.random.default_rng(seed)
+    words = ['java', 'sql', 'leadership', 'numerical', 'reasoning', 'personality', 'sales', 'customer', 'service', 'manager']
+    return [{
+        'product_id': f"product-{i}",
+        'product_name': f"Assessment {i}",
+        'url': f"https://www.shl.com/solutions/products/product-catalog/view/assessment-{i}/",
+        'solution_type': 'Individual Test Solutions',
+        'remote_testing': bool(i % 2),
+        'adaptive_irt': bool(i % 3 == 0),
+        'product_type': ['Knowledge & Skills'],
+        'description': ' '.join(rng.choice(words, 90)),
+        'job_roles': ['Developer', 'Analyst'],
+        'duration_minutes': int(rng.integers(5, 60))
+    } for i in range(n_products)]
+
+
+def memory_kib(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0] in ('Rss:', 'Pss:'):
+                values[parts[0][:-1].lower()] = int(parts[1])
+    return values
+
+
+def run_worker(path, mmap, storage, n_queries):
+    index = LocalVectorIndex.load(path, storage=storage, mmap=mmap)
+    for query in make_queries(np.asarray(index.embeddings[:1000], dtype=np.float32), n_queries):
+        index.search(query, -1.0, 6)
+    print("ready", flush=True)
+    sys.stdin.readline() # Stay alive until the parent has measured every worker
+
+
+def measure(path, n_workers, mmap, storage, n_queries):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", path, "--storage", storage, "--queries", str(n_queries)]
+    if mmap:
+        command.append("--mmap")
+    workers = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True) for _ in range(n_workers)]
+    try:
+        for worker in workers:
+            if worker.stdout.readline().strip() != "ready":
+                raise RuntimeError("Worker failed to load the index.")
+        time.sleep(0.2)
+        return [memory_kib(worker.pid) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker memory with a heap vs memory-mapped local index")
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--storage", default="float32", help="float32, float16 or int8")
+    parser.add_argument("--queries", type=int, default=20, help="Searches per worker before measuring")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--mmap", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.mmap, args.storage, args.queries)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'index.npz')
+        embeddings = synthetic_embeddings(args.products, args.dimension)
+        LocalVectorIndex(embeddings, synthetic_records(args.products), version='rss-report').save(path)
+        del embeddings
+        sizes = {name: os.path.getsize(os.path.join(tmp_dir, name)) for name in sorted(os.listdir(tmp_dir))}
+        print(f"{args.products} products x {args.dimension}-d, storage={args.storage}; index files: "
+              + ", ".join(f"{name} {size / 2**20:.1f} MiB" for name, size in sizes.items()) + "\n")
+        print(f"{'workers':>8}{'mode':>7}{'RSS/worker MiB':>16}{'total RSS MiB':>15}{'total PSS MiB':>15}")
+        for n_workers in (int(value) for value in args.workers.split(',')):
+            for mode in ("heap", "mmap"):
+                usage = measure(path, n_workers, mode == "mmap", args.storage, args.queries)
+                rss = [entry['rss'] / 1024 for entry in usage]
+                pss = sum(entry['pss'] for entry in usage) / 1024
+                print(f"{n_workers:>8}{mode:>7}{np.mean(rss):>16.0f}{sum(rss):>15.0f}{pss:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
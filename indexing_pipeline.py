@@ -0,0 +1,258 @@
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# --- Streaming Catalog Reader ---
+def iter_products(path, chunk_size=1 << 16):
+    """Yields product dicts one at a time from a JSON array file or a JSON Lines file.
+
+    The format is detected from the first non-whitespace character. Only a small read buffer
+    and the current record are held in memory, whatever the file size.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        first_char = ''
+        while True:
+            first_char = f.read(1)
+            if not first_char or not first_char.isspace():
+                break
+        if first_char == '[':
+            yield from _iter_json_array(f, chunk_size)
+        elif first_char:
+            yield from _iter_json_lines(first_char, f)
+
+
+def _iter_json_array(f, chunk_size):
+    # The opening '[' has already been consumed
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size)
+    pos = 0
+    eof = not buffer
+    while True:
+        # Skip whitespace and the separating comma, refilling the buffer as needed
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = f.read(chunk_size), 0
+            eof = not buffer
+        if pos >= len(buffer):
+            raise ValueError("Unexpected end of file: JSON array is not closed.")
+        if buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The record straddles the buffer boundary: keep the unread tail and read more
+            more = f.read(chunk_size)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield item
+        pos = end
+        if pos > chunk_size:
+            buffer, pos = buffer[pos:], 0
+
+
+def _iter_json_lines(first_char, f):
+    for line_number, line in enumerate(f, start=1):
+        if line_number == 1:
+            line = first_char + line
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+# --- Sinks ---
+class SupabaseSink:
+    """Writes product rows to a Supabase table."""
+
+    def __init__(self, supabase_client, table_name):
+        self.client = supabase_client
+        self.table_name = table_name
+
+    def upsert(self, records):
+        self.client.table(self.table_name).upsert(records, on_conflict='product_id').execute()
+
+    def delete(self, product_ids):
+        self.client.table(self.table_name).delete().in_('product_id', product_ids).execute()
+
+
+class InMemorySink:
+    """Fake sink that keeps rows in a dict, for tests and dry runs.
+
+    `latency` simulates network time per call and `fail_calls` makes the first N upsert calls
+    raise, which exercises the retry path.
+    """
+
+    def __init__(self, latency=0.0, fail_calls=0):
+        self.latency = latency
+        self.fail_calls = fail_calls
+        self.rows = {}
+        self.upsert_calls = 0
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def upsert(self, records):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.upsert_calls += 1
+            if self.upsert_calls <= self.fail_calls:
+                raise ConnectionError(f"Simulated upsert failure #{self.upsert_calls}")
+            self.batch_sizes.append(len(records))
+            for record in records:
+                self.rows.setdefault(record['product_id'], {}).update(record)
+
+    def delete(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self.rows.pop(product_id, None)
+
+
+# --- Retry Helper ---
+def call_with_backoff(fn, description, max_retries=3, base_delay=1.0, max_delay=30.0):
+    """Calls fn() with exponential backoff and full jitter. Returns (succeeded, last_error, attempts)."""
+    last_error = None
+    for attempt in range(max_retries):
+        try:
+            fn()
+            return True, None, attempt + 1
+        except Exception as e:
+            last_error = e
+            logging.error(f"{description} failed (Attempt {attempt + 1}/{max_retries}): {e}", exc_info=False)
+            if attempt < max_retries - 1:
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+                logging.info(f"Retrying {description} in {delay:.2f} seconds...")
+                time.sleep(delay)
+    logging.error(f"Max retries reached for {description}.")
+    return False, last_error, max_retries
+
+
+# --- Adaptive Batch Sizing ---
+class AdaptiveBatchSizer:
+    """Chooses the next upsert batch size from observed latency and payload size.
+
+    Grows the batch multiplicatively while calls stay well under `target_latency`, halves it
+    when a call is slower than that or fails, and caps it so a batch's estimated payload stays
+    below `max_payload_bytes`.
+    """
+
+    def __init__(self, initial_size=100, min_size=10, max_size=500, target_latency=2.0, max_payload_bytes=2_000_000):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_payload_bytes = max_payload_bytes
+        self._size = max(min_size, min(initial_size, max_size))
+        self._bytes_per_record = None
+        self._lock = threading.Lock()
+
+    def next_size(self):
+        with self._lock:
+            size = self._size
+            if self._bytes_per_record:
+                size = min(size, int(self.max_payload_bytes / self._bytes_per_record))
+            return max(self.min_size, min(size, self.max_size))
+
+    def record(self, batch_len, latency, payload_bytes, succeeded=True):
+        with self._lock:
+            if batch_len:
+                per_record = payload_bytes / batch_len
+                # Exponential moving average keeps one unusual batch from dominating
+                self._bytes_per_record = per_record if self._bytes_per_record is None else 0.8 * self._bytes_per_record + 0.2 * per_record
+            if not succeeded or latency > self.target_latency:
+                self._size = max(self.min_size, self._size // 2)
+            elif latency < self.target_latency / 2:
+                self._size = min(self.max_size, int(self._size * 1.5) + 1)
+
+
+# --- Upsert Pipeline ---
+class UpsertPipeline:
+    """Sends batches to a sink from a bounded pool of worker threads.
+
+    `submit` blocks once `max_pending` batches are queued or in flight, so the producer (the
+    embedding loop) keeps working while earlier batches are on the network, without building an
+    unbounded backlog. Failed batches are collected rather than aborting the run.
+    """
+
+    def __init__(self, sink, workers=4, max_pending=8, sizer=None, on_success=None,
+                 max_retries=3, base_delay=1.0, max_delay=30.0):
+        self.sink = sink
+        self.sizer = sizer or AdaptiveBatchSizer()
+        self.on_success = on_success
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failed_batches = [] # dicts with product_ids and error
+        self.succeeded_records = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upsert")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._batch_counter = 0
+
+    def submit(self, items):
+        """Queues a batch of (record, payload) items; `payload` is passed to on_success untouched."""
+        if not items:
+            return
+        self._slots.acquire()
+        with self._lock:
+            self._batch_counter += 1
+            batch_number = self._batch_counter
+        try:
+            self._executor.submit(self._send, batch_number, items)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _send(self, batch_number, items):
+        try:
+            records = [record for record, _ in items]
+            payload_bytes = len(json.dumps(records, ensure_ascii=False))
+            latency = 0.0
+
+            def upsert():
+                # Only the last call is timed: backoff sleeps between retries say nothing about batch size
+                nonlocal latency
+                call_start = time.perf_counter()
+                try:
+                    self.sink.upsert(records)
+                finally:
+                    latency = time.perf_counter() - call_start
+
+            start_time = time.perf_counter()
+            succeeded, error, attempts = call_with_backoff(
+                upsert, f"upsert of batch {batch_number} ({len(records)} records)",
+                max_retries=self.max_retries, base_delay=self.base_delay, max_delay=self.max_delay
+            )
+            wall_time = time.perf_counter() - start_time
+            self.sizer.record(len(records), latency, payload_bytes, succeeded)
+            if succeeded:
+                retries = f", {wall_time:.2f}s in total over {attempts} attempts" if attempts > 1 else ""
+                logging.info(f"Upserted batch {batch_number} ({len(records)} records, {payload_bytes / 1024:.0f} KiB) in {latency:.2f}s{retries}.")
+                with self._lock:
+                    self.succeeded_records += len(records)
+                    if self.on_success:
+                        self.on_success(items)
+            else:
+                with self._lock:
+                    self.failed_batches.append({
+                        "batch": batch_number,
+                        "product_ids": [record['product_id'] for record in records],
+                        "error": str(error)
+                    })
+        except Exception as e:
+            logging.error(f"Unexpected error sending batch {batch_number}: {e}", exc_info=True)
+            with self._lock:
+                self.failed_batches.append({"batch": batch_number, "product_ids": [record['product_id'] for record, _ in items], "error": str(e)})
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Waits for all queued batches to finish."""
+        self._executor.shutdown(wait=True)
@@ -1,10 +1,18 @@
 import json
 import os
+import sys
 import time
+import hashlib
+import tempfile
+import threading
 from supabase import create_client, Client
-from sentence_transformers import SentenceTransformer
+# embedding_backends.py lives with the server in rag-app-hf/app (the Docker build context)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag-app-hf', 'app'))
+from embedding_backends import load_embedding_backend, embedding_model_id, configured_onnx_model_dir, EmbeddingBackend
 from dotenv import load_dotenv
 import logging
+from indexing_pipeline import iter_products, SupabaseSink, InMemorySink, AdaptiveBatchSizer, UpsertPipeline, call_with_backoff
+import numpy as np
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s')
@@ -18,12 +26,33 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 INPUT_JSON_PATH = "/Users/aniketnikam/Documents/Personal_project/Capre_capital/shl_product_catalog_processed.json" # Make sure this is correct
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 EXPECTED_EMBEDDING_DIMENSION = 384
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower() # "torch", "onnx" or "stub" (dry runs); must match what the servers query with
+ONNX_MODEL_DIR = configured_onnx_model_dir() # Same default as the servers, so the model ids match
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() in ("1", "true", "yes")
+# Backend-specific model id (torch: the model name, onnx: file + content hash); the manifest is only reused for the same id
+EMBEDDING_MODEL_ID = embedding_model_id(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EXPECTED_EMBEDDING_DIMENSION, ONNX_MODEL_DIR, ONNX_QUANTIZED)
 TABLE_NAME = "products"
-UPSERT_BATCH_SIZE = 100 # Increased slightly, monitor performance
+UPSERT_BATCH_SIZE = 100 # Initial batch size; adapted at runtime between the min/max below
+UPSERT_MIN_BATCH_SIZE = 10
+UPSERT_MAX_BATCH_SIZE = 500
+UPSERT_TARGET_LATENCY = 2.0 # Seconds per upsert call the batch sizer aims to stay under
+UPSERT_MAX_PAYLOAD_BYTES = 2_000_000 # Keep request bodies well below PostgREST limits
+UPSERT_WORKERS = int(os.getenv("UPSERT_WORKERS", 4)) # Concurrent upsert calls
+UPSERT_MAX_PENDING = 8 # Batches queued or in flight before the embedding loop waits
 MAX_RETRIES = 3
-RETRY_DELAY = 5
+RETRY_DELAY = 5 # Base delay for exponential backoff with jitter
+RETRY_MAX_DELAY = 60
+INDEX_SINK = os.getenv("INDEX_SINK", "supabase").lower() # "supabase", or "memory" for a dry run against an in-memory fake
+MANIFEST_PATH = os.getenv("INDEX_MANIFEST_PATH", "index_manifest.json") # Per-product content hashes from the last successful run
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64)) # Texts per forward pass
+EMBED_NUM_PROCESSES = int(os.getenv("EMBED_NUM_PROCESSES", 0)) # >1 spreads encoding over a SentenceTransformer multi-process pool (torch backend only)
+FORCE_FULL_REINDEX = os.getenv("FORCE_FULL_REINDEX", "false").lower() in ("1", "true", "yes") # Ignore the manifest and re-embed everything
 
 # --- Helper Functions ---
+class EmbeddingModelError(RuntimeError):
+    """The embedding model could not be loaded (e.g. a missing ONNX export or a dimension mismatch)."""
+
+
 def get_embedding_text(product):
     """Combines important fields for richer embedding context. Handles empty/missing values."""
     # Helper to safely join list items that are non-empty strings
@@ -45,176 +74,314 @@ def get_embedding_text(product):
     return " | ".join(part for part in parts if part and ': ' not in part or ': ' in part and len(part.split(': ', 1)) > 1 and part.split(': ', 1)[1])
 
 
-def upsert_batch_with_retry(supabase_client: Client, data: list):
-    """Attempts to upsert data to Supabase with retries."""
-    if not data: return True
-    for attempt in range(MAX_RETRIES):
-        try:
-            logging.info(f"Upserting batch of {len(data)} records (Attempt {attempt + 1}/{MAX_RETRIES})...")
-            response = supabase_client.table(TABLE_NAME).upsert(data, on_conflict='product_id').execute()
-            # Add detailed error check if possible based on client version
-            # if hasattr(response, 'error') and response.error: raise Exception(f"Supabase API Error: {response.error.message}")
-            logging.info(f"Successfully upserted batch.")
-            return True
-        except Exception as e:
-            logging.error(f"Supabase upsert error (Attempt {attempt + 1}/{MAX_RETRIES}): {e}", exc_info=False) # exc_info=False to avoid full traceback on retryable errors
-            if attempt < MAX_RETRIES - 1:
-                logging.info(f"Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
-            else:
-                logging.error("Max retries reached for upserting batch.", exc_info=True) # Log full traceback on final failure
-                return False
+def build_product_record(product_id, product):
+    """Builds the Supabase row for a product, without the embedding column."""
+    # Use .get with defaults for all potentially missing fields
+    return {
+        'product_id': product_id,
+        'product_name': product.get('product_name'),
+        'url': product.get('url'),
+        'remote_testing': product.get('remote_testing'),
+        'adaptive_irt': product.get('adaptive_irt'),
+        'product_type': product.get('product_type', []) or [], # Ensure always a list, even if null in JSON
+        'description': product.get('description'),
+        'target_audience': product.get('target_audience', []) or [],
+        'measured_constructs': product.get('measured_constructs', []) or [],
+        'job_roles': product.get('job_roles', []) or [],
+        'industry': product.get('industry', []) or [],
+        'features': product.get('features', []) or [],
+        'duration_minutes': product.get('duration_minutes'), # Handles None correctly
+        # 'solution_type': product.get('solution_type') # Add if column exists in DB
+    }
+
+
+def content_hash(value):
+    """SHA-256 of a string or JSON-serializable value."""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+# --- Manifest Helpers ---
+def load_manifest(path):
+    """Loads the manifest of the last indexing run. Returns {product_id: {'text_hash', 'record_hash'}}.
+
+    The manifest is ignored (full re-index) if it is missing, unreadable or was built with a
+    different embedding model or backend (EMBEDDING_MODEL_ID).
+    """
+    if FORCE_FULL_REINDEX:
+        logging.info("FORCE_FULL_REINDEX is set, ignoring the existing manifest.")
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        logging.info(f"No manifest found at '{path}', performing a full index.")
+        return {}
+    except (json.JSONDecodeError, OSError) as e:
+        logging.warning(f"Could not read manifest '{path}': {e}. Performing a full index.")
+        return {}
+    if manifest.get('embedding_model') != EMBEDDING_MODEL_ID or manifest.get('table') != TABLE_NAME:
+        logging.info(f"Manifest was built for a different model or table ({manifest.get('embedding_model')}, {manifest.get('table')}), performing a full index.")
+        return {}
+    return manifest.get('products', {})
+
+
+def save_manifest(path, products):
+    """Atomically writes the manifest so a crash never leaves a truncated file behind."""
+    manifest = {
+        'embedding_model': EMBEDDING_MODEL_ID,
+        'table': TABLE_NAME,
+        'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'products': products
+    }
+    # A temp file per writer, so concurrent runs never publish each other's half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.chmod(tmp_path, 0o644) # mkstemp creates 0600; keep the usual mode so replacing the manifest does not hide it from other users
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logging.info(f"Manifest with {len(products)} products written to '{path}'.")
+
+
+# --- Embedding Helpers ---
+def start_embedding_pool(model: EmbeddingBackend, num_processes: int):
+    """Starts a multi-process encoding pool, or returns None for single-process encoding."""
+    if num_processes <= 1:
+        return None
+    if not hasattr(model, 'start_multi_process_pool'):
+        logging.warning(f"The {model.name} embedding backend has no multi-process pool; encoding in a single process.")
+        return None
+    logging.info(f"Starting multi-process embedding pool with {num_processes} CPU workers...")
+    return model.start_multi_process_pool(target_devices=['cpu'] * num_processes)
+
+
+def encode_texts(model: EmbeddingBackend, texts: list, pool=None):
+    """Encodes texts in EMBED_BATCH_SIZE batches. Returns a (len(texts), dim) float32 matrix."""
+    if pool is not None:
+        embeddings = model.encode_multi_process(texts, pool, batch_size=EMBED_BATCH_SIZE)
+    else:
+        embeddings = model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
+
 
 # --- Main Indexing Logic ---
 def main():
     logging.info("Starting updated indexing process...")
 
     # --- Environment Variable Check ---
-    if not SUPABASE_URL or not SUPABASE_KEY:
+    if INDEX_SINK != "memory" and (not SUPABASE_URL or not SUPABASE_KEY):
         logging.error("Critical Error: Supabase URL or Key not found. Check .env file.")
         return
 
     # --- Initialize Clients (Moved out of try block for clarity, checked later) ---
+    # The embedding model is loaded lazily, so a run with no new or changed products never loads it
     supabase: Client | None = None
-    model: SentenceTransformer | None = None
+    model: EmbeddingBackend | None = None
     try:
-        logging.info("Initializing Supabase client...")
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        logging.info("Supabase client initialized.")
-        logging.info(f"Loading embedding model '{EMBEDDING_MODEL_NAME}'...")
-        model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        actual_dimension = model.get_sentence_embedding_dimension()
-        logging.info(f"Model loaded. Actual embedding dimension: {actual_dimension}")
-        if actual_dimension != EXPECTED_EMBEDDING_DIMENSION:
-            raise ValueError(f"Model dimension ({actual_dimension}) != expected ({EXPECTED_EMBEDDING_DIMENSION}) for SQL table!")
+        if INDEX_SINK == "memory":
+            logging.info("INDEX_SINK=memory: writing to an in-memory fake instead of Supabase (dry run).")
+            sink = InMemorySink()
+        else:
+            logging.info("Initializing Supabase client...")
+            supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+            sink = SupabaseSink(supabase, TABLE_NAME)
+            logging.info("Supabase client initialized.")
     except Exception as e:
         logging.error(f"Critical Error during initialization: {e}", exc_info=True)
         return # Stop if essential clients fail
 
-    # --- Load and De-duplicate Product Data ---
-    products_from_file = []
-    try:
-        logging.info(f"Loading product data from '{INPUT_JSON_PATH}'...")
-        with open(INPUT_JSON_PATH, 'r', encoding='utf-8') as f:
-            products_from_file = json.load(f)
-        logging.info(f"Loaded {len(products_from_file)} records from file.")
-        if not isinstance(products_from_file, list):
-             logging.error(f"Error: Input file does not contain a valid JSON list.")
-             return
-    except FileNotFoundError:
-        logging.error(f"Critical Error: Input file not found at '{INPUT_JSON_PATH}'")
-        return
-    except json.JSONDecodeError as e:
-        logging.error(f"Critical Error: Failed to decode JSON: {e}")
-        return
-    except Exception as e:
-        logging.error(f"Critical Error reading input file: {e}", exc_info=True)
-        return
+    def get_model():
+        nonlocal model
+        if model is None:
+            logging.info(f"Loading embedding model '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend)...")
+            # Raises on a dimension mismatch, which would not fit the SQL table's vector column
+            try:
+                model = load_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EXPECTED_EMBEDDING_DIMENSION, onnx_model_dir=ONNX_MODEL_DIR, onnx_quantized=ONNX_QUANTIZED)
+            except Exception as e:
+                source = f" from ONNX_MODEL_DIR '{ONNX_MODEL_DIR}'" if EMBEDDING_BACKEND == "onnx" else ""
+                raise EmbeddingModelError(f"Failed to load embedding model '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend){source}: {e}") from e
+        return model
+
+    # --- Compare Against the Manifest of the Last Run ---
+    previous_manifest = load_manifest(MANIFEST_PATH)
+    manifest_products = dict(previous_manifest) # Updated as batches succeed; failed products keep their old hashes
+    manifest_lock = threading.Lock()
+
+    def record_in_manifest(items):
+        """Called by upsert workers once a batch of (record, manifest_entry) is stored."""
+        with manifest_lock:
+            for record, entry in items:
+                manifest_products[record['product_id']] = entry
+
+    # --- Upsert Pipeline: batches are sent by a worker pool while the next ones are embedded ---
+    sizer = AdaptiveBatchSizer(UPSERT_BATCH_SIZE, UPSERT_MIN_BATCH_SIZE, UPSERT_MAX_BATCH_SIZE, UPSERT_TARGET_LATENCY, UPSERT_MAX_PAYLOAD_BYTES)
+    pipeline = UpsertPipeline(
+        sink, workers=UPSERT_WORKERS, max_pending=UPSERT_MAX_PENDING, sizer=sizer, on_success=record_in_manifest,
+        max_retries=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY
+    )
 
-    # --- De-duplication Step ---
-    unique_products_dict = {}
+    pool = None
+    embedded_count = 0
+    embedding_seconds = 0.0
+
+    def embed_and_submit(chunk):
+        """Encodes a chunk of (record, manifest_entry, text) and queues it for upsert."""
+        nonlocal pool, embedded_count, embedding_seconds
+        if pool is None and EMBED_NUM_PROCESSES > 1:
+            pool = start_embedding_pool(get_model(), EMBED_NUM_PROCESSES)
+        embed_start = time.perf_counter()
+        # One bulk conversion per chunk instead of a .tolist() per product
+        vectors = encode_texts(get_model(), [text for _, _, text in chunk], pool).tolist()
+        embedding_seconds += time.perf_counter() - embed_start
+        embedded_count += len(chunk)
+
+        batch = []
+        for (record, entry, _), vector in zip(chunk, vectors):
+            record['embedding'] = vector
+            batch.append((record, entry))
+        pipeline.submit(batch)
+        logging.info(f"Progress: {embedded_count} embedded ({embedded_count / max(embedding_seconds, 1e-9):.1f} embeddings/sec), {pipeline.succeeded_records} upserted.")
+
+    # --- Stream, De-duplicate and Classify Products in a Single Pass ---
+    # Only product ids (for de-duplication and removal detection) and the current batches are kept in memory
+    seen_product_ids = set()
+    records_read_count = 0
     duplicates_found_count = 0
     skipped_missing_id_count = 0
-    valid_input_count = 0
+    unchanged_count = 0
+    metadata_only_count = 0
+    to_embed = [] # (record, manifest_entry, text) for new products or changed embedding text
+    metadata_only = [] # (record, manifest_entry) whose embedding text is unchanged
+    embedding_error_occurred = False
 
-    for product in products_from_file:
-        product_id = product.get('product_id')
-        # Ensure product_id exists and is not just whitespace
-        if not product_id or not str(product_id).strip():
-            logging.warning(f"Skipping record due to missing or empty 'product_id': {product.get('product_name', 'N/A')}")
-            skipped_missing_id_count += 1
-            continue
+    logging.info(f"Streaming product data from '{INPUT_JSON_PATH}' (embedding batch size {EMBED_BATCH_SIZE}, processes {max(1, EMBED_NUM_PROCESSES)})...")
+    try:
+        for product in iter_products(INPUT_JSON_PATH):
+            records_read_count += 1
+            if not isinstance(product, dict):
+                logging.warning(f"Skipping record {records_read_count}: expected a JSON object, got {type(product).__name__}.")
+                skipped_missing_id_count += 1
+                continue
 
-        product_id_str = str(product_id).strip() # Use stripped string ID as key
-        valid_input_count += 1
+            product_id = product.get('product_id')
+            # Ensure product_id exists and is not just whitespace
+            if not product_id or not str(product_id).strip():
+                logging.warning(f"Skipping record due to missing or empty 'product_id': {product.get('product_name', 'N/A')}")
+                skipped_missing_id_count += 1
+                continue
 
-        if product_id_str not in unique_products_dict:
-            unique_products_dict[product_id_str] = product # Store first occurrence
-        else:
-            duplicates_found_count += 1
-            logging.warning(f"Duplicate product_id found and skipped: '{product_id_str}'")
+            product_id = str(product_id).strip() # Use stripped string ID as key
+            if product_id in seen_product_ids:
+                duplicates_found_count += 1
+                logging.warning(f"Duplicate product_id found and skipped: '{product_id}'")
+                continue
+            seen_product_ids.add(product_id) # First occurrence wins
 
-    unique_product_list = list(unique_products_dict.values())
-    total_unique_products = len(unique_product_list)
+            try:
+                # Prepare text and record
+                text_to_embed = get_embedding_text(product)
+                if not text_to_embed or text_to_embed.isspace():
+                     logging.warning(f"Skipping product (ID: {product_id}) due to empty text for embedding.")
+                     # For now, we skip embedding/upserting if text is empty.
+                     continue
 
-    logging.info(f"--- Data Loading Summary ---")
-    logging.info(f"Total records read from file: {len(products_from_file)}")
-    logging.info(f"Records skipped due to missing/empty product_id: {skipped_missing_id_count}")
-    logging.info(f"Duplicate product_ids found and skipped: {duplicates_found_count}")
-    logging.info(f"Total unique products to process: {total_unique_products}")
-    #-----------------------------
+                product_record = build_product_record(product_id, product)
+                entry = {'text_hash': content_hash(text_to_embed), 'record_hash': content_hash(product_record)}
+            except Exception as e:
+                logging.error(f"Error processing product (ID: {product_id}): {e}", exc_info=True)
+                # For now, we log and continue to the next product
+                continue
+
+            previous_entry = previous_manifest.get(product_id)
+            if previous_entry == entry:
+                unchanged_count += 1
+            elif previous_entry and previous_entry.get('text_hash') == entry['text_hash']:
+                # No embedding column, so the stored vector is kept
+                metadata_only_count += 1
+                metadata_only.append((product_record, entry))
+                if len(metadata_only) >= sizer.next_size():
+                    pipeline.submit(metadata_only)
+                    metadata_only = []
+            else:
+                to_embed.append((product_record, entry, text_to_embed))
+                if len(to_embed) >= sizer.next_size():
+                    embed_and_submit(to_embed)
+                    to_embed = []
+
+        # Queue the last partial batches
+        pipeline.submit(metadata_only)
+        if to_embed:
+            embed_and_submit(to_embed)
 
-    if not unique_product_list:
-        logging.warning("No unique products found to process. Exiting.")
+    except EmbeddingModelError as e:
+        # Not an input error: products already upserted are still recorded in the manifest
+        logging.error(f"Critical Error: {e}")
+        embedding_error_occurred = True
+    except FileNotFoundError:
+        logging.error(f"Critical Error: Input file not found at '{INPUT_JSON_PATH}'")
+        pipeline.close()
         return
+    except (json.JSONDecodeError, ValueError) as e:
+        logging.error(f"Critical Error: Failed to decode input after {records_read_count} records: {e}")
+        embedding_error_occurred = True
+    except Exception as e:
+        logging.error(f"Error while streaming or embedding products: {e}", exc_info=True)
+        embedding_error_occurred = True
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    pipeline.close()
+    processed_count = pipeline.succeeded_records
 
-    # --- Generate Embeddings and Upsert UNIQUE Products ---
-    logging.info(f"Generating embeddings and upserting {total_unique_products} unique products...")
-    data_to_upsert = []
-    processed_count = 0
-    batch_error_occurred = False # Flag to stop processing if a batch fails
+    logging.info(f"--- Data Loading Summary ---")
+    logging.info(f"Total records read from file: {records_read_count}")
+    logging.info(f"Records skipped due to missing/empty product_id: {skipped_missing_id_count}")
+    logging.info(f"Duplicate product_ids found and skipped: {duplicates_found_count}")
+    logging.info(f"Total unique products processed: {len(seen_product_ids)}")
+    if embedded_count:
+        logging.info(f"Embedded {embedded_count} products in {embedding_seconds:.2f}s ({embedded_count / max(embedding_seconds, 1e-9):.1f} embeddings/sec).")
+    for failure in pipeline.failed_batches:
+        logging.error(f"Batch {failure['batch']} failed after {MAX_RETRIES} attempts ({len(failure['product_ids'])} products, e.g. {failure['product_ids'][:3]}): {failure['error']}")
+    batch_error_occurred = embedding_error_occurred or bool(pipeline.failed_batches)
+    # After a failure the seen ids may be incomplete, so nothing is treated as removed
+    removed_product_ids = [] if batch_error_occurred else sorted(set(previous_manifest) - seen_product_ids)
 
-    # Now iterate over the unique list
-    for i, product in enumerate(unique_product_list):
-        # Get the validated product_id used as the dictionary key
-        product_id = str(product.get('product_id')).strip()
+    # Remove products that disappeared from the input
+    if removed_product_ids:
+        logging.info(f"Deleting {len(removed_product_ids)} products that are no longer in the input...")
+        deleted, _, _ = call_with_backoff(
+            lambda: sink.delete(removed_product_ids), "delete of removed products",
+            max_retries=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY
+        )
+        if deleted:
+            for product_id in removed_product_ids:
+                manifest_products.pop(product_id, None)
 
+    if INDEX_SINK == "memory":
+        # The in-memory fake is discarded, so recording its products would make the next real run skip them
+        logging.info(f"INDEX_SINK=memory: dry run, manifest '{MANIFEST_PATH}' left unchanged.")
+    else:
         try:
-            # Prepare text and generate embedding
-            text_to_embed = get_embedding_text(product)
-            if not text_to_embed or text_to_embed.isspace():
-                 # This check might be redundant if get_embedding_text handles it, but safe
-                 logging.warning(f"Skipping unique product {i+1}/{total_unique_products} (ID: {product_id}) due to empty text for embedding.")
-                 # Consider if skipping here is correct, or if you want to insert without embedding?
-                 # For now, we skip embedding/upserting if text is empty.
-                 continue
-
-            embedding = model.encode(text_to_embed).tolist()
-
-            # Prepare record for Supabase
-            # Use .get with defaults for all potentially missing fields
-            product_record = {
-                'product_id': product_id,
-                'product_name': product.get('product_name'),
-                'url': product.get('url'),
-                'remote_testing': product.get('remote_testing'),
-                'adaptive_irt': product.get('adaptive_irt'),
-                'product_type': product.get('product_type', []) or [], # Ensure always a list, even if null in JSON
-                'description': product.get('description'),
-                'target_audience': product.get('target_audience', []) or [],
-                'measured_constructs': product.get('measured_constructs', []) or [],
-                'job_roles': product.get('job_roles', []) or [],
-                'industry': product.get('industry', []) or [],
-                'features': product.get('features', []) or [],
-                'duration_minutes': product.get('duration_minutes'), # Handles None correctly
-                'embedding': embedding,
-                # 'solution_type': product.get('solution_type') # Add if column exists in DB
-            }
-            # Filter out keys where value is None IF Supabase requires it (usually NULL is fine)
-            # product_record = {k: v for k, v in product_record.items() if v is not None} # Optional
-
-            data_to_upsert.append(product_record)
-            processed_count += 1
-
-            # Upsert in batches
-            if len(data_to_upsert) >= UPSERT_BATCH_SIZE or (i == total_unique_products - 1): # Also upsert last batch
-                if not upsert_batch_with_retry(supabase, data_to_upsert):
-                    batch_error_occurred = True
-                    logging.error("Stopping processing due to batch upsert failure.")
-                    break # Stop processing loop if a batch fails permanently
-                data_to_upsert = [] # Clear the batch
-                logging.info(f"Progress: {processed_count}/{total_unique_products} unique products prepared/upserted.")
-
-        except Exception as e:
-            logging.error(f"Error processing unique product {i+1}/{total_unique_products} (ID: {product_id}): {e}", exc_info=True)
-            # Decide whether to skip this single record or stop entirely
-            # For now, we log and continue to the next product
-            continue
+            save_manifest(MANIFEST_PATH, manifest_products)
+        except OSError as e:
+            logging.error(f"Failed to write manifest '{MANIFEST_PATH}': {e}. The next run will re-check all products.")
 
     logging.info(f"--- Indexing Summary ---")
-    logging.info(f"Total unique products processed for upsert: {processed_count}")
-    if batch_error_occurred:
-         logging.warning("Process stopped prematurely due to batch upsert errors.")
+    logging.info(f"Unchanged products skipped: {unchanged_count}")
+    logging.info(f"Products with metadata-only changes: {metadata_only_count}")
+    logging.info(f"Total new/changed products processed for upsert: {processed_count}")
+    logging.info(f"Products removed from the input: {len(removed_product_ids)}")
+    if embedding_error_occurred:
+         logging.warning("Processing stopped early; products that were not upserted will be retried on the next run.")
+    if pipeline.failed_batches:
+         logging.warning(f"{len(pipeline.failed_batches)} batches failed; their products keep their old manifest entries and will be retried on the next run.")
     logging.info("Indexing process finished.")
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+import math
+import time
+import logging
+import numpy as np
+
+from vector_index import LocalVectorIndex
+
+
+def default_n_lists(n_rows):
+    """About sqrt(n) inverted lists, the usual starting point for an IVF index."""
+    return max(1, min(n_rows, int(round(math.sqrt(n_rows)))))
+
+
+def train_centroids(matrix, n_lists, iterations=10, sample_size=None, seed=0, block_rows=16384):
+    """Spherical k-means on (a sample of) the L2-normalized rows of `matrix`. Returns unit centroids."""
+    rng = np.random.default_rng(seed)
+    n_rows = len(matrix)
+    sample_size = min(n_rows, sample_size or n_lists * 64)
+    sample_rows = np.sort(rng.choice(n_rows, sample_size, replace=False)) if sample_size < n_rows else np.arange(n_rows)
+    sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids, block_rows)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        centroids[filled] = sums
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            # Re-seed empty lists from random sample rows so every list stays in use
+            centroids[empty] = sample[rng.choice(sample_size, empty.size, replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids
+
+
+def assign_lists(matrix, centroids, block_rows=16384):
+    """Index of the nearest (highest inner product) centroid for every row, computed in blocks."""
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+# --- IVF Vector Index ---
+class IVFVectorIndex(LocalVectorIndex):
+    """Approximate LocalVectorIndex: an inverted-file (IVF) index over k-means centroids.
+
+    Rows are grouped into `n_lists` lists by their nearest centroid. A query scores the
+    centroids, then only the rows of the `nprobe` best lists (exactly, or through the
+    quantized coarse scan when `storage` is int8/float16). Raising `nprobe` trades latency for
+    recall; `nprobe >= n_lists` is an exact search. The centroids and list assignments are
+    saved with the index, so a restart does not retrain.
+    """
+
+    EXTRA_ARRAYS = ('centroids', 'assignments')
+
+    def __init__(self, embeddings, records, version=None, storage='float32', rerank_factor=4, normalized=False,
+                 product_ids=None, n_lists=None, nprobe=16, centroids=None, assignments=None, train_iterations=10, seed=0):
+        super().__init__(embeddings, records, version=version, storage=storage, rerank_factor=rerank_factor, normalized=normalized, product_ids=product_ids)
+        n_rows = len(self.records)
+        n_lists = min(int(n_lists), n_rows) if n_lists else default_n_lists(n_rows)
+        self.nprobe = max(1, int(nprobe))
+        # Saved lists are reused unless they are for a different list count or row count
+        self.trained_on_init = (
+            centroids is None or assignments is None
+            or len(centroids) != n_lists or len(assignments) != n_rows
+        )
+        if not n_rows:
+            self.centroids = np.zeros((0, self.dimension), dtype=np.float32)
+            self.assignments = np.zeros(0, dtype=np.int32)
+        elif self.trained_on_init:
+            start_time = time.perf_counter()
+            self.centroids = train_centroids(self.embeddings, n_lists, iterations=train_iterations, seed=seed)
+            self.assignments = assign_lists(self.embeddings, self.centroids)
+            logging.info(f"Trained IVF index: {n_lists} lists over {n_rows} products in {time.perf_counter() - start_time:.2f}s.")
+        else:
+            self.centroids = np.asarray(centroids, dtype=np.float32)
+            self.assignments = np.asarray(assignments, dtype=np.int32)
+        # Rows of list i are _list_rows[_list_offsets[i]:_list_offsets[i + 1]], in row order
+        self._list_rows = np.argsort(self.assignments, kind='stable').astype(np.int64)
+        self._list_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))))
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def memory_bytes(self):
+        usage = super().memory_bytes()
+        ivf_bytes = int(self.centroids.nbytes + self.assignments.nbytes + self._list_rows.nbytes + self._list_offsets.nbytes)
+        usage.update(index_type="ivf", n_lists=self.n_lists, nprobe=self.nprobe, ivf_bytes=ivf_bytes)
+        usage["resident_bytes"] += ivf_bytes
+        return usage
+
+    def _probed_rows(self, query):
+        if self.nprobe >= self.n_lists:
+            return None
+        lists = np.argpartition(self.centroids @ query, -self.nprobe)[-self.nprobe:]
+        # Sorted for sequential reads from a memory-mapped matrix
+        return np.sort(np.concatenate([self._list_rows[self._list_offsets[i]:self._list_offsets[i + 1]] for i in lists]))
+
+    def _candidate_rows(self, query, match_count, mask=None):
+        probed = self._probed_rows(query)
+        if mask is None:
+            return probed
+        eligible = np.flatnonzero(mask)
+        if probed is None or eligible.size <= probed.size:
+            # A selective filter leaves fewer rows than the probed lists: scan them all exactly
+            return eligible
+        rows = probed[mask[probed]]
+        # Too few eligible rows near the query: fall back to every eligible row so filters never lose results
+        return rows if rows.size >= match_count else eligible
+
+    def search_batch(self, query_matrix, match_threshold, match_count):
+        """Runs `search` for every row of `query_matrix`; each query probes its own lists."""
+        if self.nprobe >= self.n_lists:
+            return super().search_batch(query_matrix, match_threshold, match_count)
+        queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+        return [self.search(query, match_threshold, match_count) for query in queries]
+
+    def _extra_arrays(self):
+        return {'centroids': self.centroids, 'assignments': self.assignments}
@@ -0,0 +1,82 @@
+"""Builds the startup snapshot main.py loads from SNAPSHOT_DIR instead of downloading and embedding at cold start.
+
+    python build_snapshot.py [--output snapshot] [--catalog ../data/merged_shl_product_data.json]
+
+Writes, with the same EMBEDDING_BACKEND / LOCAL_INDEX_* settings the server will run with:
+    model/                 the sentence-transformers model files (plus the ONNX export for the onnx backend)
+    product_index.npz      index version and matrix shape (+ IVF lists), with beside it
+    product_index.f32.npy  the float32 product matrix,
+    product_index.ids.npy  the product ids and
+    product_index.records.jsonl / .records.offsets.npy  the product records (memory-mapped by the server)
+    manifest.json          what was built, from which model and catalog
+
+Run it before pushing the Space (or as a Docker build step) so the snapshot ships inside the image.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+
+# Only the configuration and helpers are needed from the server, not a running instance
+os.environ["EAGER_INITIALIZATION"] = "false"
+import main
+from embedding_backends import load_embedding_backend, export_onnx_model
+from vector_index import build_local_index, LocalVectorIndex
+from ann_index import IVFVectorIndex
+
+
+def build_snapshot(output_dir, catalog_path):
+    start_time = time.perf_counter()
+    model_dir = os.path.join(output_dir, 'model')
+    index_path = os.path.join(output_dir, 'product_index.npz')
+    os.makedirs(output_dir, exist_ok=True)
+    shutil.rmtree(model_dir, ignore_errors=True)
+
+    if main.EMBEDDING_BACKEND == 'onnx':
+        export_onnx_model(main.EMBEDDING_MODEL_NAME, model_dir)
+        model = load_embedding_backend('onnx', main.EMBEDDING_MODEL_NAME, main.EXPECTED_EMBEDDING_DIMENSION, onnx_model_dir=model_dir, onnx_quantized=main.ONNX_QUANTIZED)
+    else:
+        model = load_embedding_backend(main.EMBEDDING_BACKEND, main.EMBEDDING_MODEL_NAME, main.EXPECTED_EMBEDDING_DIMENSION)
+        if main.EMBEDDING_BACKEND == 'torch':
+            model.model.save(model_dir)
+    logging.info(f"Snapshot model written to '{model_dir}' ({model.model_id}).")
+
+    index_cls = IVFVectorIndex if main.LOCAL_INDEX_TYPE == "ivf" else LocalVectorIndex
+    index_options = {"n_lists": main.IVF_N_LISTS or None, "nprobe": main.IVF_NPROBE} if main.LOCAL_INDEX_TYPE == "ivf" else None
+    index = build_local_index(
+        catalog_path,
+        encode_fn=lambda texts, batch_size: model.encode(texts, batch_size=batch_size, convert_to_numpy=True),
+        text_fn=main.get_embedding_text,
+        model_name=model.model_id,
+        cache_path=index_path,
+        batch_size=main.LOCAL_INDEX_BATCH_SIZE,
+        index_cls=index_cls,
+        index_options=index_options
+    )
+
+    manifest = {
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "embedding_backend": main.EMBEDDING_BACKEND,
+        "model_id": model.model_id,
+        "index_type": main.LOCAL_INDEX_TYPE,
+        "index_version": index.version,
+        "products": len(index),
+        "catalog": os.path.basename(catalog_path)
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    logging.info(f"Snapshot with {len(index)} products written to '{output_dir}' in {time.perf_counter() - start_time:.1f}s.")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the server's startup snapshot")
+    parser.add_argument("--output", default=main.SNAPSHOT_DIR or "snapshot", help="Snapshot directory (default: SNAPSHOT_DIR)")
+    parser.add_argument("--catalog", default=main.PRODUCT_CATALOG_PATH, help="Product catalog JSON")
+    args = parser.parse_args()
+    if not os.path.exists(args.catalog):
+        sys.exit(f"Catalog '{args.catalog}' not found.")
+    build_snapshot(args.output, args.catalog)
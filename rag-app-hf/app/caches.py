@@ -0,0 +1,300 @@
+import os
+import copy
+import re
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+
+
+# --- Query Embedding Cache ---
+class EmbeddingCache:
+    """Thread-safe LRU cache with a TTL for query embeddings.
+
+    Keys are normalized query text; values are read-only float32 arrays. all-MiniLM-L6-v2 uses
+    an uncased tokenizer, so lowercasing and collapsing whitespace does not change the vector.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_key(text):
+        return " ".join(text.split()).lower()
+
+    def get(self, text):
+        key = self.normalize_key(text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, text, vector):
+        if self.max_entries <= 0:
+            return
+        vector = np.array(vector, dtype=np.float32).ravel()
+        vector.setflags(write=False) # Shared between requests, must not be mutated
+        key = self.normalize_key(text)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, text, encode_fn):
+        """Returns the cached vector for `text`, calling `encode_fn(text)` only on a miss."""
+        vector = self.get(text)
+        if vector is None:
+            vector = np.asarray(encode_fn(text), dtype=np.float32)
+            self.put(text, vector)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# --- Persistent Query Expansion Cache ---
+# Sentence punctuation carries no meaning for expansion; '+', '#', '.', '/' and '-' are kept
+# because they distinguish skills such as "C++", "C#", ".NET" and "CI/CD".
+_EXPANSION_PUNCTUATION_RE = re.compile(r"[!?,;:\"'`()\[\]{}<>]+")
+
+
+class ExpansionCache:
+    """SQLite-backed LRU cache with a max-age for LLM query expansions.
+
+    The database is a local file opened in WAL mode, so it survives restarts and can be shared
+    by several gunicorn workers. Each thread (and each forked worker) gets its own connection.
+    """
+
+    # last_access is only rewritten when older than this, keeping most hits read-only
+    TOUCH_INTERVAL_SECONDS = 60
+
+    def __init__(self, path, max_entries=5000, max_age_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS expansions ("
+                " key TEXT PRIMARY KEY, terms TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_expansions_last_access ON expansions (last_access)")
+
+    @staticmethod
+    def canonicalize(query):
+        """Lowercases, drops sentence punctuation and collapses whitespace."""
+        query = _EXPANSION_PUNCTUATION_RE.sub(" ", query.lower())
+        return " ".join(token.rstrip(".") or token for token in query.split())
+
+    def _connection(self):
+        # Connections must not cross a fork (gunicorn --preload), so they are tagged with the pid
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, query):
+        """Returns the cached expansion terms for `query`, or None."""
+        key = self.canonicalize(query)
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT terms, created_at, last_access FROM expansions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(False)
+                return None
+            terms, created_at, last_access = row
+            if now - created_at > self.max_age_seconds:
+                with conn:
+                    conn.execute("DELETE FROM expansions WHERE key = ?", (key,))
+                self._count(False)
+                return None
+            if now - last_access > self.TOUCH_INTERVAL_SECONDS:
+                with conn:
+                    conn.execute("UPDATE expansions SET last_access = ? WHERE key = ?", (now, key))
+            self._count(True)
+            return terms
+        except sqlite3.Error as e:
+            logging.warning(f"Expansion cache lookup failed: {e}")
+            self._count(False)
+            return None
+
+    def put(self, query, terms):
+        if self.max_entries <= 0:
+            return
+        key = self.canonicalize(query)
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO expansions (key, terms, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, terms, now, now)
+                )
+                conn.execute(
+                    "DELETE FROM expansions WHERE key IN ("
+                    " SELECT key FROM expansions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"Expansion cache write failed: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+        try:
+            stats["size"] = self._connection().execute("SELECT COUNT(*) FROM expansions").fetchone()[0]
+        except sqlite3.Error:
+            stats["size"] = None
+        return stats
+
+
+# --- Semantic Response Cache ---
+class SemanticResponseCache:
+    """Caches final recommendation payloads and serves them for near-duplicate queries.
+
+    Query embeddings live in a preallocated float32 matrix so a lookup is one matrix-vector
+    product. Every entry is tagged with the product index version it was answered against;
+    a lookup with a different version clears the cache.
+    """
+
+    def __init__(self, max_entries=2000, similarity_threshold=0.92, ttl_seconds=24 * 3600, recent_hits=100):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._vectors = None # (max_entries, dim) float32, allocated on first put
+        self._payloads = [None] * max_entries
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._used = np.zeros(max_entries, dtype=bool)
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.recent_hit_similarities = deque(maxlen=recent_hits)
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version):
+        # Caller holds the lock
+        if version != self._version:
+            if self._used.any():
+                self.invalidations += 1
+                logging.info(f"Semantic cache invalidated (index version {self._version} -> {version}).")
+            self._used[:] = False
+            self._payloads = [None] * self.max_entries
+            self._version = version
+
+    def lookup(self, query_embedding, version=None):
+        """Returns (payload, similarity) for the closest live entry above the threshold, else (None, best_similarity)."""
+        if self.max_entries <= 0:
+            return None, None
+        query = self._unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            live = self._used & (self._expires_at >= now)
+            if self._vectors is None or not live.any():
+                self.misses += 1
+                return None, None
+            scores = np.where(live, self._vectors @ query, -np.inf)
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.similarity_threshold:
+                self.misses += 1
+                return None, similarity
+            self._last_used[best] = now
+            self.hits += 1
+            self.recent_hit_similarities.append(round(similarity, 4))
+            return copy.deepcopy(self._payloads[best]), similarity
+
+    def put(self, query_embedding, payload, version=None):
+        if self.max_entries <= 0:
+            return
+        query = self._unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(~self._used | (self._expires_at < now))
+            slot = int(free[0]) if free.size else int(np.argmin(self._last_used))
+            self._vectors[slot] = query
+            self._payloads[slot] = copy.deepcopy(payload)
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+            self._used[slot] = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            recent = list(self.recent_hit_similarities)
+            return {
+                "size": int(self._used.sum()),
+                "similarity_threshold": self.similarity_threshold,
+                "index_version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "mean_hit_similarity": round(sum(recent) / len(recent), 4) if recent else None,
+                "recent_hit_similarities": recent
+            }
@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import functools
+import numpy as np
+
+# Selected with EMBEDDING_BACKEND
+BACKENDS = ('torch', 'onnx', 'stub')
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_MODEL_FILE = 'model_quantized.onnx'
+# build_snapshot.py's default output, next to this file in the server's app directory
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot')
+
+
+def configured_onnx_model_dir():
+    """ONNX_MODEL_DIR, defaulting to the snapshot's model directory ($SNAPSHOT_DIR/model).
+
+    The indexer and both servers resolve the directory here, so with the same environment they
+    hash the same file and agree on the model id.
+    """
+    snapshot_dir = os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+    return os.getenv("ONNX_MODEL_DIR", os.path.join(snapshot_dir, 'model') if snapshot_dir else '')
+
+
+def onnx_model_id(model_dir, quantized=True):
+    """Names the ONNX model file by its content hash, so a re-export or a different model gets a new id wherever it is stored."""
+    model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+    model_path = os.path.join(model_dir, model_file)
+    if not os.path.exists(model_path):
+        return f"onnx:{model_file}:missing"
+    stat = os.stat(model_path)
+    return f"onnx:{model_file}:{_file_sha256(model_path, stat.st_size, stat.st_mtime_ns)[:16]}"
+
+
+@functools.lru_cache(maxsize=8)
+def _file_sha256(path, size, mtime_ns):
+    # size and mtime_ns only key the cache, so a rewritten file is hashed again
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def embedding_model_id(backend, model_name, expected_dimension, onnx_model_dir=None, onnx_quantized=True):
+    """The `model_id` load_embedding_backend would give this backend, without loading the model."""
+    if backend == 'onnx':
+        return onnx_model_id(onnx_model_dir or '', onnx_quantized)
+    if backend == 'stub':
+        return f"stub-{expected_dimension}"
+    return model_name
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# --- Embedding Backends ---
+class EmbeddingBackend:
+    """The subset of the SentenceTransformer API the servers and the indexer use.
+
+    `encode` takes a string (returns a 1-D vector) or a list of strings (returns a 2-D matrix),
+    always as float32 numpy arrays. `model_id` identifies the model and inference path, so
+    caches built from one backend are not reused with another.
+    """
+
+    name = None
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+
+    def get_sentence_embedding_dimension(self):
+        raise NotImplementedError
+
+    def _encode_batch(self, texts):
+        raise NotImplementedError
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Similar lengths share a batch, so little of each batch is padding
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        for start in range(0, len(order), max(1, batch_size)):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([texts[i] for i in rows])
+        if normalize_embeddings:
+            embeddings = _normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
+
+
+class TorchEmbeddingBackend(EmbeddingBackend):
+    """The sentence-transformers PyTorch model (the original inference path)."""
+
+    name = 'torch'
+
+    def __init__(self, model_name, model_path=None, device='cpu'):
+        from sentence_transformers import SentenceTransformer
+        # A local copy (e.g. a startup snapshot) is the same model, so it keeps the model name as its id
+        super().__init__(model_name)
+        self.model = SentenceTransformer(model_path or model_name, device=device)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False):
+        embeddings = self.model.encode(
+            sentences, batch_size=batch_size, show_progress_bar=show_progress_bar,
+            convert_to_numpy=True, normalize_embeddings=normalize_embeddings
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    # Multi-process encoding for the indexer, only available on this backend
+    def start_multi_process_pool(self, target_devices=None):
+        return self.model.start_multi_process_pool(target_devices=target_devices)
+
+    def encode_multi_process(self, sentences, pool, batch_size=32):
+        return self.model.encode_multi_process(sentences, pool, batch_size=batch_size)
+
+    def stop_multi_process_pool(self, pool):
+        self.model.stop_multi_process_pool(pool)
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """ONNX Runtime inference of a model exported by `export_onnx_model`.
+
+    Reads the tokenizer, max sequence length, pooling mode and normalization from the exported
+    sentence-transformers directory, so the output matches the PyTorch model (up to int8
+    rounding when `quantized`). Needs `onnxruntime` and `tokenizers`, but not torch.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_dir, quantized=True, num_threads=0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model '{model_path}' not found. Export it with: python embedding_backends.py export --output {model_dir}")
+        super().__init__(onnx_model_id(model_dir, quantized))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+        config = self._read_json(os.path.join(model_dir, 'sentence_bert_config.json'))
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=int(config.get('max_seq_length', 256)))
+        padding = self.tokenizer.padding or {}
+        # Pad to the longest text in the batch, whatever strategy the tokenizer was saved with
+        self.tokenizer.enable_padding(pad_id=padding.get('pad_id', 0), pad_token=padding.get('pad_token', '[PAD]'))
+
+        modules = self._read_json(os.path.join(model_dir, 'modules.json')) or []
+        pooling_dir = next((module['path'] for module in modules if module.get('type', '').endswith('.Pooling')), '1_Pooling')
+        pooling = self._read_json(os.path.join(model_dir, pooling_dir, 'config.json'))
+        self.cls_pooling = bool(pooling.get('pooling_mode_cls_token')) and not pooling.get('pooling_mode_mean_tokens')
+        self.normalize = any(module.get('type', '').endswith('.Normalize') for module in modules)
+        # Also a warm-up run, so the first real query does not pay for session initialization
+        self._dimension = int(self._encode_batch(["dimension check"]).shape[1])
+
+    @staticmethod
+    def _read_json(path):
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get_sentence_embedding_dimension(self):
+        return self._dimension
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        feed = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            'attention_mask': np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        token_embeddings = self.session.run(None, {name: value for name, value in feed.items() if name in self._input_names})[0]
+        if self.cls_pooling:
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = feed['attention_mask'][:, :, None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        embeddings = embeddings.astype(np.float32)
+        return _normalize_rows(embeddings) if self.normalize else embeddings
+
+
+class StubEmbeddingBackend(EmbeddingBackend):
+    """Deterministic, dependency-free embeddings for tests and dry runs.
+
+    Each lowercased word is hashed (SHA-1, so results do not vary between processes) to a
+    signed position; the vector is the L2-normalized sum. Texts sharing words are similar,
+    which is enough to exercise retrieval, caching and batching without loading a model.
+    """
+
+    name = 'stub'
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self, dimension=384):
+        super().__init__(f"stub-{dimension}")
+        self._dimension = dimension
+        self._word_cache = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self._dimension
+
+    def _word_slot(self, word):
+        slot = self._word_cache.get(word)
+        if slot is None:
+            value = int.from_bytes(hashlib.sha1(word.encode('utf-8')).digest()[:8], 'little')
+            slot = self._word_cache[word] = (value % self._dimension, 1.0 if value & (1 << 63) else -1.0)
+        return slot
+
+    def _encode_batch(self, texts):
+        embeddings = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in self._WORD_RE.findall(text.lower()):
+                position, sign = self._word_slot(word)
+                embeddings[row, position] += sign
+        return _normalize_rows(embeddings)
+
+
+def load_embedding_backend(backend, model_name, expected_dimension, onnx_model_dir=None, onnx_quantized=True, onnx_threads=0, model_path=None):
+    """Creates the named backend and checks its dimension against `expected_dimension`.
+
+    `model_path` is a local sentence-transformers directory to load the torch model from
+    instead of downloading `model_name`.
+
+    Raises ValueError for an unknown backend or a dimension mismatch, and ImportError when the
+    backend's optional dependencies are not installed.
+    """
+    if backend == 'torch':
+        model = TorchEmbeddingBackend(model_name, model_path=model_path)
+    elif backend == 'onnx':
+        if not onnx_model_dir:
+            raise ValueError("The onnx embedding backend needs a model directory (ONNX_MODEL_DIR).")
+        model = OnnxEmbeddingBackend(onnx_model_dir, quantized=onnx_quantized, num_threads=onnx_threads)
+    elif backend == 'stub':
+        model = StubEmbeddingBackend(expected_dimension)
+    else:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Expected one of {', '.join(BACKENDS)}.")
+    actual_dimension = model.get_sentence_embedding_dimension()
+    if actual_dimension != expected_dimension:
+        raise ValueError(f"Embedding model dimension mismatch! Expected {expected_dimension}, but got {actual_dimension} ({backend} backend).")
+    logging.info(f"Embedding backend '{backend}' ready ({model.model_id}, dimension {actual_dimension}).")
+    return model
+
+
+# --- ONNX Export ---
+def export_onnx_model(model_name, output_dir, quantize=True, opset=14):
+    """Exports a sentence-transformers model to `output_dir` for OnnxEmbeddingBackend.
+
+    Writes the model's own files (tokenizer, pooling and normalization config), the transformer
+    as `model.onnx` and, with `quantize`, a dynamically quantized int8 `model_quantized.onnx`.
+    Needs torch, sentence-transformers and onnxruntime; the server then only needs onnxruntime.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    model.save(output_dir)
+    transformer = model[0].auto_model.eval()
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+    sample = model.tokenize(["An assessment for a Java developer", "Sales"])
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer), tuple(sample[name] for name in input_names), model_path,
+            input_names=input_names, output_names=['token_embeddings'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in input_names + ['token_embeddings']},
+            opset_version=opset, do_constant_folding=True
+        )
+    logging.info(f"Exported '{model_name}' to '{model_path}'.")
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized_path = os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE)
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        logging.info(f"Wrote dynamically quantized int8 model to '{quantized_path}'.")
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s')
+    parser = argparse.ArgumentParser(description="Embedding backend tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export a sentence-transformers model for the onnx backend")
+    export_parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    export_parser.add_argument("--output", required=True, help="Directory to write the exported model to")
+    export_parser.add_argument("--no-quantize", action="store_true", help="Skip writing the int8 model")
+    args = parser.parse_args()
+    export_onnx_model(args.model, args.output, quantize=not args.no_quantize)
@@ -0,0 +1,13 @@
+# Gunicorn settings for the Space (loaded with `-c gunicorn.conf.py`, before the app is imported).
+import os
+import sys
+
+# With --preload the app is imported in the master and then forked. Initialization threads must
+# not be running at that point (a fork can copy half-finished SDK imports and held import locks
+# into the worker), so loading starts in each worker after the fork instead.
+os.environ["EAGER_INITIALIZATION"] = "false"
+
+
+def post_fork(server, worker):
+    app = server.app.wsgi() # Already imported by the master under --preload
+    sys.modules[app.import_name].start_initialization()
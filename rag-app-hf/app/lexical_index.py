@@ -0,0 +1,124 @@
+import re
+import math
+import logging
+from collections import Counter
+from collections.abc import Sequence
+import numpy as np
+
+# Keeps skill tokens such as "c++", "c#", ".net", "node.js" and "4.5" intact
+_TOKEN_RE = re.compile(r"\.?[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9+#]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can for from has have i in is it of on or our that the this to "
+    "we with who will need want looking test tests assessment assessments".split()
+)
+
+
+def tokenize(text):
+    """Lowercased word tokens with stopwords removed."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def _field_text(value):
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(item) for item in value if item)
+    return str(value) if value else ""
+
+
+# --- Lexical Index ---
+class BM25Index:
+    """In-memory inverted index with BM25 scoring over selected product fields.
+
+    Term frequencies are weighted per field (a product_name hit counts more than a description
+    hit). Postings are numpy arrays, so scoring a query is a few vectorized adds per term.
+    """
+
+    DEFAULT_FIELD_WEIGHTS = {'product_name': 3.0, 'description': 1.0, 'job_roles': 1.5, 'measured_constructs': 1.5}
+
+    def __init__(self, records, field_weights=None, k1=1.2, b=0.75):
+        self.field_weights = field_weights or self.DEFAULT_FIELD_WEIGHTS
+        self.k1 = k1
+        self.b = b
+        # A memory-mapped record sequence is kept as is rather than copied into this worker
+        self.records = records if isinstance(records, Sequence) else list(records)
+        doc_lengths = np.zeros(len(self.records), dtype=np.float32)
+        postings = {}
+        self._doc_terms = []
+        for row, record in enumerate(self.records):
+            counts = Counter()
+            for field, weight in self.field_weights.items():
+                for token in tokenize(_field_text(record.get(field))):
+                    counts[token] += weight
+            doc_lengths[row] = sum(counts.values())
+            self._doc_terms.append(frozenset(counts))
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((row, tf))
+
+        average_length = float(doc_lengths.mean()) if len(self.records) else 0.0
+        # Per-document length normalization of BM25, precomputed once
+        self._length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / (average_length or 1.0))
+        self._postings = {}
+        n_docs = len(self.records)
+        for token, entries in postings.items():
+            rows = np.fromiter((row for row, _ in entries), dtype=np.int32, count=len(entries))
+            tfs = np.fromiter((tf for _, tf in entries), dtype=np.float32, count=len(entries))
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            self._postings[token] = (rows, tfs, idf)
+        logging.info(f"Built BM25 index over {n_docs} products ({len(self._postings)} terms).")
+
+    def __len__(self):
+        return len(self.records)
+
+    def search(self, query, limit, mask=None):
+        """Returns (hits, coverage): up to `limit` record copies with a 'bm25_score' key, best first,
+        and the fraction of distinct query terms that the top hit contains.
+
+        A bool `mask` (row-aligned with the records) restricts the hits to eligible products.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if limit <= 0 or not terms or not self.records:
+            return [], 0.0
+        scores = np.zeros(len(self.records), dtype=np.float32)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            rows, tfs, idf = posting
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self._length_norm[rows])
+        if mask is not None:
+            scores[~mask] = 0
+
+        candidate_rows = np.flatnonzero(scores > 0)
+        if candidate_rows.size > limit:
+            part = np.argpartition(scores[candidate_rows], -limit)[-limit:]
+            candidate_rows = candidate_rows[part]
+        ordered = candidate_rows[np.argsort(-scores[candidate_rows], kind='stable')]
+        if not ordered.size:
+            return [], 0.0
+        top_terms = self._doc_terms[ordered[0]]
+        coverage = sum(1 for term in terms if term in top_terms) / len(terms)
+        return [dict(self.records[row], bm25_score=float(scores[row])) for row in ordered], coverage
+
+
+# --- Rank Fusion ---
+def reciprocal_rank_fusion(ranked_lists, k=60, limit=None):
+    """Fuses ranked lists of product dicts by reciprocal rank: score = sum(1 / (k + rank)).
+
+    The first dict seen for a product_id is kept, so pass the vector list first to keep its
+    'similarity' values. Returns the fused list, best first, with an added 'fusion_score'.
+    """
+    fused = {}
+    for matches in ranked_lists:
+        for rank, match in enumerate(matches or [], start=1):
+            product_id = match.get('product_id') if isinstance(match, dict) else None
+            if not product_id:
+                continue
+            entry = fused.get(product_id)
+            if entry is None:
+                fused[product_id] = entry = [dict(match), 0.0]
+            entry[1] += 1.0 / (k + rank)
+    ordered = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+    results = []
+    for match, score in ordered[:limit]:
+        match['fusion_score'] = round(score, 6)
+        results.append(match)
+    return results
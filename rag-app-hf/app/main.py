@@ -1,10 +1,21 @@
 import os
 import time
+PROCESS_START_TIME = time.time() # Reference point for the startup timings reported by /health
 import json
 import logging
 import threading
-from flask import Flask, request, jsonify, Response
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import numpy as np
+from flask import Flask, request, jsonify, Response, stream_with_context
 from dotenv import load_dotenv
+from caches import EmbeddingCache, ExpansionCache, SemanticResponseCache
+from micro_batching import MicroBatchEncoder
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from metadata_index import MetadataIndex, parse_filters, record_matches_filters
+from embedding_backends import load_embedding_backend, embedding_model_id, configured_onnx_model_dir, DEFAULT_SNAPSHOT_DIR
+from vector_index import build_local_index, load_catalog, LocalVectorIndex, RECORD_FIELDS
+from ann_index import IVFVectorIndex
 
 # --- Set cache environment variables BEFORE importing model libraries ---
 os.environ['HF_HOME'] = '/tmp/.cache'
@@ -19,21 +30,21 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Now import model-related libraries AFTER setting environment variables
-try:
-    from supabase import create_client, Client
-    from sentence_transformers import SentenceTransformer
-    import google.generativeai as genai
-except ImportError as e:
-    logging.critical(f"Failed to import required libraries: {e}. Ensure dependencies are installed.")
-    # Exit or handle gracefully if essential libraries are missing
-    # For now, we'll let the initialization fail later, but logging it here is crucial.
-    pass
+# The Supabase and Gemini SDKs (and torch, inside the embedding backend) are imported during
+# initialization, in parallel, instead of here: importing them serially dominated cold start.
+genai = None # google.generativeai, set once the Gemini client is initialized
 
 
 # --- Configuration ---
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 EXPECTED_EMBEDDING_DIMENSION = 384
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower() # "torch" (sentence-transformers), "onnx" (ONNX Runtime) or "stub" (tests only)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR) # Written by build_snapshot.py; empty string disables it
+SNAPSHOT_MODEL_DIR = os.path.join(SNAPSHOT_DIR, 'model') if SNAPSHOT_DIR else ''
+SNAPSHOT_INDEX_PATH = os.path.join(SNAPSHOT_DIR, 'product_index.npz') if SNAPSHOT_DIR else ''
+ONNX_MODEL_DIR = configured_onnx_model_dir()
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() in ("1", "true", "yes") # Use the dynamically quantized int8 export
+ONNX_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", 0)) # 0 = ONNX Runtime default (all cores)
 DB_RETRIEVAL_COUNT = 6      # Fetch top 6 candidates from Supabase
 MAX_FINAL_RECOMMENDATIONS = 3 # Ask LLM to return at most 3
 DB_MATCH_THRESHOLD = 0.4 # Keep threshold relatively inclusive for retrieval
@@ -42,14 +53,62 @@ MAX_QUERY_RETRIES = 2
 RETRY_QUERY_DELAY = 3
 GEMINI_QUERY_EXPANSION_TEMP = 0.6
 GEMINI_JSON_GENERATION_TEMP = 0.1 # Keep low for structured JSON
+LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", 800)) # Estimated tokens for all candidates in the generation prompt; descriptions are trimmed to fit. 0 = no limit
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "local").lower() # "local" (in-process index, Supabase fallback) or "supabase"
+PRODUCT_CATALOG_PATH = os.getenv("PRODUCT_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'merged_shl_product_data.json'))
+LOCAL_INDEX_CACHE_PATH = os.getenv("LOCAL_INDEX_CACHE_PATH", "/tmp/.cache/shl_product_index.npz")
+LOCAL_INDEX_BATCH_SIZE = 64
+LOCAL_INDEX_STORAGE = os.getenv("LOCAL_INDEX_STORAGE", "float32").lower() # "float32", "float16" or "int8" (coarse scan + exact float32 re-rank): less memory, slower scans (float16 much slower)
+LOCAL_INDEX_RERANK_FACTOR = int(os.getenv("LOCAL_INDEX_RERANK_FACTOR", 4)) # Quantized storage re-ranks DB_RETRIEVAL_COUNT * this candidates
+LOCAL_INDEX_MMAP = os.getenv("LOCAL_INDEX_MMAP", "true").lower() in ("1", "true", "yes") # Memory-map the matrix, ids and records so gunicorn workers share them
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "exact").lower() # "exact" (brute force) or "ivf" (approximate, for large catalogs)
+IVF_N_LISTS = int(os.getenv("IVF_N_LISTS", 0)) # 0 = about sqrt(number of products)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16)) # Lists scanned per query; higher = better recall, slower
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1024)) # 0 disables the cache
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 6 * 3600))
+EMBEDDING_MICRO_BATCHING = os.getenv("EMBEDDING_MICRO_BATCHING", "true").lower() in ("1", "true", "yes") # Merge concurrent query encodes into one forward pass
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 16))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5)) # Only spent when other encodes are already queued
+EXPANSION_CACHE_PATH = os.getenv("EXPANSION_CACHE_PATH", "/tmp/.cache/query_expansion_cache.sqlite3") # Empty string disables the cache
+EXPANSION_CACHE_MAX_ENTRIES = int(os.getenv("EXPANSION_CACHE_MAX_ENTRIES", 5000))
+EXPANSION_CACHE_MAX_AGE_SECONDS = int(os.getenv("EXPANSION_CACHE_MAX_AGE_SECONDS", 7 * 24 * 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2000)) # 0 disables the cache
+SEMANTIC_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_SIMILARITY_THRESHOLD", 0.95)) # Cosine similarity between original queries
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 24 * 3600))
+BATCH_MAX_QUERIES = 32 # Upper bound on queries accepted by /recommend/batch
+BATCH_MAX_CONCURRENCY = 8 # Concurrent Gemini/Supabase calls per batch
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() in ("1", "true", "yes") # Retrieve on the raw query while expansion runs
+EXPANSION_LATENCY_BUDGET_SECONDS = float(os.getenv("EXPANSION_LATENCY_BUDGET_SECONDS", 2.5)) # Speculative mode only: stop waiting for expansion after this
+SPECULATIVE_MAX_WORKERS = 8
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes") # Fuse BM25 candidates with vector candidates
+RRF_K = 60 # Reciprocal-rank fusion constant
+LEXICAL_SKIP_EXPANSION = os.getenv("LEXICAL_SKIP_EXPANSION", "false").lower() in ("1", "true", "yes") # Skip Gemini expansion when BM25 is confident
+LEXICAL_CONFIDENCE_MARGIN = float(os.getenv("LEXICAL_CONFIDENCE_MARGIN", 1.5)) # Top BM25 score must beat the runner-up by this factor
+SUPABASE_FILTER_OVERFETCH = 5 # Filtered queries on the Supabase RPC fetch this many times DB_RETRIEVAL_COUNT, then post-filter
+EAGER_INITIALIZATION = os.getenv("EAGER_INITIALIZATION", "true").lower() in ("1", "true", "yes") # Start initializing at import instead of on the first request
+STARTUP_WORKERS = int(os.getenv("STARTUP_WORKERS", 4)) # Components initialized in parallel; 1 = serially
+WARM_UP_QUERY = "Java developer who can collaborate with business teams" # Run through the model and indexes before readiness flips
 
 # --- Initialize Clients (Global Scope) ---
 supabase_client = None
 embed_model = None
 gen_model = None
+product_index = None # LocalVectorIndex, only built when RETRIEVAL_BACKEND == "local"
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_TTL_SECONDS)
+query_encoder = None # MicroBatchEncoder around embed_model, when EMBEDDING_MICRO_BATCHING is on
+expansion_cache = None # ExpansionCache, shared on disk between workers
+speculation_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_MAX_WORKERS, thread_name_prefix="expansion") if SPECULATIVE_RETRIEVAL else None
+bm25_index = None # BM25Index over the catalog, only built when HYBRID_RETRIEVAL is on
+metadata_index = None # MetadataIndex row-aligned with product_index / bm25_index, for request filters
+lexical_stats = {"queries": 0, "confident": 0, "expansions_skipped": 0}
+lexical_stats_lock = threading.Lock()
+semantic_cache = SemanticResponseCache(SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_SIMILARITY_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS) if SEMANTIC_CACHE_MAX_ENTRIES > 0 else None
 initialization_error_message = None
 initialization_complete = False
 initialization_thread = None
+startup_phases = {} # Phase name -> seconds, filled in by async_initialize
+startup_milestones = {"ready_after_seconds": None, "first_success_after_seconds": None} # Seconds since PROCESS_START_TIME
+startup_lock = threading.Lock()
 
 # --- Flask App Definition ---
 app = Flask(__name__)
@@ -75,45 +134,216 @@ def pretty_json_response(data, status_code=200):
     )
     return response
 
-# --- Async Initialization Function ---
-def async_initialize():
-    global supabase_client, embed_model, gen_model, initialization_error_message, initialization_complete
+# --- Startup Profiling ---
+@contextmanager
+def startup_phase(name):
+    """Times one initialization phase into startup_phases (phases may run in parallel)."""
+    start_time = time.perf_counter()
     try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        with startup_lock:
+            startup_phases[name] = round(elapsed, 3)
+        logging.info(f"Startup phase '{name}' took {elapsed:.2f}s.")
+
+
+def record_first_success():
+    """Logs, once, how long after process start the first recommendation succeeded."""
+    with startup_lock:
+        if startup_milestones["first_success_after_seconds"] is not None:
+            return
+        startup_milestones["first_success_after_seconds"] = round(time.time() - PROCESS_START_TIME, 3)
+    logging.info(f"First successful recommendation {startup_milestones['first_success_after_seconds']:.2f}s after process start.")
+
+
+def startup_stats():
+    with startup_lock:
+        return dict(startup_milestones, phases=dict(startup_phases), workers=STARTUP_WORKERS, snapshot_dir=SNAPSHOT_DIR or None)
+
+
+# --- Component Initializers (run in parallel by async_initialize) ---
+def init_supabase_client():
+    with startup_phase("supabase_client"):
         logging.info("Initializing Supabase client...")
         if not SUPABASE_URL or not SUPABASE_KEY:
             raise ValueError("Supabase URL/Key missing in environment variables.")
-        supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        from supabase import create_client
+        client = create_client(SUPABASE_URL, SUPABASE_KEY)
         logging.info("Supabase client initialized.")
-
-        logging.info(f"Loading embedding model '{EMBEDDING_MODEL_NAME}'...")
-        embed_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        actual_dimension = embed_model.get_sentence_embedding_dimension()
-        if actual_dimension != EXPECTED_EMBEDDING_DIMENSION:
-            raise ValueError(f"Embedding model dimension mismatch! Expected {EXPECTED_EMBEDDING_DIMENSION}, but got {actual_dimension}.")
+        return client
+
+
+def init_embedding_model():
+    with startup_phase("embedding_model"):
+        # A snapshot copy of the model avoids the Hugging Face download on a fresh container
+        model_path = SNAPSHOT_MODEL_DIR if SNAPSHOT_MODEL_DIR and os.path.exists(os.path.join(SNAPSHOT_MODEL_DIR, 'modules.json')) else None
+        logging.info(f"Loading embedding model '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend" + (f" from snapshot '{model_path}')..." if model_path else ")..."))
+        model = load_embedding_backend(
+            EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EXPECTED_EMBEDDING_DIMENSION,
+            onnx_model_dir=ONNX_MODEL_DIR, onnx_quantized=ONNX_QUANTIZED, onnx_threads=ONNX_NUM_THREADS,
+            model_path=model_path
+        )
         logging.info(f"Embedding model loaded.")
+        return model
+
 
+def init_gemini_model():
+    global genai
+    with startup_phase("gemini_client"):
         logging.info("Initializing Gemini client...")
         if not GEMINI_API_KEY:
             raise ValueError("Gemini API Key missing in environment variables.")
-        genai.configure(api_key=GEMINI_API_KEY)
+        import google.generativeai as genai_module
+        genai_module.configure(api_key=GEMINI_API_KEY)
+        genai = genai_module
         # It's good practice to specify the model generation configuration here if needed
-        gen_model = genai.GenerativeModel(
+        model = genai.GenerativeModel(
              model_name='gemini-1.5-flash', # Using gemini-1.5-flash as 2.0 isn't a standard public name yet
              # generation_config=genai.types.GenerationConfig(...) # Can be set here or per-call
              # safety_settings=... # Consider configuring safety settings
         )
-
         logging.info("Gemini client initialized.")
+        return model
+
+
+def init_local_index(model_future):
+    """Loads or builds the local vector index. Not fatal: returns None and retrieval falls back to Supabase.
+
+    The model is only waited for if the index has to be (re)embedded, so loading a cached or
+    snapshot index overlaps with loading the model.
+    """
+    with startup_phase("local_index"):
+        try:
+            index_cls = IVFVectorIndex if LOCAL_INDEX_TYPE == "ivf" else LocalVectorIndex
+            index_options = {"n_lists": IVF_N_LISTS or None, "nprobe": IVF_NPROBE} if LOCAL_INDEX_TYPE == "ivf" else None
+            use_snapshot = bool(SNAPSHOT_INDEX_PATH) and os.path.exists(SNAPSHOT_INDEX_PATH)
+            if use_snapshot and not os.path.exists(PRODUCT_CATALOG_PATH):
+                # The snapshot carries the product records, so the raw catalog is not needed to serve
+                logging.info(f"Catalog '{PRODUCT_CATALOG_PATH}' not found; serving the snapshot index as is.")
+                index = index_cls.load(SNAPSHOT_INDEX_PATH, storage=LOCAL_INDEX_STORAGE, rerank_factor=LOCAL_INDEX_RERANK_FACTOR, mmap=LOCAL_INDEX_MMAP, **(index_options or {}))
+            else:
+                logging.info(f"Building local vector index from '{PRODUCT_CATALOG_PATH}'...")
+                index = build_local_index(
+                    PRODUCT_CATALOG_PATH,
+                    encode_fn=lambda texts, batch_size: model_future.result().encode(texts, batch_size=batch_size, convert_to_numpy=True),
+                    text_fn=get_embedding_text,
+                    model_name=embedding_model_id(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EXPECTED_EMBEDDING_DIMENSION, ONNX_MODEL_DIR, ONNX_QUANTIZED),
+                    cache_path=SNAPSHOT_INDEX_PATH if use_snapshot else LOCAL_INDEX_CACHE_PATH,
+                    batch_size=LOCAL_INDEX_BATCH_SIZE,
+                    storage=LOCAL_INDEX_STORAGE,
+                    rerank_factor=LOCAL_INDEX_RERANK_FACTOR,
+                    index_cls=index_cls,
+                    index_options=index_options,
+                    mmap=LOCAL_INDEX_MMAP
+                )
+            if index.dimension != EXPECTED_EMBEDDING_DIMENSION:
+                raise ValueError(f"Local index dimension {index.dimension} != expected {EXPECTED_EMBEDDING_DIMENSION}.")
+            logging.info(f"Local vector index ready with {len(index)} products ({index.memory_bytes()}).")
+            return index
+        except Exception as e:
+            logging.error(f"Failed to build local vector index, falling back to Supabase retrieval: {e}", exc_info=True)
+            return None
+
+
+def init_expansion_cache():
+    """Opens the query expansion cache. Not fatal: without it every query is expanded by Gemini."""
+    with startup_phase("expansion_cache"):
+        try:
+            cache = ExpansionCache(EXPANSION_CACHE_PATH, EXPANSION_CACHE_MAX_ENTRIES, EXPANSION_CACHE_MAX_AGE_SECONDS)
+            logging.info(f"Query expansion cache opened at '{EXPANSION_CACHE_PATH}'.")
+            return cache
+        except Exception as e:
+            logging.error(f"Failed to open query expansion cache: {e}", exc_info=True)
+            return None
+
+
+def warm_up():
+    """Runs one query through the model and the indexes so the first request does not pay for
+    lazy allocations and first-call overheads."""
+    with startup_phase("warm_up"):
+        # Through the micro-batching encoder when it is on, the same path requests take
+        if query_encoder is not None:
+            vector = query_encoder.encode(WARM_UP_QUERY)
+            query_encoder.encode_many([WARM_UP_QUERY, "Sales graduate"])
+        else:
+            vector = np.asarray(embed_model.encode(WARM_UP_QUERY), dtype=np.float32)
+            embed_model.encode([WARM_UP_QUERY, "Sales graduate"], batch_size=2, convert_to_numpy=True)
+        if product_index is not None:
+            product_index.search(vector, DB_MATCH_THRESHOLD, DB_RETRIEVAL_COUNT)
+        if bm25_index is not None:
+            bm25_index.search(WARM_UP_QUERY, DB_RETRIEVAL_COUNT)
+
+
+# --- Async Initialization Function ---
+def async_initialize():
+    global supabase_client, embed_model, query_encoder, gen_model, product_index, bm25_index, metadata_index, expansion_cache, initialization_error_message, initialization_complete
+    try:
+        with startup_phase("total"):
+            # Independent components load in parallel; the slowest one sets the startup time
+            with ThreadPoolExecutor(max_workers=max(1, STARTUP_WORKERS), thread_name_prefix="startup") as executor:
+                supabase_future = executor.submit(init_supabase_client)
+                model_future = executor.submit(init_embedding_model)
+                index_future = executor.submit(init_local_index, model_future) if RETRIEVAL_BACKEND == "local" else None
+                gemini_future = executor.submit(init_gemini_model)
+                expansion_future = executor.submit(init_expansion_cache) if EXPANSION_CACHE_PATH else None
+
+                supabase_client = supabase_future.result()
+                embed_model = model_future.result()
+                gen_model = gemini_future.result()
+                product_index = index_future.result() if index_future is not None else None
+                expansion_cache = expansion_future.result() if expansion_future is not None else None
+
+            if EMBEDDING_MICRO_BATCHING:
+                query_encoder = MicroBatchEncoder(
+                    lambda texts: embed_model.encode(texts, batch_size=len(texts), convert_to_numpy=True),
+                    max_batch_size=EMBEDDING_BATCH_MAX_SIZE, max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS
+                )
+
+            with startup_phase("lexical_and_metadata_indexes"):
+                # The BM25 and metadata indexes share the local index's rows (or the raw catalog without one)
+                catalog_records = None
+                if product_index is not None:
+                    catalog_records = product_index.records
+                elif HYBRID_RETRIEVAL:
+                    try:
+                        catalog_records = [{field: product.get(field) for field in RECORD_FIELDS} for product in load_catalog(PRODUCT_CATALOG_PATH)]
+                    except Exception as e:
+                        logging.error(f"Failed to load catalog for the BM25 index, continuing with vector-only retrieval: {e}", exc_info=True)
+
+                if catalog_records is not None and HYBRID_RETRIEVAL:
+                    # Not fatal: retrieval is vector-only without the lexical index
+                    try:
+                        bm25_index = BM25Index(catalog_records)
+                    except Exception as e:
+                        logging.error(f"Failed to build BM25 index, continuing with vector-only retrieval: {e}", exc_info=True)
+                        bm25_index = None
+
+                if catalog_records is not None:
+                    # Not fatal: filters fall back to a per-record predicate
+                    try:
+                        metadata_index = MetadataIndex(catalog_records)
+                    except Exception as e:
+                        logging.error(f"Failed to build metadata index: {e}", exc_info=True)
+                        metadata_index = None
+
+            warm_up()
 
         initialization_complete = True
-        logging.info("Initialization completed successfully")
+        with startup_lock:
+            startup_milestones["ready_after_seconds"] = round(time.time() - PROCESS_START_TIME, 3)
+        logging.info(f"Initialization completed successfully ({startup_milestones['ready_after_seconds']:.2f}s after process start; phases: {startup_phases})")
     except Exception as e:
         logging.critical(f"CRITICAL ERROR DURING INITIALIZATION: {e}", exc_info=True)
         initialization_error_message = f"Server initialization failed: {e}"
         # Ensure components are None if initialization failed
         supabase_client = None
         embed_model = None
+        query_encoder = None
         gen_model = None
+        product_index = None
+        bm25_index = None
+        metadata_index = None
         initialization_complete = False # Explicitly set to false on error
 
 # --- Start initialization in background thread ---
@@ -154,6 +384,13 @@ def expand_query_with_llm(original_query: str) -> str:
         logging.error("Gemini client not available for query expansion.")
         return original_query
 
+    if expansion_cache is not None:
+        cached_terms = expansion_cache.get(original_query)
+        if cached_terms:
+            combined_query = f"{original_query} | Relevant concepts: {cached_terms}"
+            logging.info(f"Expanded query (cached) for search: '{combined_query}'")
+            return combined_query
+
     prompt = f"""Analyze the following user query about SHL assessments. Identify the core concepts, skills, or job roles mentioned. Generate a list of related keywords or synonyms that would be useful for searching a database of assessment product descriptions. Output ONLY the keywords, separated by commas. User Query: "{original_query}" Keywords only, comma-separated:"""
     try:
         logging.info(f"Expanding query: '{original_query}'")
@@ -166,6 +403,8 @@ def expand_query_with_llm(original_query: str) -> str:
         if response.parts:
             expanded_terms = response.text.strip()
             if expanded_terms: # Ensure terms are not empty
+                if expansion_cache is not None:
+                    expansion_cache.put(original_query, expanded_terms)
                 combined_query = f"{original_query} | Relevant concepts: {expanded_terms}"
                 logging.info(f"Expanded query for search: '{combined_query}'")
                 return combined_query
@@ -183,9 +422,234 @@ def expand_query_with_llm(original_query: str) -> str:
         logging.error(f"Error during query expansion API call: {e}", exc_info=True)
         return original_query
 
-# --- RAG Core Function ---
-def get_product_recommendation_backend_robust(original_query: str):
-    """Performs the enhanced RAG process: Expand -> Retrieve -> Select -> Generate JSON. Returns (dict, status_code)"""
+# --- Query Embedding ---
+def embed_query(text):
+    """Embeds a query as a float32 vector, skipping the model forward pass on a cache hit.
+
+    Cache misses from concurrent requests share batched forward passes through query_encoder.
+    """
+    return embedding_cache.get_or_compute(text, query_encoder.encode if query_encoder is not None else embed_model.encode)
+
+
+def embed_queries(texts):
+    """Embeds several queries as a (len(texts), dim) float32 matrix with one batched encode call for the cache misses.
+
+    With micro-batching on, the misses go through query_encoder, so they share forward passes
+    with concurrent single-query requests instead of running beside them.
+    """
+    vectors = [embedding_cache.get(text) for text in texts]
+    missing = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(embedding_cache.normalize_key(texts[i]), []).append(i)
+    if missing:
+        positions = list(missing.values())
+        unique_texts = [texts[group[0]] for group in positions]
+        if query_encoder is not None:
+            encoded = query_encoder.encode_many(unique_texts)
+        else:
+            encoded = embed_model.encode(unique_texts, batch_size=len(unique_texts), convert_to_numpy=True)
+        for group, vector in zip(positions, encoded):
+            embedding_cache.put(texts[group[0]], vector)
+            for i in group:
+                vectors[i] = vector
+    return np.vstack([np.asarray(vector, dtype=np.float32) for vector in vectors])
+
+
+def current_index_version():
+    """Version of the product data answers are computed against; cached responses are keyed on it."""
+    if product_index is not None:
+        return product_index.version
+    return f"supabase:{embed_model.model_id if embed_model is not None else EMBEDDING_MODEL_NAME}"
+
+
+# --- Retrieval Functions ---
+def search_supabase(query_embedding, filters=None):
+    """Calls the Supabase match_products RPC with retries. Returns (matches, error); error is None on success.
+
+    The RPC cannot filter on metadata, so filtered queries over-fetch and drop ineligible products.
+    """
+    if hasattr(query_embedding, 'tolist'):
+        query_embedding = query_embedding.tolist()
+    match_count = DB_RETRIEVAL_COUNT * SUPABASE_FILTER_OVERFETCH if filters else DB_RETRIEVAL_COUNT
+    last_db_error = None
+    for attempt in range(MAX_QUERY_RETRIES):
+        try:
+            # Ensure supabase_client is valid before calling rpc
+            if not supabase_client:
+                 raise ConnectionError("Supabase client is not initialized.")
+
+            response = supabase_client.rpc(
+                DB_FUNCTION_NAME,
+                {
+                    'query_embedding': query_embedding,
+                    'match_threshold': DB_MATCH_THRESHOLD,
+                    'match_count': match_count
+                }
+            ).execute()
+
+            # Check response structure (depends on Supabase client version)
+            if hasattr(response, 'data') and response.data is not None:
+                matches = response.data
+            elif isinstance(response, list): # Handle cases where it might return a list directly
+                 matches = response
+            else:
+                 # Log unexpected response structure
+                 logging.warning(f"Supabase RPC returned unexpected response structure: {type(response)}, Content: {response}")
+                 matches = [] # Assume no matches if structure is wrong
+
+            if filters:
+                matches = [match for match in matches if isinstance(match, dict) and record_matches_filters(match, filters)][:DB_RETRIEVAL_COUNT]
+
+            logging.info(f"Initial retrieval found {len(matches)} candidates (Attempt {attempt + 1}).")
+            return matches, None
+        except Exception as e:
+            last_db_error = e
+            logging.error(f"Supabase RPC error (Attempt {attempt + 1}/{MAX_QUERY_RETRIES}): {e}", exc_info=True)
+            if attempt < MAX_QUERY_RETRIES - 1:
+                logging.info(f"Retrying Supabase query in {RETRY_QUERY_DELAY} seconds...")
+                time.sleep(RETRY_QUERY_DELAY)
+            else:
+                logging.error("Supabase search failed after all retries.")
+    return [], last_db_error
+
+
+def filter_mask(filters):
+    """Bool mask of catalog rows eligible under `filters` (row-aligned with product_index and bm25_index), or None."""
+    if not filters:
+        return None
+    if metadata_index is not None:
+        return metadata_index.mask(filters)
+    records = product_index.records if product_index is not None else bm25_index.records
+    return np.array([record_matches_filters(record, filters) for record in records], dtype=bool)
+
+
+def retrieve_candidates(query_embedding, filters=None):
+    """Retrieves the top DB_RETRIEVAL_COUNT products above DB_MATCH_THRESHOLD. Returns (matches, error).
+
+    Uses the in-process index when available and falls back to the Supabase RPC otherwise.
+    With `filters`, only eligible products are scored.
+    """
+    if product_index is not None:
+        try:
+            start_time = time.perf_counter()
+            mask = filter_mask(filters)
+            matches = product_index.search(query_embedding, DB_MATCH_THRESHOLD, DB_RETRIEVAL_COUNT, mask)
+            elapsed_us = (time.perf_counter() - start_time) * 1e6
+            eligible = f" over {int(mask.sum())} eligible products" if mask is not None else ""
+            logging.info(f"Local index retrieval found {len(matches)} candidates{eligible} in {elapsed_us:.0f}us.")
+            return matches, None
+        except Exception as e:
+            logging.error(f"Local index search failed, falling back to Supabase: {e}", exc_info=True)
+    return search_supabase(query_embedding, filters)
+
+
+def retrieve_candidates_batch(query_matrix):
+    """Batch variant of retrieve_candidates; one matrix product on the local index. Returns a list of (matches, error)."""
+    if product_index is not None:
+        try:
+            start_time = time.perf_counter()
+            all_matches = product_index.search_batch(query_matrix, DB_MATCH_THRESHOLD, DB_RETRIEVAL_COUNT)
+            elapsed_us = (time.perf_counter() - start_time) * 1e6
+            logging.info(f"Local index batch retrieval for {len(all_matches)} queries took {elapsed_us:.0f}us.")
+            return [(matches, None) for matches in all_matches]
+        except Exception as e:
+            logging.error(f"Local index batch search failed, falling back to Supabase: {e}", exc_info=True)
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_MAX_CONCURRENCY, len(query_matrix)))) as executor:
+        return list(executor.map(search_supabase, query_matrix))
+
+
+# --- Lexical Retrieval ---
+def lexical_search(original_query, filters=None):
+    """BM25 candidates for the raw query. Returns (hits, confident).
+
+    `confident` means the top hit contains every query term and its score beats the runner-up
+    by LEXICAL_CONFIDENCE_MARGIN, i.e. the query names a product or skill outright.
+    """
+    if bm25_index is None:
+        return [], False
+    try:
+        hits, coverage = bm25_index.search(original_query, DB_RETRIEVAL_COUNT, filter_mask(filters))
+    except Exception as e:
+        logging.error(f"BM25 search failed, continuing with vector-only retrieval: {e}", exc_info=True)
+        return [], False
+    confident = bool(hits) and coverage >= 1.0 and (
+        len(hits) == 1 or hits[0]['bm25_score'] >= LEXICAL_CONFIDENCE_MARGIN * hits[1]['bm25_score']
+    )
+    with lexical_stats_lock:
+        lexical_stats["queries"] += 1
+        lexical_stats["confident"] += int(confident)
+    if hits:
+        logging.info(f"Lexical retrieval found {len(hits)} candidates (top '{hits[0].get('product_name')}', coverage {coverage:.2f}, confident={confident}).")
+    return hits, confident
+
+
+def expand_query_for_retrieval(original_query, lexical_confident=False):
+    """expand_query_with_llm, skipped when LEXICAL_SKIP_EXPANSION is on and BM25 is confident."""
+    if lexical_confident and LEXICAL_SKIP_EXPANSION:
+        with lexical_stats_lock:
+            lexical_stats["expansions_skipped"] += 1
+        logging.info(f"Skipping query expansion: lexical match is confident for '{original_query[:100]}'.")
+        return original_query
+    return expand_query_with_llm(original_query)
+
+
+def score_lexical_hits(lexical_hits, query_embeddings, vector_matches=None):
+    """Gives BM25 hits the vector candidates don't have a 'similarity' and applies DB_MATCH_THRESHOLD to them.
+
+    The similarity is the best cosine against `query_embeddings` (the raw and/or expanded query),
+    read from the product's row in the local index. Without one (Supabase backend) the product
+    texts are embedded instead. Hits that fail the threshold are dropped, like vector candidates.
+    """
+    vector_ids = {match.get('product_id') for match in vector_matches or [] if isinstance(match, dict)}
+    lexical_only = [hit for hit in lexical_hits if hit.get('product_id') not in vector_ids]
+    if not lexical_only:
+        return lexical_hits
+    try:
+        if product_index is not None:
+            product_ids = [hit['product_id'] for hit in lexical_only]
+            scores = np.max([product_index.similarities(embedding, product_ids) for embedding in query_embeddings], axis=0)
+        else:
+            texts = [get_embedding_text(hit) for hit in lexical_only]
+            product_matrix = np.atleast_2d(np.asarray(embed_model.encode(texts, batch_size=len(texts), convert_to_numpy=True), dtype=np.float32))
+            query_matrix = np.vstack([np.asarray(embedding, dtype=np.float32).ravel() for embedding in query_embeddings])
+            product_matrix /= np.maximum(np.linalg.norm(product_matrix, axis=1, keepdims=True), 1e-12)
+            query_matrix /= np.maximum(np.linalg.norm(query_matrix, axis=1, keepdims=True), 1e-12)
+            scores = (product_matrix @ query_matrix.T).max(axis=1)
+    except Exception as e:
+        logging.error(f"Failed to score lexical candidates, keeping only those the vector search also found: {e}", exc_info=True)
+        return [hit for hit in lexical_hits if hit.get('product_id') in vector_ids]
+
+    similarities = {hit['product_id']: float(score) for hit, score in zip(lexical_only, scores)}
+    kept = []
+    for hit in lexical_hits:
+        similarity = similarities.get(hit.get('product_id'))
+        if hit.get('product_id') in vector_ids:
+            kept.append(hit)
+        elif similarity is not None and similarity > DB_MATCH_THRESHOLD: # NaN (not in the index) fails too
+            kept.append(dict(hit, similarity=similarity))
+    if len(kept) < len(lexical_hits):
+        logging.info(f"Dropped {len(lexical_hits) - len(kept)} lexical candidates below similarity threshold {DB_MATCH_THRESHOLD}.")
+    return kept
+
+
+def fuse_candidates(vector_matches, lexical_hits, query_embeddings):
+    """Reciprocal-rank fusion of vector and BM25 candidates, keeping the top DB_RETRIEVAL_COUNT.
+
+    Every fused candidate carries a 'similarity' that passed DB_MATCH_THRESHOLD (see score_lexical_hits).
+    """
+    if lexical_hits:
+        lexical_hits = score_lexical_hits(lexical_hits, query_embeddings, vector_matches)
+    if not lexical_hits:
+        return vector_matches
+    fused = reciprocal_rank_fusion([vector_matches, lexical_hits], k=RRF_K, limit=DB_RETRIEVAL_COUNT)
+    logging.info(f"Fused {len(vector_matches or [])} vector + {len(lexical_hits)} lexical candidates into {len(fused)}.")
+    return fused
+
+
+# --- RAG Pipeline Helpers ---
+def check_pipeline_ready():
+    """Returns an (error_dict, status_code) tuple if the pipeline cannot serve requests, else None."""
     # Check if initialization is complete or failed
     if not initialization_complete:
         if initialization_error_message:
@@ -199,80 +663,385 @@ def get_product_recommendation_backend_robust(original_query: str):
     if not supabase_client or not embed_model or not gen_model:
          logging.critical("A required client (Supabase, Embed, Gemini) is None despite initialization supposedly complete.")
          return {"error": "Internal server error: Core components missing.", "status": "internal_error"}, 500
+    return None
 
-    if not original_query or not isinstance(original_query, str) or original_query.isspace():
-        logging.warning("Received invalid query.")
-        return {"error": "Query parameter is missing, empty, or not a string.", "status": "bad_request"}, 400
 
-    # Default responses defined once
-    default_error_response = {"error": "An internal error occurred during recommendation generation.", "status": "error"}
-    default_error_code = 500
-    no_match_json_response_dict = {
+def is_valid_query(query):
+    return bool(query) and isinstance(query, str) and not query.isspace()
+
+
+def no_match_response(original_query):
+    return {
         "status": "no_match",
         "message": f"No products found matching the initial criteria for query: '{original_query}'. Try rephrasing or broadening your search.",
         "recommended_assessments": []
     }
 
+
+def build_llm_context(matches):
+    """Turns retrieved matches into the de-duplicated candidate list passed to Gemini."""
+    context_data_for_llm = []
+    seen_product_ids = set() # Avoid duplicates if DB returns them somehow
+    for match in matches:
+        if isinstance(match, dict) and match.get('product_id') not in seen_product_ids:
+            product_id = match.get('product_id') # Get product_id for the JSON output
+            if not product_id:
+                logging.warning(f"Skipping match due to missing 'product_id': {match.get('product_name')}")
+                continue
+
+            context_data_for_llm.append({
+                # Ensure all required fields for the final JSON are present here
+                "product_id": product_id, # Use product_id from the match
+                "url": match.get('url'),
+                "adaptive_irt": match.get('adaptive_irt'), # Keep boolean or source format
+                "description": match.get('description'),
+                "duration_minutes": match.get('duration_minutes'), # Keep number or None
+                "remote_testing": match.get('remote_testing'), # Keep boolean or source format
+                "product_type": match.get('product_type', []),
+                "product_name": match.get('product_name'),
+                # Include similarity score for context, though not required in final JSON
+                "similarity_score": match.get('similarity')
+            })
+            seen_product_ids.add(product_id)
+        else:
+            if not isinstance(match, dict):
+                 logging.warning(f"Skipping unexpected match item format: {type(match)}, Content: {match}")
+            # else: duplicate product_id, already logged if needed
+
+    return context_data_for_llm
+
+
+# Candidate fields the generation prompt maps to output keys; everything else is left out of the prompt
+PROMPT_CONTEXT_FIELDS = ('product_id', 'product_name', 'url', 'adaptive_irt', 'description', 'duration_minutes', 'remote_testing', 'product_type')
+CHARS_PER_TOKEN = 4 # Rough average for English text, used to estimate prompt tokens without a tokenizer call
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts `text` at a word boundary to about `max_tokens` estimated tokens, marking the cut with an ellipsis."""
+    max_chars = max(0, max_tokens) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - 1)].rsplit(' ', 1)[0].rstrip(' ,.;:')
+    return f"{cut}…" if cut else ""
+
+
+def build_prompt_context(context_data_for_llm, token_budget=LLM_CONTEXT_TOKEN_BUDGET):
+    """Serializes the candidates for the generation prompt as compact JSON, one candidate per line.
+
+    Only PROMPT_CONTEXT_FIELDS are kept and null fields are omitted. With a `token_budget`,
+    what is left after the other fields is shared out between the descriptions in candidate
+    order (best match first), weighted towards the top candidates; text a short description
+    does not need is passed on to the ones below it. Returns (text, stats).
+    """
+    candidates = [
+        {field: candidate.get(field) for field in PROMPT_CONTEXT_FIELDS if candidate.get(field) is not None}
+        for candidate in context_data_for_llm
+    ]
+    descriptions = [str(candidate.pop('description', '') or '') for candidate in candidates]
+
+    truncated = 0
+    if token_budget > 0:
+        def description_cost(text): # Escaped text plus the `,"description":` key
+            return estimate_tokens(',"description":' + json.dumps(text, ensure_ascii=False)) if text else 0
+
+        remaining = token_budget - sum(estimate_tokens(json.dumps(candidate, ensure_ascii=False, separators=(',', ':'))) for candidate in candidates)
+        weights = [1.0 / np.sqrt(rank + 1) for rank in range(len(candidates))]
+        for rank, description in enumerate(descriptions):
+            allowance = int(max(0, remaining) * weights[rank] / sum(weights[rank:]))
+            cost = description_cost(description)
+            if cost > allowance:
+                descriptions[rank] = truncate_to_tokens(description, allowance - (cost - estimate_tokens(description)))
+                truncated += 1
+            remaining -= description_cost(descriptions[rank])
+
+    for candidate, description in zip(candidates, descriptions):
+        if description:
+            candidate['description'] = description
+    text = "\n".join(json.dumps(candidate, ensure_ascii=False, separators=(',', ':')) for candidate in candidates)
+    stats = {
+        "candidates": len(candidates),
+        "estimated_tokens": estimate_tokens(text),
+        "descriptions_truncated": truncated
+    }
+    return text, stats
+
+
+def restore_full_descriptions(parsed_json, context_data_for_llm):
+    """Puts each recommended product's full catalog description back in place of the trimmed prompt copy."""
+    descriptions = {candidate.get('product_id'): candidate.get('description') for candidate in context_data_for_llm}
+    for recommendation in parsed_json.get("recommended_assessments") or []:
+        if isinstance(recommendation, dict) and descriptions.get(recommendation.get("product_id")):
+            recommendation["description"] = descriptions[recommendation["product_id"]]
+
+
+def generate_recommendations(original_query, context_data_for_llm):
+    """Asks Gemini to select and format the final recommendations. Returns (dict, status_code)."""
+    # 5. Construct Prompt for Final JSON Generation
+    context_lines, context_stats = build_prompt_context(context_data_for_llm)
+
+    # Updated prompt asking for specific conversion and explicit no-match JSON
+    prompt = f"""You are an AI assistant generating JSON recommendations for SHL assessments based on provided context.
+    Analyze the user's original query and the provided context, which contains potentially relevant products found in the database.
+
+    Original User Query: "{original_query}"
+
+    Product Data Context (Top candidates retrieved, sorted by relevance, one JSON object per line; a missing key means null, long descriptions are shortened with "…"):
+    {context_lines}
+
+    Your Task:
+    1. Select the **BEST** and **MOST RELEVANT** products from the context that directly address the *original user query*.
+    2. Choose **AT MOST {MAX_FINAL_RECOMMENDATIONS}** products. Prioritize direct relevance to the original query over position in the list alone.
+    3. If the original query was broad (e.g., 'technical skills'), include products from the context that clearly fit that category (like specific coding tests, technical simulations), up to the limit of {MAX_FINAL_RECOMMENDATIONS}.
+    4. Generate **ONLY** a single, valid JSON object as your response. Do not include any text before or after the JSON object, including markdown fences like ```json or ```.
+
+    JSON Output Instructions:
+    - The JSON object MUST have a top-level key: "recommended_assessments", which is a JSON array.
+    - The array should contain **0 to {MAX_FINAL_RECOMMENDATIONS}** product objects, ordered by relevance to the original query.
+    - Each product object MUST have these keys IN THIS EXACT ORDER:
+      - "product_id": string (from context's 'product_id')
+      - "product_name": string (from context's 'product_name')
+      - "url": string (from context's 'url', ensure it's not null, use "" if missing)
+      - "adaptive_support": string ("Yes" if context 'adaptive_irt' is true/non-empty, otherwise "No")
+      - "description": string (from context's 'description')
+      - "duration": number or null (from context's 'duration_minutes')
+      - "remote_support": string ("Yes" if context 'remote_testing' is true/non-empty, otherwise "No")
+      - "test_type": array of strings (from context's 'product_type', ensure it's an array)
+    - Use ONLY data provided in the context. Convert boolean/source values for 'adaptive_support' and 'remote_support' to "Yes" or "No" strings. Ensure 'test_type' is always an array. Handle nulls appropriately for 'duration' and provide default "" for missing 'url'.
+
+    - **Crucially**: If *none* of the products in the provided context are a good match for the *original user query*, output EXACTLY this JSON object:
+      `{{"status": "no_relevant_match_in_context", "message": "While related products were retrieved, none closely matched the specific request.", "recommended_assessments": []}}`
+
+    Generate the JSON output now.
+    """
+
+    # 6. Call Gemini for Final JSON Generation
+    logging.info(
+        f"Sending final generation prompt to Gemini (asking for max {MAX_FINAL_RECOMMENDATIONS} results): "
+        f"~{estimate_tokens(prompt)} prompt tokens, context ~{context_stats['estimated_tokens']} tokens for {context_stats['candidates']} candidates "
+        f"({context_stats['descriptions_truncated']} descriptions shortened, budget {LLM_CONTEXT_TOKEN_BUDGET})."
+    )
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"The same context as indented JSON would be ~{estimate_tokens(json.dumps(context_data_for_llm, indent=2))} tokens.")
     try:
-        # 1. Expand Query
-        expanded_query = expand_query_with_llm(original_query)
+        gemini_response = gen_model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                temperature=GEMINI_JSON_GENERATION_TEMP,
+                # Explicitly ask for JSON output if the model supports it
+                # response_mime_type="application/json" # Uncomment if using a model/version supporting this
+            )
+        )
+        # logging.debug(f"Raw Gemini Response Text: {gemini_response.text}") # Be cautious logging potentially large/sensitive raw responses
+
+        usage = getattr(gemini_response, 'usage_metadata', None)
+        if usage is not None:
+            logging.info(f"Gemini generation usage: {getattr(usage, 'prompt_token_count', None)} prompt tokens, {getattr(usage, 'candidates_token_count', None)} output tokens.")
+
+        if gemini_response.parts:
+            recommendation_json_string = gemini_response.text
+            logging.info("Received text response from Gemini, attempting to parse as JSON.")
+
+            # --- Robust JSON Cleaning ---
+            cleaned_json_string = recommendation_json_string.strip()
+            # Remove potential markdown fences (```json ... ``` or ``` ... ```)
+            if cleaned_json_string.startswith("```json"):
+                cleaned_json_string = cleaned_json_string[7:]
+            elif cleaned_json_string.startswith("```"):
+                 cleaned_json_string = cleaned_json_string[3:]
+
+            if cleaned_json_string.endswith("```"):
+                cleaned_json_string = cleaned_json_string[:-3]
+
+            # Final strip after removing fences
+            cleaned_json_string = cleaned_json_string.strip()
+            # --- End JSON Cleaning ---
+
+            logging.debug(f"Cleaned JSON string attempt: '{cleaned_json_string}'") # Log the cleaned string
+
+            if not cleaned_json_string:
+                 logging.error("Gemini response was empty after cleaning attempts.")
+                 return {"error": "AI model returned an empty response after cleaning.", "status": "ai_error"}, 502
+
+            try:
+                # Attempt to parse the cleaned string
+                parsed_json = json.loads(cleaned_json_string)
+                logging.info("Response successfully parsed as JSON.")
+
+                # --- Add status and message if missing (and recommendations exist) ---
+                if "status" not in parsed_json:
+                    if isinstance(parsed_json.get("recommended_assessments"), list) and len(parsed_json["recommended_assessments"]) > 0:
+                         parsed_json["status"] = "success"
+                         parsed_json["message"] = "Successfully retrieved recommendations."
+                    else:
+                         # If recommendations array is missing or empty, assume no relevant match based on prompt instructions
+                         parsed_json["status"] = "no_relevant_match_in_context"
+                         parsed_json["message"] = parsed_json.get("message", "AI selected no relevant products from the provided context.")
+                         if "recommended_assessments" not in parsed_json:
+                             parsed_json["recommended_assessments"] = []
+                # --- End status handling ---
+
+                # Validate structure minimally (presence of recommended_assessments array)
+                if not isinstance(parsed_json.get("recommended_assessments"), list):
+                    logging.error(f"Parsed JSON lacks 'recommended_assessments' list. Parsed: {parsed_json}")
+                    raise json.JSONDecodeError("Parsed JSON missing 'recommended_assessments' list.", cleaned_json_string, 0)
+
+                if context_stats['descriptions_truncated']:
+                    restore_full_descriptions(parsed_json, context_data_for_llm)
+
+                # Return the parsed dictionary and status code
+                return parsed_json, 200
+
+            except json.JSONDecodeError as json_e:
+                logging.error(f"Gemini did not return valid JSON after cleaning: {json_e}. Cleaned String: '{cleaned_json_string}'. Raw Response (start): '{recommendation_json_string[:200]}...'")
+                # Return error dictionary
+                return {"error": f"AI model returned text that could not be parsed as JSON after cleaning. Check logs for details.", "raw_start": recommendation_json_string[:200], "status": "ai_error"}, 502
+
+        # Handle blocked responses explicitly
+        elif hasattr(gemini_response, 'prompt_feedback') and gemini_response.prompt_feedback and gemini_response.prompt_feedback.block_reason:
+             block_reason = gemini_response.prompt_feedback.block_reason
+             logging.warning(f"Gemini response blocked. Reason: {block_reason}")
+             # Return error dictionary
+             return {"error": f"AI response blocked by content safety filter ({block_reason}). Try rephrasing query or check context.", "status": "ai_blocked"}, 400
+        else:
+            # Handle other unexpected empty responses
+            logging.warning("Gemini returned an empty or unexpected response structure.")
+             # Return error dictionary
+            return {"error": "AI model returned an empty or unparseable response.", "status": "ai_error"}, 502
+
+    except Exception as e:
+        # Catch potential errors during the API call itself
+        logging.error(f"Error calling Gemini API or processing its response: {e}", exc_info=True)
+        # Return error dictionary
+        return {"error": f"An error occurred communicating with the AI model: {e}", "status": "ai_error"}, 502
+
+
+def merge_candidates(*match_lists, limit=DB_RETRIEVAL_COUNT):
+    """Merges candidate lists, de-duplicating by product_id (highest similarity wins) and keeping the top `limit`."""
+    best = {}
+    for matches in match_lists:
+        for match in matches or []:
+            if not isinstance(match, dict) or not match.get('product_id'):
+                continue
+            current = best.get(match['product_id'])
+            if current is None or (match.get('similarity') or 0) > (current.get('similarity') or 0):
+                best[match['product_id']] = match
+    merged = sorted(best.values(), key=lambda match: match.get('similarity') or 0, reverse=True)
+    return merged[:limit]
+
+
+def expand_and_retrieve(original_query, original_query_embedding=None, filters=None):
+    """Steps 1-3 of the pipeline. Returns (matches, expanded_query, error_response); error_response is (dict, status_code) or None.
+
+    With SPECULATIVE_RETRIEVAL the raw query is embedded and searched while Gemini expands it.
+    The two candidate sets are merged; if expansion exceeds EXPANSION_LATENCY_BUDGET_SECONDS
+    the speculative candidates are used alone.
+    """
+    # BM25 runs on the raw query, which is where exact product and skill names appear
+    lexical_hits, lexical_confident = lexical_search(original_query, filters)
+
+    if speculation_executor is None:
+        # 1. Expand Query (skipped when the lexical match is confident and LEXICAL_SKIP_EXPANSION is on)
+        expanded_query = expand_query_for_retrieval(original_query, lexical_confident)
 
         # 2. Embed Expanded Query
         logging.info(f"Embedding expanded query for retrieval...")
         try:
-            query_embedding = embed_model.encode(expanded_query).tolist()
+            query_embedding = embed_query(expanded_query)
         except Exception as e:
             logging.error(f"Failed to encode query: {e}", exc_info=True)
-            return {"error": f"Failed to process query for embedding: {e}", "status": "embedding_error"}, 500
-
+            return None, expanded_query, ({"error": f"Failed to process query for embedding: {e}", "status": "embedding_error"}, 500)
 
-        # 3. Query Supabase using Expanded Query Embedding
+        # 3. Retrieve candidates (local index, or Supabase RPC as fallback)
         logging.info(f"Searching for top {DB_RETRIEVAL_COUNT} relevant products...")
-        matches = []
-        last_db_error = None
-        for attempt in range(MAX_QUERY_RETRIES):
+        matches, last_db_error = retrieve_candidates(query_embedding, filters)
+        if last_db_error:
+             return None, expanded_query, ({"error": f"Database search failed after {MAX_QUERY_RETRIES} retries: {last_db_error}", "status": "db_error"}, 503)
+        return fuse_candidates(matches, lexical_hits, [query_embedding]), expanded_query, None
+
+    start_time = time.perf_counter()
+    expansion_future = speculation_executor.submit(expand_query_for_retrieval, original_query, lexical_confident)
+
+    # Speculative retrieval on the raw query while the expansion is in flight
+    try:
+        raw_embedding = original_query_embedding if original_query_embedding is not None else embed_query(original_query)
+    except Exception as e:
+        logging.error(f"Failed to encode query: {e}", exc_info=True)
+        return None, original_query, ({"error": f"Failed to process query for embedding: {e}", "status": "embedding_error"}, 500)
+    speculative_matches, speculative_error = retrieve_candidates(raw_embedding, filters)
+    db_errors = [speculative_error] if speculative_error else []
+
+    remaining_budget = EXPANSION_LATENCY_BUDGET_SECONDS - (time.perf_counter() - start_time)
+    try:
+        expanded_query = expansion_future.result(timeout=max(0.0, remaining_budget))
+    except FuturesTimeoutError:
+        # The expansion keeps running in the background and still populates the expansion cache
+        logging.warning(f"Query expansion exceeded the {EXPANSION_LATENCY_BUDGET_SECONDS}s budget. Using speculative candidates only.")
+        expanded_query = None
+
+    expanded_matches = []
+    query_embeddings = [raw_embedding]
+    retrievals_attempted = 1
+    if expanded_query and expanded_query != original_query:
+        retrievals_attempted += 1
+        try:
+            query_embeddings.append(embed_query(expanded_query))
+            expanded_matches, expanded_error = retrieve_candidates(query_embeddings[-1], filters)
+            if expanded_error:
+                db_errors.append(expanded_error)
+        except Exception as e:
+            logging.error(f"Failed to encode expanded query, using speculative candidates only: {e}", exc_info=True)
+
+    if len(db_errors) == retrievals_attempted:
+        return None, expanded_query or original_query, ({"error": f"Database search failed after {MAX_QUERY_RETRIES} retries: {db_errors[-1]}", "status": "db_error"}, 503)
+
+    matches = merge_candidates(speculative_matches, expanded_matches)
+    logging.info(f"Speculative retrieval: {len(speculative_matches or [])} raw + {len(expanded_matches or [])} expanded candidates merged into {len(matches)} in {time.perf_counter() - start_time:.2f}s.")
+    return fuse_candidates(matches, lexical_hits, query_embeddings), expanded_query or original_query, None
+
+
+# --- RAG Core Function ---
+def get_product_recommendation_backend_robust(original_query: str, filters=None):
+    """Performs the enhanced RAG process: Expand -> Retrieve -> Select -> Generate JSON. Returns (dict, status_code)
+
+    `filters` (see metadata_index.parse_filters) restrict retrieval to eligible products.
+    """
+    not_ready = check_pipeline_ready()
+    if not_ready:
+        return not_ready
+
+    if not is_valid_query(original_query):
+        logging.warning("Received invalid query.")
+        return {"error": "Query parameter is missing, empty, or not a string.", "status": "bad_request"}, 400
+
+    # Default responses defined once
+    default_error_response = {"error": "An internal error occurred during recommendation generation.", "status": "error"}
+    default_error_code = 500
+    no_match_json_response_dict = no_match_response(original_query)
+
+    try:
+        # 0. Serve near-duplicate queries from the semantic response cache (unfiltered queries only)
+        original_query_embedding = None
+        if semantic_cache is not None and not filters:
             try:
-                # Ensure supabase_client is valid before calling rpc
-                if not supabase_client:
-                     raise ConnectionError("Supabase client is not initialized.")
-
-                response = supabase_client.rpc(
-                    DB_FUNCTION_NAME,
-                    {
-                        'query_embedding': query_embedding,
-                        'match_threshold': DB_MATCH_THRESHOLD,
-                        'match_count': DB_RETRIEVAL_COUNT
-                    }
-                ).execute()
-
-                # Check response structure (depends on Supabase client version)
-                if hasattr(response, 'data') and response.data is not None:
-                    matches = response.data
-                elif isinstance(response, list): # Handle cases where it might return a list directly
-                     matches = response
-                else:
-                     # Log unexpected response structure
-                     logging.warning(f"Supabase RPC returned unexpected response structure: {type(response)}, Content: {response}")
-                     matches = [] # Assume no matches if structure is wrong
-
-                logging.info(f"Initial retrieval found {len(matches)} candidates (Attempt {attempt + 1}).")
-                last_db_error = None # Reset error on success
-                break # Exit loop on success
+                original_query_embedding = embed_query(original_query)
+                cached_response, similarity = semantic_cache.lookup(original_query_embedding, current_index_version())
+                if cached_response is not None:
+                    logging.info(f"Semantic cache hit (similarity {similarity:.4f}) for query '{original_query[:100]}'.")
+                    return cached_response, 200
+                if similarity is not None:
+                    logging.info(f"Semantic cache miss (best similarity {similarity:.4f}).")
             except Exception as e:
-                last_db_error = e
-                logging.error(f"Supabase RPC error (Attempt {attempt + 1}/{MAX_QUERY_RETRIES}): {e}", exc_info=True)
-                if attempt < MAX_QUERY_RETRIES - 1:
-                    logging.info(f"Retrying Supabase query in {RETRY_QUERY_DELAY} seconds...")
-                    time.sleep(RETRY_QUERY_DELAY)
-                else:
-                    logging.error("Supabase search failed after all retries.")
-                    # Use last_db_error in the response
-                    return {"error": f"Database search failed after {MAX_QUERY_RETRIES} retries: {last_db_error}", "status": "db_error"}, 503
-
-        # If loop finished due to retries failing
-        if last_db_error:
-             return {"error": f"Database search failed: {last_db_error}", "status": "db_error"}, 503
+                logging.warning(f"Semantic cache lookup failed, continuing without it: {e}")
+                original_query_embedding = None
 
+        # 1-3. Expand, embed and retrieve candidates
+        matches, expanded_query, error_response = expand_and_retrieve(original_query, original_query_embedding, filters)
+        if error_response:
+            return error_response
 
         if not matches:
             logging.warning(f"No candidates found matching threshold {DB_MATCH_THRESHOLD} for expanded query '{expanded_query}'.")
@@ -281,165 +1050,18 @@ def get_product_recommendation_backend_robust(original_query: str):
 
         # 4. Format Context for Final LLM
         logging.info(f"Preparing context with {len(matches)} candidates for AI selection...")
-        context_data_for_llm = []
-        seen_product_ids = set() # Avoid duplicates if DB returns them somehow
-        for match in matches:
-            if isinstance(match, dict) and match.get('product_id') not in seen_product_ids:
-                product_id = match.get('product_id') # Get product_id for the JSON output
-                if not product_id:
-                    logging.warning(f"Skipping match due to missing 'product_id': {match.get('product_name')}")
-                    continue
-
-                context_data_for_llm.append({
-                    # Ensure all required fields for the final JSON are present here
-                    "product_id": product_id, # Use product_id from the match
-                    "url": match.get('url'),
-                    "adaptive_irt": match.get('adaptive_irt'), # Keep boolean or source format
-                    "description": match.get('description'),
-                    "duration_minutes": match.get('duration_minutes'), # Keep number or None
-                    "remote_testing": match.get('remote_testing'), # Keep boolean or source format
-                    "product_type": match.get('product_type', []),
-                    "product_name": match.get('product_name'),
-                    # Include similarity score for context, though not required in final JSON
-                    "similarity_score": match.get('similarity')
-                })
-                seen_product_ids.add(product_id)
-            else:
-                if not isinstance(match, dict):
-                     logging.warning(f"Skipping unexpected match item format: {type(match)}, Content: {match}")
-                # else: duplicate product_id, already logged if needed
-
+        context_data_for_llm = build_llm_context(matches)
         if not context_data_for_llm:
              logging.warning("No valid candidates remaining after filtering for context.")
              return no_match_json_response_dict, 200
 
+        # 5-6. Generate the final JSON with Gemini
+        result, status_code = generate_recommendations(original_query, context_data_for_llm)
 
-        # 5. Construct Prompt for Final JSON Generation
-        context_json_string = json.dumps(context_data_for_llm, indent=2)
-
-        # Updated prompt asking for specific conversion and explicit no-match JSON
-        prompt = f"""You are an AI assistant generating JSON recommendations for SHL assessments based on provided context.
-        Analyze the user's original query and the provided context, which contains potentially relevant products found in the database.
-
-        Original User Query: "{original_query}"
-
-        Product Data Context (Top candidates retrieved, sorted by relevance):
-        ```json
-        {context_json_string}
-        ```
-
-        Your Task:
-        1. Select the **BEST** and **MOST RELEVANT** products from the context that directly address the *original user query*.
-        2. Choose **AT MOST {MAX_FINAL_RECOMMENDATIONS}** products. Prioritize direct relevance to the original query over similarity score alone.
-        3. If the original query was broad (e.g., 'technical skills'), include products from the context that clearly fit that category (like specific coding tests, technical simulations), up to the limit of {MAX_FINAL_RECOMMENDATIONS}.
-        4. Generate **ONLY** a single, valid JSON object as your response. Do not include any text before or after the JSON object, including markdown fences like ```json or ```.
-
-        JSON Output Instructions:
-        - The JSON object MUST have a top-level key: "recommended_assessments", which is a JSON array.
-        - The array should contain **0 to {MAX_FINAL_RECOMMENDATIONS}** product objects, ordered by relevance to the original query.
-        - Each product object MUST have these keys IN THIS EXACT ORDER:
-          - "product_id": string (from context's 'product_id')
-          - "product_name": string (from context's 'product_name')
-          - "url": string (from context's 'url', ensure it's not null, use "" if missing)
-          - "adaptive_support": string ("Yes" if context 'adaptive_irt' is true/non-empty, otherwise "No")
-          - "description": string (from context's 'description')
-          - "duration": number or null (from context's 'duration_minutes')
-          - "remote_support": string ("Yes" if context 'remote_testing' is true/non-empty, otherwise "No")
-          - "test_type": array of strings (from context's 'product_type', ensure it's an array)
-        - Use ONLY data provided in the context. Convert boolean/source values for 'adaptive_support' and 'remote_support' to "Yes" or "No" strings. Ensure 'test_type' is always an array. Handle nulls appropriately for 'duration' and provide default "" for missing 'url'.
-
-        - **Crucially**: If *none* of the products in the provided context are a good match for the *original user query*, output EXACTLY this JSON object:
-          `{{"status": "no_relevant_match_in_context", "message": "While related products were retrieved, none closely matched the specific request.", "recommended_assessments": []}}`
-
-        Generate the JSON output now.
-        """
-
-        # 6. Call Gemini for Final JSON Generation
-        logging.info(f"Sending final generation prompt to Gemini (asking for max {MAX_FINAL_RECOMMENDATIONS} results)...")
-        try:
-            gemini_response = gen_model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=GEMINI_JSON_GENERATION_TEMP,
-                    # Explicitly ask for JSON output if the model supports it
-                    # response_mime_type="application/json" # Uncomment if using a model/version supporting this
-                )
-            )
-            # logging.debug(f"Raw Gemini Response Text: {gemini_response.text}") # Be cautious logging potentially large/sensitive raw responses
-
-            if gemini_response.parts:
-                recommendation_json_string = gemini_response.text
-                logging.info("Received text response from Gemini, attempting to parse as JSON.")
-
-                # --- Robust JSON Cleaning ---
-                cleaned_json_string = recommendation_json_string.strip()
-                # Remove potential markdown fences (```json ... ``` or ``` ... ```)
-                if cleaned_json_string.startswith("```json"):
-                    cleaned_json_string = cleaned_json_string[7:]
-                elif cleaned_json_string.startswith("```"):
-                     cleaned_json_string = cleaned_json_string[3:]
-
-                if cleaned_json_string.endswith("```"):
-                    cleaned_json_string = cleaned_json_string[:-3]
-
-                # Final strip after removing fences
-                cleaned_json_string = cleaned_json_string.strip()
-                # --- End JSON Cleaning ---
-
-                logging.debug(f"Cleaned JSON string attempt: '{cleaned_json_string}'") # Log the cleaned string
-
-                if not cleaned_json_string:
-                     logging.error("Gemini response was empty after cleaning attempts.")
-                     return {"error": "AI model returned an empty response after cleaning.", "status": "ai_error"}, 502
-
-                try:
-                    # Attempt to parse the cleaned string
-                    parsed_json = json.loads(cleaned_json_string)
-                    logging.info("Response successfully parsed as JSON.")
-
-                    # --- Add status and message if missing (and recommendations exist) ---
-                    if "status" not in parsed_json:
-                        if isinstance(parsed_json.get("recommended_assessments"), list) and len(parsed_json["recommended_assessments"]) > 0:
-                             parsed_json["status"] = "success"
-                             parsed_json["message"] = "Successfully retrieved recommendations."
-                        else:
-                             # If recommendations array is missing or empty, assume no relevant match based on prompt instructions
-                             parsed_json["status"] = "no_relevant_match_in_context"
-                             parsed_json["message"] = parsed_json.get("message", "AI selected no relevant products from the provided context.")
-                             if "recommended_assessments" not in parsed_json:
-                                 parsed_json["recommended_assessments"] = []
-                    # --- End status handling ---
-
-                    # Validate structure minimally (presence of recommended_assessments array)
-                    if not isinstance(parsed_json.get("recommended_assessments"), list):
-                        logging.error(f"Parsed JSON lacks 'recommended_assessments' list. Parsed: {parsed_json}")
-                        raise json.JSONDecodeError("Parsed JSON missing 'recommended_assessments' list.", cleaned_json_string, 0)
-
-                    # Return the parsed dictionary and status code
-                    return parsed_json, 200
-
-                except json.JSONDecodeError as json_e:
-                    logging.error(f"Gemini did not return valid JSON after cleaning: {json_e}. Cleaned String: '{cleaned_json_string}'. Raw Response (start): '{recommendation_json_string[:200]}...'")
-                    # Return error dictionary
-                    return {"error": f"AI model returned text that could not be parsed as JSON after cleaning. Check logs for details.", "raw_start": recommendation_json_string[:200], "status": "ai_error"}, 502
-
-            # Handle blocked responses explicitly
-            elif hasattr(gemini_response, 'prompt_feedback') and gemini_response.prompt_feedback and gemini_response.prompt_feedback.block_reason:
-                 block_reason = gemini_response.prompt_feedback.block_reason
-                 logging.warning(f"Gemini response blocked. Reason: {block_reason}")
-                 # Return error dictionary
-                 return {"error": f"AI response blocked by content safety filter ({block_reason}). Try rephrasing query or check context.", "status": "ai_blocked"}, 400
-            else:
-                # Handle other unexpected empty responses
-                logging.warning("Gemini returned an empty or unexpected response structure.")
-                 # Return error dictionary
-                return {"error": "AI model returned an empty or unparseable response.", "status": "ai_error"}, 502
-
-        except Exception as e:
-            # Catch potential errors during the API call itself
-            logging.error(f"Error calling Gemini API or processing its response: {e}", exc_info=True)
-            # Return error dictionary
-            return {"error": f"An error occurred communicating with the AI model: {e}", "status": "ai_error"}, 502
+        # Only full successes are reused for near-duplicate queries
+        if original_query_embedding is not None and status_code == 200 and result.get("status") == "success":
+            semantic_cache.put(original_query_embedding, result, current_index_version())
+        return result, status_code
 
     except Exception as e:
         # Catch-all for unexpected errors in the main RAG flow
@@ -448,6 +1070,167 @@ def get_product_recommendation_backend_robust(original_query: str):
         return default_error_response, default_error_code
 
 
+def split_expanded_query(expanded_query):
+    """Returns the expansion terms appended by expand_query_with_llm (empty list if the query was not expanded)."""
+    _, separator, terms = expanded_query.partition(" | Relevant concepts: ")
+    return [term.strip() for term in terms.split(",") if term.strip()] if separator else []
+
+
+def stream_product_recommendation(original_query, filters=None):
+    """Generator variant of get_product_recommendation_backend_robust for SSE clients.
+
+    Yields (event_name, data) tuples as each stage completes: "expansion", "candidates" and
+    finally "result" (the same body the JSON endpoint returns, plus its status_code).
+    """
+    not_ready = check_pipeline_ready()
+    if not_ready:
+        yield "result", dict(not_ready[0], status_code=not_ready[1])
+        return
+
+    try:
+        original_query_embedding = None
+        if semantic_cache is not None and not filters:
+            try:
+                original_query_embedding = embed_query(original_query)
+                cached_response, similarity = semantic_cache.lookup(original_query_embedding, current_index_version())
+                if cached_response is not None:
+                    logging.info(f"Semantic cache hit (similarity {similarity:.4f}) for streamed query.")
+                    yield "result", dict(cached_response, status_code=200)
+                    return
+            except Exception as e:
+                logging.warning(f"Semantic cache lookup failed, continuing without it: {e}")
+                original_query_embedding = None
+
+        if speculation_executor is not None:
+            matches, expanded_query, error_response = expand_and_retrieve(original_query, original_query_embedding, filters)
+            yield "expansion", {"expanded_query": expanded_query, "terms": split_expanded_query(expanded_query)}
+        else:
+            lexical_hits, lexical_confident = lexical_search(original_query, filters)
+            expanded_query = expand_query_for_retrieval(original_query, lexical_confident)
+            yield "expansion", {"expanded_query": expanded_query, "terms": split_expanded_query(expanded_query)}
+            matches, error_response = None, None
+            try:
+                query_embedding = embed_query(expanded_query)
+                matches, last_db_error = retrieve_candidates(query_embedding, filters)
+                matches = fuse_candidates(matches, lexical_hits, [query_embedding])
+                if last_db_error:
+                    error_response = ({"error": f"Database search failed after {MAX_QUERY_RETRIES} retries: {last_db_error}", "status": "db_error"}, 503)
+            except Exception as e:
+                logging.error(f"Failed to encode query: {e}", exc_info=True)
+                error_response = ({"error": f"Failed to process query for embedding: {e}", "status": "embedding_error"}, 500)
+
+        if error_response:
+            yield "result", dict(error_response[0], status_code=error_response[1])
+            return
+
+        context_data_for_llm = build_llm_context(matches) if matches else []
+        yield "candidates", {"candidates": context_data_for_llm}
+        if not context_data_for_llm:
+            yield "result", dict(no_match_response(original_query), status_code=200)
+            return
+
+        result, status_code = generate_recommendations(original_query, context_data_for_llm)
+        if original_query_embedding is not None and status_code == 200 and result.get("status") == "success":
+            semantic_cache.put(original_query_embedding, result, current_index_version())
+        yield "result", dict(result, status_code=status_code)
+
+    except Exception as e:
+        logging.error(f"Unexpected error in streamed RAG process for query '{original_query}': {e}", exc_info=True)
+        yield "result", {"error": "An internal error occurred during recommendation generation.", "status": "error", "status_code": 500}
+
+
+def format_sse_event(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def get_product_recommendations_batch(queries):
+    """Batch variant of get_product_recommendation_backend_robust. Returns a list of (dict, status_code) in input order.
+
+    Expansions and generations run concurrently, all expanded queries are embedded with one
+    batched encode call and local retrieval for the whole batch is a single matrix product.
+    """
+    not_ready = check_pipeline_ready()
+    if not_ready:
+        return [not_ready] * len(queries)
+
+    results = [None] * len(queries)
+    pending = []
+    for i, query in enumerate(queries):
+        if is_valid_query(query):
+            pending.append(i)
+        else:
+            results[i] = ({"error": "Query is missing, empty, or not a string.", "status": "bad_request"}, 400)
+
+    try:
+        # 0. Serve near-duplicate queries from the semantic response cache
+        original_query_embeddings = {}
+        if semantic_cache is not None and pending:
+            try:
+                version = current_index_version()
+                still_pending = []
+                for i, vector in zip(pending, embed_queries([queries[i] for i in pending])):
+                    cached_response, similarity = semantic_cache.lookup(vector, version)
+                    if cached_response is not None:
+                        logging.info(f"Semantic cache hit (similarity {similarity:.4f}) for batch item {i}.")
+                        results[i] = (cached_response, 200)
+                    else:
+                        original_query_embeddings[i] = vector
+                        still_pending.append(i)
+                pending = still_pending
+            except Exception as e:
+                logging.warning(f"Semantic cache lookup failed for batch, continuing without it: {e}")
+                original_query_embeddings = {}
+
+        if not pending:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_CONCURRENCY, len(pending))) as executor:
+            # 1. Expand all queries concurrently (BM25 first, so confident queries can skip expansion)
+            lexical_results = [lexical_search(queries[i]) for i in pending]
+            expanded_queries = list(executor.map(
+                expand_query_for_retrieval, [queries[i] for i in pending], [confident for _, confident in lexical_results]
+            ))
+
+            # 2. Embed all expanded queries in one batched call
+            logging.info(f"Embedding {len(expanded_queries)} expanded queries for retrieval...")
+            try:
+                query_matrix = embed_queries(expanded_queries)
+            except Exception as e:
+                logging.error(f"Failed to encode batch queries: {e}", exc_info=True)
+                for i in pending:
+                    results[i] = ({"error": f"Failed to process query for embedding: {e}", "status": "embedding_error"}, 500)
+                return results
+
+            # 3. Retrieve candidates for the whole batch
+            contexts = {}
+            for i, query_embedding, (lexical_hits, _), (matches, last_db_error) in zip(pending, query_matrix, lexical_results, retrieve_candidates_batch(query_matrix)):
+                if last_db_error:
+                    results[i] = ({"error": f"Database search failed after {MAX_QUERY_RETRIES} retries: {last_db_error}", "status": "db_error"}, 503)
+                    continue
+                matches = fuse_candidates(matches, lexical_hits, [query_embedding])
+                context_data_for_llm = build_llm_context(matches) if matches else []
+                if not context_data_for_llm:
+                    results[i] = (no_match_response(queries[i]), 200)
+                    continue
+                contexts[i] = context_data_for_llm
+
+            # 4-6. Generate the final JSON for every query with candidates, concurrently
+            futures = {i: executor.submit(generate_recommendations, queries[i], context) for i, context in contexts.items()}
+            for i, future in futures.items():
+                result, status_code = future.result()
+                if i in original_query_embeddings and status_code == 200 and result.get("status") == "success":
+                    semantic_cache.put(original_query_embeddings[i], result, current_index_version())
+                results[i] = (result, status_code)
+
+    except Exception as e:
+        logging.error(f"Unexpected error in batch RAG process: {e}", exc_info=True)
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = ({"error": "An internal error occurred during recommendation generation.", "status": "error"}, 500)
+
+    return results
+
+
 # --- Flask Routes ---
 @app.route('/recommend', methods=['POST'])
 def recommend_assessments():
@@ -484,19 +1267,117 @@ def recommend_assessments():
          logging.warning(f"[Req ID: {request_id}] Invalid 'query' provided (not a non-empty string).")
          return pretty_json_response({"error": "'query' must be a non-empty string.", "status": "bad_request"}, 400)
 
-    logging.info(f"[Req ID: {request_id}] Processing original query: '{original_query[:100]}...'")
+    try:
+        filters = parse_filters(data.get('filters'))
+    except ValueError as e:
+        logging.warning(f"[Req ID: {request_id}] Invalid 'filters' provided: {e}")
+        return pretty_json_response({"error": str(e), "status": "bad_request"}, 400)
+
+    logging.info(f"[Req ID: {request_id}] Processing original query: '{original_query[:100]}...'" + (f" with filters {filters}" if filters else ""))
 
     # Call the backend function which now returns (dict, status_code)
-    result_data, status_code = get_product_recommendation_backend_robust(original_query)
+    result_data, status_code = get_product_recommendation_backend_robust(original_query, filters)
 
     end_time = time.time()
     processing_time = end_time - start_time
     logging.info(f"[Req ID: {request_id}] Request processed in {processing_time:.2f} seconds. Status code: {status_code}. Result status: {result_data.get('status', 'N/A')}")
+    if status_code == 200:
+        record_first_success()
 
     # Use the pretty_json_response helper for consistent output
     return pretty_json_response(result_data, status_code)
 
 
+@app.route('/recommend/stream', methods=['POST'])
+def recommend_assessments_stream():
+    """Server-Sent Events variant of /recommend: emits 'expansion', 'candidates' and 'result' events."""
+    if not initialization_complete and (initialization_thread is None or not initialization_thread.is_alive()):
+        start_initialization()
+
+    if not initialization_complete:
+        if initialization_error_message:
+            return pretty_json_response({"error": initialization_error_message, "status": "unavailable"}, 503)
+        else:
+            return pretty_json_response({"error": "Server is initializing. Please try again shortly.", "status": "initializing"}, 503)
+
+    request_id = os.urandom(4).hex()
+    logging.info(f"[Req ID: {request_id}] Received request on /recommend/stream endpoint.")
+
+    if not request.is_json:
+        logging.warning(f"[Req ID: {request_id}] Request content type is not application/json.")
+        return pretty_json_response({"error": "Request must be JSON.", "status": "bad_request"}, 415)
+
+    data = request.json
+    original_query = data.get('query') if isinstance(data, dict) else None
+    if not isinstance(original_query, str) or not original_query.strip():
+        logging.warning(f"[Req ID: {request_id}] Invalid or missing 'query' provided.")
+        return pretty_json_response({"error": "'query' must be a non-empty string.", "status": "bad_request"}, 400)
+
+    try:
+        filters = parse_filters(data.get('filters'))
+    except ValueError as e:
+        logging.warning(f"[Req ID: {request_id}] Invalid 'filters' provided: {e}")
+        return pretty_json_response({"error": str(e), "status": "bad_request"}, 400)
+
+    def event_stream():
+        start_time = time.time()
+        for event_name, event_data in stream_product_recommendation(original_query, filters):
+            logging.info(f"[Req ID: {request_id}] Streaming '{event_name}' event after {time.time() - start_time:.2f} seconds.")
+            yield format_sse_event(event_name, event_data)
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/recommend/batch', methods=['POST'])
+def recommend_assessments_batch():
+    if not initialization_complete and (initialization_thread is None or not initialization_thread.is_alive()):
+        start_initialization()
+
+    if not initialization_complete:
+        if initialization_error_message:
+            return pretty_json_response({"error": initialization_error_message, "status": "unavailable"}, 503)
+        else:
+            return pretty_json_response({"error": "Server is initializing. Please try again shortly.", "status": "initializing"}, 503)
+
+    start_time = time.time()
+    request_id = os.urandom(4).hex()
+    logging.info(f"[Req ID: {request_id}] Received request on /recommend/batch endpoint.")
+
+    if not request.is_json:
+        logging.warning(f"[Req ID: {request_id}] Request content type is not application/json.")
+        return pretty_json_response({"error": "Request must be JSON.", "status": "bad_request"}, 415)
+
+    data = request.json
+    queries = data.get('queries') if isinstance(data, dict) else None
+    if not isinstance(queries, list) or not queries:
+        logging.warning(f"[Req ID: {request_id}] Request JSON missing a non-empty 'queries' list.")
+        return pretty_json_response({"error": "'queries' must be a non-empty list of strings.", "status": "bad_request"}, 400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        logging.warning(f"[Req ID: {request_id}] Batch of {len(queries)} queries exceeds limit {BATCH_MAX_QUERIES}.")
+        return pretty_json_response({"error": f"At most {BATCH_MAX_QUERIES} queries are accepted per batch.", "status": "bad_request"}, 413)
+
+    logging.info(f"[Req ID: {request_id}] Processing batch of {len(queries)} queries.")
+    batch_results = get_product_recommendations_batch(queries)
+
+    succeeded = sum(1 for _, status_code in batch_results if status_code == 200)
+    response_data = {
+        "status": "success" if succeeded == len(batch_results) else ("partial_success" if succeeded else "error"),
+        "message": f"{succeeded} of {len(batch_results)} queries processed successfully.",
+        "results": [
+            {"index": i, "query": query, "status_code": status_code, "result": result}
+            for i, (query, (result, status_code)) in enumerate(zip(queries, batch_results))
+        ]
+    }
+
+    processing_time = time.time() - start_time
+    logging.info(f"[Req ID: {request_id}] Batch of {len(queries)} processed in {processing_time:.2f} seconds. {succeeded} succeeded.")
+    return pretty_json_response(response_data, 200)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     # Start initialization if it hasn't been started yet (e.g., health check is the first hit)
@@ -513,7 +1394,10 @@ def health_check():
             "gen_model_needed": GEMINI_API_KEY is not None,
             "supabase_client_ready": supabase_client is not None,
             "embedding_model_ready": embed_model is not None,
-            "gen_model_ready": gen_model is not None
+            "gen_model_ready": gen_model is not None,
+            "local_index_ready": product_index is not None,
+            "bm25_index_ready": bm25_index is not None,
+            "metadata_index_ready": metadata_index is not None
         }
     }
 
@@ -538,15 +1422,34 @@ def health_check():
     response_data["components"]["supabase_client_ready"] = supabase_client is not None
     response_data["components"]["embedding_model_ready"] = embed_model is not None
     response_data["components"]["gen_model_ready"] = gen_model is not None
+    response_data["components"]["local_index_ready"] = product_index is not None
+    response_data["components"]["bm25_index_ready"] = bm25_index is not None
+    response_data["components"]["metadata_index_ready"] = metadata_index is not None
+    response_data["embedding_backend"] = {"backend": EMBEDDING_BACKEND, "model_id": embed_model.model_id} if embed_model is not None else None
+    response_data["startup"] = startup_stats()
+    response_data["embedding_cache"] = embedding_cache.stats()
+    response_data["embedding_micro_batching"] = query_encoder.stats() if query_encoder is not None else None
+    response_data["expansion_cache"] = expansion_cache.stats() if expansion_cache is not None else None
+    response_data["semantic_cache"] = semantic_cache.stats() if semantic_cache is not None else None
+    response_data["retrieval_backend"] = "local" if product_index is not None else "supabase"
+    response_data["local_index_memory"] = product_index.memory_bytes() if product_index is not None else None
+    with lexical_stats_lock:
+        response_data["lexical_retrieval"] = dict(lexical_stats, hybrid=bm25_index is not None, skip_expansion=LEXICAL_SKIP_EXPANSION)
 
 
     return pretty_json_response(response_data, status_code)
 
 
+# Start loading components at import so they are ready by the first request. Not for a process
+# that will fork workers: gunicorn.conf.py turns this off and starts each worker's load in post_fork.
+if EAGER_INITIALIZATION:
+    start_initialization()
+
 # --- Run Flask App ---
 if __name__ == '__main__':
     # Start initialization in background immediately when script runs directly
-    start_initialization()
+    if not EAGER_INITIALIZATION:
+        start_initialization()
 
     # Read PORT environment variable, default to 8080 common for cloud containers
     port = int(os.environ.get("PORT", 7860)) # Changed default to 8080
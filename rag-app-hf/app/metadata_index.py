@@ -0,0 +1,138 @@
+import logging
+import numpy as np
+
+# Filter fields accepted in the request body
+FILTER_FIELDS = (
+    'min_duration_minutes', 'max_duration_minutes', 'remote_testing', 'adaptive_irt', 'product_type', 'solution_type'
+)
+
+
+def _as_value_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def parse_filters(raw_filters):
+    """Validates the optional 'filters' object of a request. Returns a normalized dict (empty if no filters).
+
+    Raises ValueError with a client-facing message when a field is unknown or has the wrong type.
+    """
+    if raw_filters is None:
+        return {}
+    if not isinstance(raw_filters, dict):
+        raise ValueError("'filters' must be a JSON object.")
+    unknown = sorted(set(raw_filters) - set(FILTER_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown filter field(s): {', '.join(unknown)}. Supported: {', '.join(FILTER_FIELDS)}.")
+
+    filters = {}
+    for field in ('min_duration_minutes', 'max_duration_minutes'):
+        value = raw_filters.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"'{field}' must be a non-negative number.")
+        filters[field] = float(value)
+    if filters.get('min_duration_minutes', 0) > filters.get('max_duration_minutes', float('inf')):
+        raise ValueError("'min_duration_minutes' cannot be greater than 'max_duration_minutes'.")
+    for field in ('remote_testing', 'adaptive_irt'):
+        value = raw_filters.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, bool):
+            raise ValueError(f"'{field}' must be true or false.")
+        filters[field] = value
+    for field in ('product_type', 'solution_type'):
+        value = raw_filters.get(field)
+        if value is None:
+            continue
+        values = _as_value_list(value)
+        if not values or not all(isinstance(item, str) and item.strip() for item in values):
+            raise ValueError(f"'{field}' must be a non-empty string or list of strings.")
+        # Any-of semantics, matched case-insensitively
+        filters[field] = sorted({item.strip().lower() for item in values})
+    return filters
+
+
+def record_matches_filters(record, filters):
+    """Predicate form of MetadataIndex.mask, for candidates that did not come from the local index."""
+    duration = record.get('duration_minutes') or 0
+    if 'min_duration_minutes' in filters or 'max_duration_minutes' in filters:
+        # Unknown durations (0 in the catalog) cannot be shown to satisfy a bound
+        if duration <= 0:
+            return False
+        if duration < filters.get('min_duration_minutes', 0) or duration > filters.get('max_duration_minutes', float('inf')):
+            return False
+    for field in ('remote_testing', 'adaptive_irt'):
+        if field in filters and bool(record.get(field)) != filters[field]:
+            return False
+    if 'product_type' in filters:
+        product_types = {str(item).strip().lower() for item in record.get('product_type') or []}
+        if product_types.isdisjoint(filters['product_type']):
+            return False
+    if 'solution_type' in filters:
+        if str(record.get('solution_type') or '').strip().lower() not in filters['solution_type']:
+            return False
+    return True
+
+
+# --- Metadata Index ---
+class MetadataIndex:
+    """Bitmap and sorted-array indexes over product metadata, row-aligned with the product records.
+
+    Boolean fields and every product_type / solution_type value are numpy bool bitmaps;
+    durations are a sorted array, so a range is two binary searches. `mask(filters)` combines
+    them into the set of eligible rows before any vector or lexical scoring happens.
+    """
+
+    def __init__(self, records):
+        self.size = len(records)
+        self.remote_testing = np.array([bool(record.get('remote_testing')) for record in records], dtype=bool)
+        self.adaptive_irt = np.array([bool(record.get('adaptive_irt')) for record in records], dtype=bool)
+        durations = np.array([record.get('duration_minutes') or 0 for record in records], dtype=np.float32)
+        self._duration_order = np.argsort(durations, kind='stable')
+        self._sorted_durations = durations[self._duration_order]
+        self.product_type_bitmaps = self._value_bitmaps(records, lambda record: record.get('product_type') or [])
+        self.solution_type_bitmaps = self._value_bitmaps(records, lambda record: [record.get('solution_type')] if record.get('solution_type') else [])
+        logging.info(f"Built metadata index over {self.size} products ({len(self.product_type_bitmaps)} product types, {len(self.solution_type_bitmaps)} solution types).")
+
+    def _value_bitmaps(self, records, values_fn):
+        bitmaps = {}
+        for row, record in enumerate(records):
+            for value in values_fn(record):
+                key = str(value).strip().lower()
+                if key not in bitmaps:
+                    bitmaps[key] = np.zeros(self.size, dtype=bool)
+                bitmaps[key][row] = True
+        return bitmaps
+
+    def _any_of(self, bitmaps, values):
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            bitmap = bitmaps.get(value)
+            if bitmap is not None:
+                mask |= bitmap
+        return mask
+
+    def mask(self, filters):
+        """Returns a bool array of eligible rows, or None when `filters` is empty (everything is eligible)."""
+        if not filters:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        if 'min_duration_minutes' in filters or 'max_duration_minutes' in filters:
+            # Unknown durations (0) are excluded whenever a bound is given
+            low = max(filters.get('min_duration_minutes', 0), np.nextafter(np.float32(0), np.float32(1)))
+            high = filters.get('max_duration_minutes', np.inf)
+            start = np.searchsorted(self._sorted_durations, low, side='left')
+            end = np.searchsorted(self._sorted_durations, high, side='right')
+            duration_mask = np.zeros(self.size, dtype=bool)
+            duration_mask[self._duration_order[start:end]] = True
+            mask &= duration_mask
+        if 'remote_testing' in filters:
+            mask &= self.remote_testing == filters['remote_testing']
+        if 'adaptive_irt' in filters:
+            mask &= self.adaptive_irt == filters['adaptive_irt']
+        if 'product_type' in filters:
+            mask &= self._any_of(self.product_type_bitmaps, filters['product_type'])
+        if 'solution_type' in filters:
+            mask &= self._any_of(self.solution_type_bitmaps, filters['solution_type'])
+        return mask
@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+
+# --- Micro-Batching Query Encoder ---
+class MicroBatchEncoder:
+    """Merges concurrent single-text encode calls into batched forward passes.
+
+    Only one forward pass runs at a time. A call that finds the model idle and nothing queued
+    is encoded straight away in the calling thread, so an uncontended request pays no extra
+    latency. Calls arriving while a pass is running are queued; when the model frees up, a
+    worker thread waits up to `max_wait_ms` for the queue to reach `max_batch_size`, encodes
+    the queued texts in one `encode_batch_fn(list_of_texts)` call (identical texts once) and
+    resolves each caller's future.
+    """
+
+    def __init__(self, encode_batch_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.encode_batch_fn = encode_batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = deque() # (text, future)
+        self._busy = False # A forward pass (direct or batched) is running or being collected
+        self._cond = threading.Condition()
+        self._worker = None
+        self.direct_calls = 0
+        self.batched_calls = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    def encode(self, text):
+        """Returns the embedding of `text` as a float32 vector. Safe to call from any thread."""
+        return self.encode_many([text])[0]
+
+    def encode_many(self, texts):
+        """Returns the embeddings of `texts` as a (len(texts), dim) float32 matrix.
+
+        On an idle encoder the texts are encoded directly as one batch; otherwise each joins the
+        queue and is merged into batches with other callers' texts.
+        """
+        texts = list(texts)
+        with self._cond:
+            direct = not self._busy and not self._queue
+            if direct:
+                self._busy = True
+                self.direct_calls += len(texts)
+            else:
+                futures = []
+                for text in texts:
+                    futures.append(Future())
+                    self._queue.append((text, futures[-1]))
+                self._ensure_worker()
+                self._cond.notify_all()
+        if not direct:
+            return np.vstack([future.result() for future in futures])
+        try:
+            return np.asarray(self.encode_batch_fn(texts), dtype=np.float32)
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _ensure_worker(self):
+        # Called with the lock held
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._worker.start()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue or self._busy:
+                self._cond.wait()
+            self._busy = True
+            # Requests are waiting, so there is contention: give others a moment to join the batch
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.max_batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            self.batches += 1
+            self.batched_calls += count
+            self.largest_batch = max(self.largest_batch, count)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                unique_texts = list(dict.fromkeys(text for text, _ in batch))
+                try:
+                    vectors = np.asarray(self.encode_batch_fn(unique_texts), dtype=np.float32)
+                    results = {text: (vector, None) for text, vector in zip(unique_texts, vectors)}
+                except Exception as e:
+                    # Retry one by one so a single bad input only fails its own request
+                    logging.warning(f"Batched encode of {len(unique_texts)} queries failed ({e}); encoding them individually.")
+                    results = {text: self._encode_one(text) for text in unique_texts}
+                for text, future in batch:
+                    vector, error = results[text]
+                    if error is None:
+                        future.set_result(vector)
+                    else:
+                        future.set_exception(error)
+            except Exception as e:
+                logging.error(f"Unexpected error in the embedding batcher: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _encode_one(self, text):
+        try:
+            return np.asarray(self.encode_batch_fn([text]), dtype=np.float32)[0], None
+        except Exception as e:
+            return None, e
+
+    def stats(self):
+        with self._cond:
+            return {
+                "direct_calls": self.direct_calls,
+                "batched_calls": self.batched_calls,
+                "batches": self.batches,
+                "average_batch_size": round(self.batched_calls / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "queued": len(self._queue)
+            }
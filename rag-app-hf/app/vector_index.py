@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from collections.abc import Sequence
+import numpy as np
+
+# Fields returned for every match, mirroring the columns the `match_products` RPC selects.
+RECORD_FIELDS = (
+    'product_id', 'product_name', 'url', 'solution_type', 'remote_testing', 'adaptive_irt',
+    'product_type', 'description', 'target_audience', 'measured_constructs', 'job_roles',
+    'industry', 'features', 'duration_minutes'
+)
+
+
+# --- Catalog Loading ---
+def load_catalog(path):
+    """Loads the product catalog JSON and de-duplicates it by product_id (first occurrence wins)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        products = json.load(f)
+    if not isinstance(products, list):
+        raise ValueError(f"Catalog file '{path}' does not contain a JSON list.")
+
+    unique_products = {}
+    for product in products:
+        product_id = product.get('product_id')
+        if not product_id or not str(product_id).strip():
+            continue
+        unique_products.setdefault(str(product_id).strip(), product)
+    logging.info(f"Loaded {len(products)} catalog records ({len(unique_products)} unique) from '{path}'.")
+    return list(unique_products.values())
+
+
+def compute_index_version(model_name, texts):
+    """Stable fingerprint of the embedding model and the exact texts that were embedded."""
+    digest = hashlib.sha1(model_name.encode('utf-8'))
+    for text in texts:
+        digest.update(b'\x00')
+        digest.update(text.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix):
+    """Symmetric per-row int8 quantization. Returns (codes, scales) with matrix ~= codes * scales[:, None]."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _sidecar_path(path, suffix):
+    return f"{path[:-4] if path.endswith('.npz') else path}{suffix}"
+
+
+def _exact_matrix_path(path):
+    return _sidecar_path(path, '.f32.npy')
+
+
+def _save_atomic(path, write_fn):
+    # A temp file per writer: several workers may build and save the same index at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+        os.chmod(tmp_path, 0o644) # mkstemp creates 0600; a snapshot built as root must stay readable by the server user
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# --- Memory-Mapped Records ---
+class MappedRecords(Sequence):
+    """Read-only sequence of product records stored as one UTF-8 JSON object per record.
+
+    The records file is memory-mapped and an int64 offsets table (n + 1 entries) gives each
+    record's byte range, so a record is only decoded when it is accessed. Processes that map
+    the same files share one page-cache copy instead of each holding the records as dicts.
+    """
+
+    def __init__(self, records_path, offsets_path):
+        self._offsets = np.load(offsets_path, mmap_mode='r')
+        # np.memmap cannot map an empty file
+        self._blob = np.memmap(records_path, dtype=np.uint8, mode='r') if os.path.getsize(records_path) else np.zeros(0, dtype=np.uint8)
+
+    @staticmethod
+    def write(records, records_path, offsets_path):
+        encoded = [json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in records]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(item) for item in encoded])
+        _save_atomic(records_path, lambda f: f.writelines(encoded))
+        _save_atomic(offsets_path, lambda f: np.save(f, offsets))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("record index out of range")
+        return json.loads(self._blob[int(self._offsets[row]):int(self._offsets[row + 1])].tobytes())
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+# --- Local Vector Index ---
+class LocalVectorIndex:
+    """In-process replacement for the Supabase `match_products` RPC.
+
+    Holds an L2-normalized float32 matrix (one row per product) and the matching product
+    records. A search is one matrix-vector product followed by an argpartition top-k.
+
+    With `storage` 'int8' (per-row scale) or 'float16', a compact copy of the matrix is scanned
+    first and only the best `match_count * rerank_factor` rows are re-scored exactly in float32.
+    When loaded from disk the float32 matrix is memory-mapped, so only re-ranked rows are paged in.
+
+    With `mmap=True` on load(), the float32 matrix, the product id array and the records are
+    all memory-mapped, so gunicorn workers loading the same files share them through the page
+    cache instead of each holding a private copy.
+    """
+
+    STORAGE_FORMATS = ('float32', 'float16', 'int8')
+    COARSE_BLOCK_ROWS = 256 # Rows upcast to float32 at a time during the coarse scan; a block stays in L2 cache
+
+    def __init__(self, embeddings, records, version=None, storage='float32', rerank_factor=4, normalized=False, product_ids=None):
+        if len(embeddings) != len(records):
+            raise ValueError(f"Embedding rows ({len(embeddings)}) != records ({len(records)}).")
+        if storage not in self.STORAGE_FORMATS:
+            raise ValueError(f"Unknown embedding storage '{storage}'. Expected one of {', '.join(self.STORAGE_FORMATS)}.")
+        # A memory-mapped matrix from save() is already normalized and must stay mapped
+        self.embeddings = embeddings if normalized else _normalize_rows(embeddings)
+        if isinstance(records, MappedRecords):
+            self.records = records # Written by save() with RECORD_FIELDS only
+        else:
+            self.records = [{field: record.get(field) for field in RECORD_FIELDS} for record in records]
+        self.product_ids = product_ids if product_ids is not None else np.array([record['product_id'] for record in self.records])
+        self.version = version
+        self._row_by_id = None # product_id -> row, built on first use by similarities()
+        self.storage = storage
+        self.rerank_factor = max(1, rerank_factor)
+        self._codes = self._scales = None
+        if storage == 'int8':
+            self._codes, self._scales = quantize_int8(self.embeddings)
+        elif storage == 'float16':
+            self._codes = np.asarray(self.embeddings, dtype=np.float16)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dimension(self):
+        return self.embeddings.shape[1]
+
+    def memory_bytes(self):
+        """Bytes held by the embedding matrices; a memory-mapped float32 matrix is reported separately."""
+        exact_bytes = int(self.embeddings.nbytes)
+        mapped = isinstance(self.embeddings, np.memmap)
+        coarse_bytes = 0
+        if self._codes is not None:
+            coarse_bytes = int(self._codes.nbytes) + (int(self._scales.nbytes) if self._scales is not None else 0)
+        return {
+            "storage": self.storage,
+            "coarse_bytes": coarse_bytes,
+            "float32_bytes": exact_bytes,
+            "float32_memory_mapped": mapped,
+            "records_memory_mapped": isinstance(self.records, MappedRecords),
+            "resident_bytes": coarse_bytes + (0 if mapped else exact_bytes)
+        }
+
+    def search(self, query_embedding, match_threshold, match_count, mask=None):
+        """Returns up to `match_count` records with cosine similarity > `match_threshold`, best first.
+
+        Each result is a copy of the product record with an added 'similarity' key, the same
+        shape the `match_products` RPC returns. With a bool `mask` only the eligible rows are
+        scored.
+        """
+        if match_count <= 0 or not len(self.records):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+        query = query / query_norm
+        rows = self._candidate_rows(query, match_count, mask)
+        if rows is not None and not rows.size:
+            return []
+        if self._codes is not None:
+            return self._search_quantized(query, match_threshold, match_count, rows)
+        if rows is None:
+            return self._top_k(self.embeddings @ query, match_threshold, match_count)
+        return self._top_k(self.embeddings[rows] @ query, match_threshold, match_count, rows)
+
+    def similarities(self, query_embedding, product_ids):
+        """Exact cosine similarity of `query_embedding` to the given products, NaN for ids not in the index."""
+        if self._row_by_id is None:
+            self._row_by_id = {str(product_id): row for row, product_id in enumerate(self.product_ids)}
+        rows = np.array([self._row_by_id.get(product_id, -1) for product_id in product_ids], dtype=np.int64)
+        scores = np.full(len(rows), np.nan, dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query_norm = np.linalg.norm(query)
+        known = rows >= 0
+        if query_norm > 0 and known.any():
+            scores[known] = np.asarray(self.embeddings[rows[known]], dtype=np.float32) @ (query / query_norm)
+        return scores
+
+    def _candidate_rows(self, query, match_count, mask=None):
+        # Rows to score for `query`, or None for all of them; subclasses narrow this down
+        return None if mask is None else np.flatnonzero(mask)
+
+    def _coarse_scores(self, query, rows=None):
+        codes = self._codes if rows is None else self._codes[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.COARSE_BLOCK_ROWS):
+            block = codes[start:start + self.COARSE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self._scales is not None:
+            scores *= self._scales if rows is None else self._scales[rows]
+        return scores
+
+    def _search_quantized(self, query, match_threshold, match_count, rows=None):
+        approx_scores = self._coarse_scores(query, rows)
+        n_candidates = min(len(approx_scores), match_count * self.rerank_factor)
+        candidates = np.argpartition(approx_scores, -n_candidates)[-n_candidates:]
+        candidate_rows = np.sort(candidates if rows is None else rows[candidates]) # Sorted for sequential reads from a memory map
+        exact_scores = np.asarray(self.embeddings[candidate_rows], dtype=np.float32) @ query
+        return self._top_k(exact_scores, match_threshold, match_count, candidate_rows)
+
+    def search_batch(self, query_matrix, match_threshold, match_count):
+        """Runs `search` for every row of `query_matrix` with a single matrix-matrix product."""
+        queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+        if match_count <= 0 or not len(self.records):
+            return [[] for _ in range(len(queries))]
+        if self._codes is not None:
+            return [self.search(query, match_threshold, match_count) for query in queries]
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        zero_rows = (norms == 0).ravel()
+        norms[norms == 0] = 1.0
+        all_scores = (queries / norms) @ self.embeddings.T
+        return [
+            [] if zero_rows[row] else self._top_k(scores, match_threshold, match_count)
+            for row, scores in enumerate(all_scores)
+        ]
+
+    def _top_k(self, scores, match_threshold, match_count, rows=None):
+        # `rows` maps positions in `scores` back to record rows when only a subset was scored
+        candidate_idx = np.flatnonzero(scores > match_threshold)
+        if candidate_idx.size > match_count:
+            part = np.argpartition(scores[candidate_idx], -match_count)[-match_count:]
+            candidate_idx = candidate_idx[part]
+        ordered = candidate_idx[np.argsort(-scores[candidate_idx], kind='stable')]
+        if rows is None:
+            return [dict(self.records[i], similarity=float(scores[i])) for i in ordered]
+        return [dict(self.records[rows[i]], similarity=float(scores[i])) for i in ordered]
+
+    # --- Persistence ---
+    EXTRA_ARRAYS = () # Constructor arguments a subclass stores in the .npz alongside the records
+
+    def _extra_arrays(self):
+        return {}
+
+    def save(self, path):
+        """Writes the index as `path` (.npz) plus memory-mappable files beside it.
+
+        The sidecars are the float32 matrix (.f32.npy), the product ids (.ids.npy) and the
+        records (.records.jsonl with a .records.offsets.npy table). They are written first; the
+        .npz is the commit point and records the matrix shape it expects.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        _save_atomic(_exact_matrix_path(path), lambda f: np.save(f, np.asarray(self.embeddings, dtype=np.float32)))
+        _save_atomic(_sidecar_path(path, '.ids.npy'), lambda f: np.save(f, np.asarray(self.product_ids, dtype=str)))
+        MappedRecords.write(self.records, _sidecar_path(path, '.records.jsonl'), _sidecar_path(path, '.records.offsets.npy'))
+        _save_atomic(path, lambda f: np.savez(
+            f,
+            embeddings_shape=np.array(self.embeddings.shape),
+            version=np.array(self.version or ''),
+            **self._extra_arrays()
+        ))
+
+    @classmethod
+    def load(cls, path, storage='float32', rerank_factor=4, mmap=False, **options):
+        """Loads an index written by save().
+
+        With `mmap` (or quantized storage) the float32 matrix is memory-mapped; with `mmap` the
+        ids and records are too. `options` are passed to the constructor. Arrays listed in
+        EXTRA_ARRAYS are restored when the file has them, so a subclass can also load an index
+        saved without them. Files written by earlier versions (records inside the .npz) still load.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            version = str(data['version']) or None
+            options.update({name: data[name] for name in cls.EXTRA_ARRAYS if name in data and name not in options})
+            inline_records = json.loads(str(data['records'])) if 'records' in data else None
+            if 'embeddings' in data: # Single-file format written before the .f32.npy split
+                return cls(data['embeddings'], inline_records, version=version, storage=storage, rerank_factor=rerank_factor, **options)
+            expected_shape = tuple(int(n) for n in data['embeddings_shape'])
+        embeddings = np.load(_exact_matrix_path(path), mmap_mode='r' if mmap or storage != 'float32' else None)
+        if embeddings.shape != expected_shape:
+            raise ValueError(f"Embedding matrix shape {embeddings.shape} does not match the index ({expected_shape}).")
+        if inline_records is not None:
+            return cls(embeddings, inline_records, version=version, storage=storage, rerank_factor=rerank_factor, normalized=True, **options)
+
+        records = MappedRecords(_sidecar_path(path, '.records.jsonl'), _sidecar_path(path, '.records.offsets.npy'))
+        product_ids = np.load(_sidecar_path(path, '.ids.npy'), mmap_mode='r' if mmap else None)
+        if not mmap:
+            records = list(records)
+        return cls(embeddings, records, version=version, storage=storage, rerank_factor=rerank_factor, normalized=True, product_ids=product_ids, **options)
+
+
+def build_local_index(catalog_path, encode_fn, text_fn, model_name, cache_path=None, batch_size=64,
+                      storage='float32', rerank_factor=4, index_cls=LocalVectorIndex, index_options=None, mmap=False):
+    """Builds (or loads from `cache_path`) a LocalVectorIndex for the catalog at `catalog_path`.
+
+    `encode_fn(list_of_texts, batch_size)` must return a 2-D array of embeddings. The cache is
+    only reused when its version matches the current model name and catalog texts.
+    `index_cls` selects the index implementation (e.g. ann_index.IVFVectorIndex) and
+    `index_options` are extra constructor arguments for it. `mmap` is passed to load(); a
+    freshly built index is reloaded from the cache so it is mapped too.
+    """
+    index_options = index_options or {}
+    products = load_catalog(catalog_path)
+    texts = [text_fn(product) for product in products]
+    version = compute_index_version(model_name, texts)
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            index = index_cls.load(cache_path, storage=storage, rerank_factor=rerank_factor, mmap=mmap, **index_options)
+            if index.version == version:
+                logging.info(f"Loaded local vector index ({len(index)} products, version {version}) from cache.")
+                if getattr(index, 'trained_on_init', False):
+                    # The cache predates this index type's own arrays; store them for the next start
+                    _save_index(index, cache_path)
+                return index
+            logging.info(f"Cached local index version {index.version} is stale (current {version}). Rebuilding.")
+        except Exception as e:
+            logging.warning(f"Failed to load cached local index from '{cache_path}': {e}. Rebuilding.")
+
+    start_time = time.perf_counter()
+    embeddings = encode_fn(texts, batch_size)
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"Embedded {len(texts)} catalog products in {elapsed:.2f}s for the local vector index.")
+    index = index_cls(embeddings, products, version=version, storage=storage, rerank_factor=rerank_factor, **index_options)
+
+    if cache_path and _save_index(index, cache_path) and (mmap or storage != 'float32'):
+        # Reload so the float32 matrix (and with mmap, the records) is memory-mapped instead of resident
+        index = index_cls.load(cache_path, storage=storage, rerank_factor=rerank_factor, mmap=mmap, **index_options)
+    return index
+
+
+def _save_index(index, cache_path):
+    try:
+        index.save(cache_path)
+        logging.info(f"Saved local vector index to '{cache_path}'.")
+        return True
+    except Exception as e:
+        logging.warning(f"Failed to save local index cache to '{cache_path}': {e}")
+        return False
@@ -1,13 +1,271 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from lxml import etree
+import os
 import json
 import re
 import time
-from urllib.parse import urljoin
+import hashlib
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response for pages served from the page cache"""
+
+    def __init__(self, status_code, text, from_cache=True):
+        self.status_code = status_code
+        self.text = text
+        self.from_cache = from_cache
+
+
+class PageCache:
+    """On-disk HTML cache keyed by URL, storing the validators needed for conditional GETs.
+
+    Each URL maps to `<sha1>.html` (the body) and `<sha1>.json` (url, ETag, Last-Modified).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.html"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, url):
+        """Returns (html, metadata) for a cached URL, or (None, None)"""
+        html_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            with open(html_path, 'r', encoding='utf-8') as f:
+                return f.read(), metadata
+        except (OSError, ValueError):
+            return None, None
+
+    def store(self, url, html, etag=None, last_modified=None):
+        html_path, meta_path = self._paths(url)
+        metadata = {"url": url, "etag": etag, "last_modified": last_modified, "fetched_at": time.time()}
+        # Body first, then metadata, each written atomically, so a crash never leaves a half-written entry
+        for path, content in ((html_path, html), (meta_path, json.dumps(metadata))):
+            tmp_path = f"{path}.tmp.{threading.get_ident()}"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+
+# --- Catalog Page Parsing ---
+def generate_product_id(product_name):
+    """Generate a product ID from the product name"""
+    # Convert to lowercase, replace spaces with underscores, remove special characters
+    product_id = product_name.lower()
+    product_id = product_id.replace(' - ', '_')
+    product_id = product_id.replace(' ', '_')
+    product_id = re.sub(r'[^\w_]', '', product_id)
+    return f"shl_{product_id}"
+
+
+def parse_catalog_page(html, product_type, base_url):
+    """Parse a catalog page into product link dicts (module-level so a process pool can run it)"""
+    soup = BeautifulSoup(html, 'lxml')
+    product_links = []
+    
+    # Find all product links in the table
+    product_rows = soup.select('tr')
+    for row in product_rows:
+        product_link = row.select_one('td a')
+        if product_link and product_link.get('href'):
+            full_url = urljoin(base_url, product_link.get('href'))
+            product_name = product_link.text.strip()
+            product_id = generate_product_id(product_name)
+            product_links.append({
+                "url": full_url,
+                "product_name": product_name,
+                "product_id": product_id,
+                "product_type": "Individual Test Solution" if product_type == 1 else "Pre-packaged Job Solution"
+            })
+    
+    return product_links
+
+
+# --- Product Page Parsing ---
+PRODUCT_TYPE_MAPPING = {
+    'A': "Ability & Aptitude",
+    'K': "Knowledge & Skills",
+    'P': "Personality & Behavior"
+}
+DURATION_PATTERN = re.compile(r'(\d+)\s*minutes')
+
+
+def _class_xpath(class_name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+# Comments and processing instructions never contribute text, so they are dropped while parsing
+HTML_PARSER = etree.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True, no_network=True)
+# Matches BeautifulSoup's get_text(): text inside script/style/template/ruby annotations is skipped
+TEXT_XPATH = etree.XPath(".//text()[not(ancestor::script or ancestor::style or ancestor::template or ancestor::rt or ancestor::rp)]")
+ROWS_XPATH = etree.XPath("//tr")
+CELLS_XPATH = etree.XPath(".//td")
+IMAGES_XPATH = etree.XPath(".//img")
+REMOTE_TESTING_FALLBACK_XPATH = etree.XPath(f"//*[{_class_xpath('remote-testing')}]//*[{_class_xpath('green-dot')}]")
+ADAPTIVE_IRT_FALLBACK_XPATH = etree.XPath(f"//*[{_class_xpath('adaptive-irt')}]//*[{_class_xpath('green-dot')}]")
+TEST_TYPE_IMAGES_XPATH = etree.XPath(f"//*[{_class_xpath('test-type')}]//img")
+DESCRIPTION_XPATH = etree.XPath(f"//*[{_class_xpath('product-description')}]")
+SECTIONS_XPATH = etree.XPath(f"//*[{_class_xpath('product-details-section')}]")
+SECTION_HEADING_XPATH = etree.XPath(".//h3")
+LIST_ITEMS_XPATH = etree.XPath(".//li")
+
+
+def _text(element):
+    return "".join(TEXT_XPATH(element))
+
+
+def _indicator_set(cell):
+    """True if a table cell shows a green dot/checkmark image or a 'Yes'/'✓' text indicator"""
+    images = IMAGES_XPATH(cell)
+    if images:
+        src = images[0].get('src', '').lower()
+        if 'green' in src or 'check' in src:
+            return True
+    cell_text = _text(cell).strip()
+    return bool(cell_text) and ('yes' in cell_text.lower() or '✓' in cell_text)
+
+
+def _add_product_types(product_data, text):
+    for key, value in PRODUCT_TYPE_MAPPING.items():
+        if key in text or value in text:
+            if key not in product_data["product_type_keys"]:
+                product_data["product_type_keys"].append(key)
+            if value not in product_data["product_type"]:
+                product_data["product_type"].append(value)
+
+
+def parse_product_page(html, product_info):
+    """Parse a product page into a product record.
+
+    Walks the table rows once (Remote Testing, Adaptive/IRT and Test Type are all read in the
+    same pass) with precompiled XPath over an lxml tree.
+    """
+    # Initialize product data with basic info
+    product_data = {
+        "product_id": product_info["product_id"],
+        "product_name": product_info["product_name"],
+        "url": product_info["url"],
+        "solution_type": product_info["product_type"],
+        "remote_testing": False,
+        "adaptive_irt": False,
+        "product_type_keys": [],
+        "product_type": [],
+        "description": "",
+        "target_audience": [],
+        "measured_constructs": [],
+        "job_roles": [],
+        "industry": [],
+        "features": [],
+        "duration_minutes": 0
+    }
+
+    root = etree.fromstring(html.encode('utf-8'), HTML_PARSER) if html.strip() else None
+    if root is None:
+        return product_data
+
+    for row in ROWS_XPATH(root):
+        row_text = _text(row)
+        is_remote_row = 'Remote Testing' in row_text
+        is_adaptive_row = 'Adaptive' in row_text
+        is_test_type_row = 'Test Type' in row_text
+        if not (is_remote_row or is_adaptive_row or is_test_type_row):
+            continue
+        cells = CELLS_XPATH(row)
+        if len(cells) < 2:
+            continue
+        if is_remote_row and _indicator_set(cells[1]):
+            product_data["remote_testing"] = True
+        if is_adaptive_row and _indicator_set(cells[1]):
+            product_data["adaptive_irt"] = True
+        if is_test_type_row:
+            # Check for type indicators in the cell text, then in image alt text
+            _add_product_types(product_data, _text(cells[1]))
+            for img in IMAGES_XPATH(cells[1]):
+                _add_product_types(product_data, img.get('alt', ''))
+
+    # Fallback to original selectors if not found
+    if not product_data["remote_testing"] and REMOTE_TESTING_FALLBACK_XPATH(root):
+        product_data["remote_testing"] = True
+    if not product_data["adaptive_irt"] and ADAPTIVE_IRT_FALLBACK_XPATH(root):
+        product_data["adaptive_irt"] = True
+    if not product_data["product_type_keys"]:
+        for img in TEST_TYPE_IMAGES_XPATH(root):
+            _add_product_types(product_data, img.get('alt', ''))
+
+    # Extract description
+    description_elements = DESCRIPTION_XPATH(root)
+    if description_elements:
+        product_data["description"] = _text(description_elements[0]).strip()
+
+    # Extract other details from sections
+    for section in SECTIONS_XPATH(root):
+        headings = SECTION_HEADING_XPATH(section)
+        if not headings:
+            continue
+
+        heading_text = _text(headings[0]).strip().lower()
+        items = [_text(item).strip() for item in LIST_ITEMS_XPATH(section)]
+
+        if 'target audience' in heading_text:
+            product_data["target_audience"] = items
+        elif 'measured constructs' in heading_text or 'what it measures' in heading_text:
+            product_data["measured_constructs"] = items
+        elif 'job roles' in heading_text or 'job titles' in heading_text:
+            product_data["job_roles"] = items
+        elif 'industry' in heading_text:
+            product_data["industry"] = items
+        elif 'features' in heading_text:
+            product_data["features"] = items
+
+    # Extract duration if available
+    for feature in product_data["features"]:
+        match = DURATION_PATTERN.search(feature)
+        if match:
+            product_data["duration_minutes"] = int(match.group(1))
+            break
+
+    return product_data
 
 
 class SHLScraper:
-    def __init__(self):
+    def __init__(self, max_workers=1, requests_per_second=1.0, burst=1, cache_dir=None, offline=False, timeout=30,
+                 parse_processes=0, queue_depth=None):
         self.base_url = "https://www.shl.com"
         self.catalog_url = "https://www.shl.com/solutions/products/product-catalog/?start={}&type={}"
         self.headers = {
@@ -16,210 +274,138 @@ class SHLScraper:
         self.products = []
         # Type 1 is for Individual Test Solutions, Type 2 is for Pre-packaged Job Solutions
         self.product_types = [1, 2]
+        # Concurrency settings: worker threads, plus a per-host token bucket so we stay polite
+        self.max_workers = max(1, max_workers)
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.rate_limiters = {}
+        self.rate_limiters_lock = threading.Lock()
+        # With parse_processes > 0, fetched HTML is parsed in a process pool instead of the fetching
+        # thread; queue_depth bounds the pages fetched or parsed but not yet consumed
+        self.parse_processes = parse_processes
+        self.queue_depth = queue_depth or 2 * max(self.max_workers, parse_processes)
+        # One pooled keep-alive session shared by all workers
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, self.max_workers))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        # Optional on-disk page cache; offline mode replays pages from it without any network access
+        if offline and not cache_dir:
+            raise ValueError("Offline mode requires a cache_dir")
+        self.cache = PageCache(cache_dir) if cache_dir else None
+        self.offline = offline
+        self.fetch_stats = {"downloaded": 0, "not_modified": 0, "offline_hits": 0, "offline_misses": 0}
+        self.fetch_stats_lock = threading.Lock()
+
+    def wait_for_rate_limit(self, url):
+        """Blocks until the per-host token bucket allows another request to this URL's host"""
+        host = urlparse(url).netloc
+        with self.rate_limiters_lock:
+            limiter = self.rate_limiters.get(host)
+            if limiter is None:
+                limiter = self.rate_limiters[host] = TokenBucket(self.requests_per_second, self.burst)
+        limiter.acquire()
+
+    def count_fetch(self, outcome):
+        with self.fetch_stats_lock:
+            self.fetch_stats[outcome] += 1
+
+    def fetch(self, url):
+        """Rate-limited GET through the pooled session, revalidating against the page cache if enabled"""
+        cached_html, metadata = self.cache.load(url) if self.cache else (None, None)
+
+        if self.offline:
+            if cached_html is None:
+                self.count_fetch("offline_misses")
+                # 504 is what HTTP caches answer for only-if-cached requests they cannot satisfy
+                return CachedResponse(504, "")
+            self.count_fetch("offline_hits")
+            return CachedResponse(200, cached_html)
+
+        conditional_headers = {}
+        if cached_html is not None:
+            if metadata.get("etag"):
+                conditional_headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = metadata["last_modified"]
 
-    def get_product_links(self, page_num=0, product_type=1):
-        """Get all product links from a catalog page"""
+        self.wait_for_rate_limit(url)
+        response = self.session.get(url, headers=conditional_headers, timeout=self.timeout)
+
+        if response.status_code == 304 and cached_html is not None:
+            self.count_fetch("not_modified")
+            return CachedResponse(200, cached_html)
+        if response.status_code == 200:
+            self.count_fetch("downloaded")
+            if self.cache:
+                self.cache.store(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response
+
+    def get_product_links(self, page_num=0, product_type=1, parse_pool=None):
+        """Get all product links from a catalog page, parsing in `parse_pool` when given"""
         # Each page has 12 products
         start_index = page_num * 12
         url = self.catalog_url.format(start_index, product_type)
         print(f"Scraping catalog page {page_num+1} (type {product_type}): {url}")
         
-        response = requests.get(url, headers=self.headers)
+        response = self.fetch(url)
         if response.status_code != 200:
             print(f"Failed to fetch page {page_num+1}: {response.status_code}")
             return []
         
-        soup = BeautifulSoup(response.text, 'lxml')
-        product_links = []
-        
-        # Find all product links in the table
-        product_rows = soup.select('tr')
-        for row in product_rows:
-            product_link = row.select_one('td a')
-            if product_link and product_link.get('href'):
-                full_url = urljoin(self.base_url, product_link.get('href'))
-                product_name = product_link.text.strip()
-                product_id = self.generate_product_id(product_name)
-                product_links.append({
-                    "url": full_url,
-                    "product_name": product_name,
-                    "product_id": product_id,
-                    "product_type": "Individual Test Solution" if product_type == 1 else "Pre-packaged Job Solution"
-                })
-        
-        return product_links
+        if parse_pool is not None:
+            return parse_pool.submit(parse_catalog_page, response.text, product_type, self.base_url).result()
+        return parse_catalog_page(response.text, product_type, self.base_url)
 
     def generate_product_id(self, product_name):
         """Generate a product ID from the product name"""
-        # Convert to lowercase, replace spaces with underscores, remove special characters
-        product_id = product_name.lower()
-        product_id = product_id.replace(' - ', '_')
-        product_id = product_id.replace(' ', '_')
-        product_id = re.sub(r'[^\w_]', '', product_id)
-        return f"shl_{product_id}"
+        return generate_product_id(product_name)
 
-    def extract_product_details(self, product_info):
-        """Extract detailed information for a product"""
+    def fetch_product_page(self, product_info):
+        """Fetch a product page's HTML, or None if the request failed"""
         url = product_info["url"]
         print(f"Scraping product: {product_info['product_name']} - {url}")
         
-        response = requests.get(url, headers=self.headers)
+        response = self.fetch(url)
         if response.status_code != 200:
             print(f"Failed to fetch product details: {response.status_code}")
             return None
-        
-        soup = BeautifulSoup(response.text, 'lxml')
-        
-        # Initialize product data with basic info
-        product_data = {
-            "product_id": product_info["product_id"],
-            "product_name": product_info["product_name"],
-            "url": url,
-            "solution_type": product_info["product_type"],
-            "remote_testing": False,
-            "adaptive_irt": False,
-            "product_type_keys": [],
-            "product_type": [],
-            "description": "",
-            "target_audience": [],
-            "measured_constructs": [],
-            "job_roles": [],
-            "industry": [],
-            "features": [],
-            "duration_minutes": 0
-        }
-        
-        # Look for table rows containing Remote Testing text
-        for row in soup.find_all('tr'):
-            row_text = row.get_text().strip()
-            if 'Remote Testing' in row_text:
-                # Check if there's a green dot or checkmark in the next cell
-                cells = row.find_all('td')
-                if len(cells) > 1:
-                    # Check for green dot image or any indicator
-                    img = cells[1].find('img')
-                    if img and ('green' in img.get('src', '').lower() or 'check' in img.get('src', '').lower()):
-                        product_data["remote_testing"] = True
-                    # Also check for text indicators like 'Yes' or '✓'
-                    cell_text = cells[1].get_text().strip()
-                    if cell_text and ('yes' in cell_text.lower() or '✓' in cell_text):
-                        product_data["remote_testing"] = True
-            
-            if 'Adaptive/IRT' in row_text or 'Adaptive' in row_text:
-                # Similar check for Adaptive/IRT
-                cells = row.find_all('td')
-                if len(cells) > 1:
-                    img = cells[1].find('img')
-                    if img and ('green' in img.get('src', '').lower() or 'check' in img.get('src', '').lower()):
-                        product_data["adaptive_irt"] = True
-                    cell_text = cells[1].get_text().strip()
-                    if cell_text and ('yes' in cell_text.lower() or '✓' in cell_text):
-                        product_data["adaptive_irt"] = True
-        
-        # Fallback to original selectors if not found
-        if not product_data["remote_testing"]:
-            remote_testing_element = soup.select_one('.remote-testing .green-dot')
-            if remote_testing_element:
-                product_data["remote_testing"] = True
-                
-        if not product_data["adaptive_irt"]:
-            adaptive_irt_element = soup.select_one('.adaptive-irt .green-dot')
-            if adaptive_irt_element:
-                product_data["adaptive_irt"] = True
-        
-        # Look for Test Type row
-        for row in soup.find_all('tr'):
-            row_text = row.get_text().strip()
-            if 'Test Type' in row_text:
-                cells = row.find_all('td')
-                if len(cells) > 1:
-                    # Check for test type indicators in the cell
-                    type_cell = cells[1]
-                    type_text = type_cell.get_text().strip()
-                    
-                    # Define type mapping
-                    type_mapping = {
-                        'A': "Ability & Aptitude",
-                        'K': "Knowledge & Skills",
-                        'P': "Personality & Behavior"
-                    }
-                    
-                    # Check for type indicators in text
-                    for key, value in type_mapping.items():
-                        if key in type_text or value in type_text:
-                            if key not in product_data["product_type_keys"]:
-                                product_data["product_type_keys"].append(key)
-                            if value not in product_data["product_type"]:
-                                product_data["product_type"].append(value)
-                    
-                    # Also check for images with alt text
-                    for img in type_cell.find_all('img'):
-                        alt_text = img.get('alt', '')
-                        for key, value in type_mapping.items():
-                            if key in alt_text or value in alt_text:
-                                if key not in product_data["product_type_keys"]:
-                                    product_data["product_type_keys"].append(key)
-                                if value not in product_data["product_type"]:
-                                    product_data["product_type"].append(value)
-        
-        # Fallback to the original method if no test types found yet
-        if not product_data["product_type_keys"]:
-            test_type_elements = soup.select('.test-type img')
-            type_mapping = {
-                'A': "Ability & Aptitude",
-                'K': "Knowledge & Skills",
-                'P': "Personality & Behavior"
-            }
-            
-            for element in test_type_elements:
-                alt_text = element.get('alt', '')
-                for key, value in type_mapping.items():
-                    if key in alt_text or value in alt_text:
-                        if key not in product_data["product_type_keys"]:
-                            product_data["product_type_keys"].append(key)
-                        if value not in product_data["product_type"]:
-                            product_data["product_type"].append(value)
-        
-        # Extract description
-        description_element = soup.select_one('.product-description')
-        if description_element:
-            product_data["description"] = description_element.text.strip()
-        
-        # Extract other details from sections
-        sections = soup.select('.product-details-section')
-        for section in sections:
-            heading = section.select_one('h3')
-            if not heading:
-                continue
-                
-            heading_text = heading.text.strip().lower()
-            list_items = section.select('li')
-            
-            if 'target audience' in heading_text:
-                product_data["target_audience"] = [item.text.strip() for item in list_items]
-            elif 'measured constructs' in heading_text or 'what it measures' in heading_text:
-                product_data["measured_constructs"] = [item.text.strip() for item in list_items]
-            elif 'job roles' in heading_text or 'job titles' in heading_text:
-                product_data["job_roles"] = [item.text.strip() for item in list_items]
-            elif 'industry' in heading_text:
-                product_data["industry"] = [item.text.strip() for item in list_items]
-            elif 'features' in heading_text:
-                product_data["features"] = [item.text.strip() for item in list_items]
-        
-        # Extract duration if available
-        duration_pattern = r'(\d+)\s*minutes'
-        for feature in product_data["features"]:
-            match = re.search(duration_pattern, feature)
-            if match:
-                product_data["duration_minutes"] = int(match.group(1))
-                break
-        
-        return product_data
+        return response.text
+
+    def extract_product_details(self, product_info):
+        """Extract detailed information for a product"""
+        html = self.fetch_product_page(product_info)
+        if html is None:
+            return None
+        return parse_product_page(html, product_info)
+
+    def fetch_and_submit_parse(self, product_info, parse_pool):
+        """I/O stage of the pipeline: fetch the page, then hand the HTML to the parse pool"""
+        html = self.fetch_product_page(product_info)
+        if html is None:
+            return None
+        return parse_pool.submit(parse_product_page, html, product_info)
+
+    def get_catalog_page(self, page_num, product_type, checkpoint=None, parse_pool=None):
+        """get_product_links, reusing (and recording) catalog pages in the crawl checkpoint"""
+        if checkpoint is not None:
+            product_links = checkpoint.catalog_pages.get((product_type, page_num))
+            if product_links is not None:
+                return product_links
+        product_links = self.get_product_links(page_num, product_type, parse_pool)
+        # Empty pages are not recorded: they may be a failed fetch rather than the end of the catalog
+        if checkpoint is not None and product_links:
+            checkpoint.record_catalog_page(product_type, page_num, product_links)
+        return product_links
+
+    def iter_scraped_products(self, max_pages=40, checkpoint=None):
+        """Yield product records in catalog order, skipping products the checkpoint marks as done"""
+        if self.max_workers > 1 or self.parse_processes > 0:
+            yield from self.iter_scraped_products_concurrently(max_pages, checkpoint)
+            return
 
-    def scrape_all_products(self, max_pages=40):
-        """Scrape all products from the catalog"""
-        all_products = []
-        
         # Scrape both Individual Test Solutions (type=1) and Pre-packaged Job Solutions (type=2)
         for product_type in self.product_types:
             print(f"\nScraping products for type: {product_type} ({'Individual Test Solutions' if product_type == 1 else 'Pre-packaged Job Solutions'})")
@@ -227,7 +413,7 @@ class SHLScraper:
             # Start from page 0 and continue until we reach the end or max_pages
             for page_num in range(max_pages):
                 # Get product links for the current page and product type
-                product_links = self.get_product_links(page_num, product_type)
+                product_links = self.get_catalog_page(page_num, product_type, checkpoint)
                 
                 # If no products found, we've reached the end for this product type
                 if not product_links:
@@ -236,24 +422,135 @@ class SHLScraper:
                     
                 print(f"Found {len(product_links)} products on page {page_num+1}")
                 
-                # Process each product on the page
+                # Process each product on the page (fetch() applies the per-host rate limit)
                 for product_info in product_links:
-                    # Add a delay to avoid overloading the server
-                    time.sleep(1)
+                    if checkpoint is not None and product_info["url"] in checkpoint.completed_urls:
+                        continue
                     product_data = self.extract_product_details(product_info)
                     if product_data:
-                        all_products.append(product_data)
+                        yield product_data
                 
                 # Check if there's a next page
                 # Each page has 12 products, if we get fewer, we've reached the end
                 if len(product_links) < 12:
                     print(f"Reached the last page for type {product_type}. Moving to next type.")
                     break
-        
+
+    def collect_product_links_concurrently(self, executor, max_pages, checkpoint=None, parse_pool=None):
+        """Fetch catalog pages for all product types in windows of max_workers pages per type.
+
+        The serial stop rules apply per type (an empty page or a page with fewer than 12 products
+        ends it), and links come back in the serial order: type by type, page by page.
+        """
+        links_by_type = {product_type: [] for product_type in self.product_types}
+        active_types = list(self.product_types)
+        for window_start in range(0, max_pages, self.max_workers):
+            page_nums = range(window_start, min(window_start + self.max_workers, max_pages))
+            futures = {
+                (product_type, page_num): executor.submit(self.get_catalog_page, page_num, product_type, checkpoint, parse_pool)
+                for product_type in active_types
+                for page_num in page_nums
+            }
+            for product_type in list(active_types):
+                for page_num in page_nums:
+                    page_links = futures[(product_type, page_num)].result()
+                    # If no products found, we've reached the end for this product type
+                    if not page_links:
+                        print(f"No more products found on page {page_num+1} for type {product_type}. Moving to next type.")
+                        active_types.remove(product_type)
+                        break
+                    print(f"Found {len(page_links)} products on page {page_num+1} for type {product_type}")
+                    links_by_type[product_type].extend(page_links)
+                    # Each page has 12 products, if we get fewer, we've reached the end
+                    if len(page_links) < 12:
+                        print(f"Reached the last page for type {product_type}. Moving to next type.")
+                        active_types.remove(product_type)
+                        break
+            if not active_types:
+                break
+        return [link for product_type in self.product_types for link in links_by_type[product_type]]
+
+    def iter_scraped_products_concurrently(self, max_pages=40, checkpoint=None):
+        """Concurrent version of iter_scraped_products with identical output and ordering.
+
+        Threads do the fetching. With parse_processes > 0 this becomes a two-stage pipeline: each
+        fetched page goes to a process pool for parsing, so parse CPU is spread across cores
+        instead of contending for the GIL with the fetch threads.
+        """
+        print(f"Scraping with {self.max_workers} workers at up to {self.requests_per_second} requests/sec per host"
+              + (f", parsing in {self.parse_processes} processes" if self.parse_processes > 0 else ""))
+        parse_pool = ProcessPoolExecutor(max_workers=self.parse_processes) if self.parse_processes > 0 else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Catalog pages for both product types are paginated concurrently
+                product_links = self.collect_product_links_concurrently(executor, max_pages, checkpoint, parse_pool)
+                if checkpoint is not None:
+                    product_links = [link for link in product_links if link["url"] not in checkpoint.completed_urls]
+                print(f"Found {len(product_links)} product links to fetch. Fetching product details...")
+
+                # Pages are consumed in catalog order, so the output matches the serial run, and at
+                # most queue_depth are fetched (or parsed) ahead of the consumer
+                pending = deque()
+                for product_info in product_links:
+                    if len(pending) >= self.queue_depth:
+                        product_data = self.next_product(pending)
+                        if product_data:
+                            yield product_data
+                    if parse_pool is None:
+                        pending.append(executor.submit(self.extract_product_details, product_info))
+                    else:
+                        pending.append(executor.submit(self.fetch_and_submit_parse, product_info, parse_pool))
+                while pending:
+                    product_data = self.next_product(pending)
+                    if product_data:
+                        yield product_data
+        finally:
+            if parse_pool is not None:
+                parse_pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def next_product(pending):
+        # A fetch future resolves to the product, or with a parse pool to the parse future (None on a failed fetch)
+        result = pending.popleft().result()
+        return result.result() if isinstance(result, Future) else result
+
+    def scrape_all_products(self, max_pages=40):
+        """Scrape all products from the catalog"""
+        all_products = list(self.iter_scraped_products(max_pages))
         print(f"Total products scraped: {len(all_products)}")
+        print(f"Fetch stats: {self.fetch_stats}")
         self.products = all_products
         return all_products
 
+    def crawl_to_jsonl(self, jsonl_path="shl_products.jsonl", checkpoint_path=None, max_pages=40):
+        """Stream product records to a JSONL file as they complete, resuming from the checkpoint.
+
+        Only the checkpoint state (finished catalog pages and product URLs) is kept in memory,
+        never the scraped records themselves.
+        """
+        checkpoint_path = checkpoint_path or f"{jsonl_path}.checkpoint"
+        truncate_partial_line(jsonl_path)
+        checkpoint = CrawlCheckpoint(checkpoint_path)
+        # A record can reach the JSONL just before a crash stops the checkpoint write
+        checkpoint.completed_urls.update(iter_jsonl_urls(jsonl_path))
+        if checkpoint.completed_urls or checkpoint.catalog_pages:
+            print(f"Resuming crawl: {len(checkpoint.completed_urls)} products and {len(checkpoint.catalog_pages)} catalog pages already done")
+
+        written = 0
+        try:
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                for product_data in self.iter_scraped_products(max_pages, checkpoint):
+                    f.write(json.dumps(product_data, ensure_ascii=False) + "\n")
+                    f.flush()
+                    checkpoint.record_product(product_data["url"])
+                    written += 1
+        finally:
+            checkpoint.close()
+
+        print(f"Wrote {written} new products to {jsonl_path} ({len(checkpoint.completed_urls)} in total)")
+        print(f"Fetch stats: {self.fetch_stats}")
+        return written
+
     def save_to_json(self, filename="shl_products.json"):
         """Save scraped products to a JSON file"""
         if not self.products:
@@ -266,6 +563,133 @@ class SHLScraper:
         return filename
 
 
+# --- Resumable Crawl Output ---
+def truncate_partial_line(path):
+    """Drop a trailing line left half-written by a crash so appends start on a clean line"""
+    if not os.path.exists(path):
+        return
+    good_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.endswith(b"\n"):
+                good_size += len(line)
+    if good_size != os.path.getsize(path):
+        print(f"Truncating partial last line in {path}")
+        with open(path, 'r+b') as f:
+            f.truncate(good_size)
+
+
+def iter_jsonl_records(path):
+    """Yield records from a JSONL file one line at a time"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable line {line_number} in {path}")
+
+
+def iter_jsonl_urls(path):
+    for record in iter_jsonl_records(path):
+        if record.get("url"):
+            yield record["url"]
+
+
+class CrawlCheckpoint:
+    """Append-only log of finished catalog pages (with their links) and finished product URLs.
+
+    Each line is either {"product_type", "start", "links"} for a catalog page or {"url"} for a
+    product whose record has been written. Appending keeps every update O(1) and crash-safe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.catalog_pages = {} # (product_type, page_num) -> product links
+        self.completed_urls = set()
+        truncate_partial_line(path)
+        for entry in iter_jsonl_records(path):
+            if "url" in entry:
+                self.completed_urls.add(entry["url"])
+            elif "links" in entry:
+                self.catalog_pages[(entry["product_type"], entry["start"] // 12)] = entry["links"]
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def append(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def record_catalog_page(self, product_type, page_num, product_links):
+        self.catalog_pages[(product_type, page_num)] = product_links
+        self.append({"product_type": product_type, "start": page_num * 12, "links": product_links})
+
+    def record_product(self, url):
+        self.completed_urls.add(url)
+        self.append({"url": url})
+
+    def close(self):
+        self.file.close()
+
+
+def compact_jsonl(jsonl_path="shl_products.jsonl", json_path="shl_products.json"):
+    """Rewrite a crawl's JSONL output as the indented JSON array the indexer expects.
+
+    Streams record by record, dropping repeated URLs (first occurrence wins); the result is
+    byte-identical to json.dump(records, indent=2).
+    """
+    seen_urls = set()
+    count = 0
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in iter_jsonl_records(jsonl_path):
+            if record.get("url") in seen_urls:
+                continue
+            seen_urls.add(record.get("url"))
+            body = json.dumps(record, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+            f.write(("[\n  " if count == 0 else ",\n  ") + body)
+            count += 1
+        f.write("\n]" if count else "[]")
+    os.replace(tmp_path, json_path)
+    print(f"Compacted {count} products from {jsonl_path} into {json_path}")
+    return count
+
+
 if __name__ == "__main__":
-    scraper = SHLScraper()
-    scraper.save_to_json()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape the SHL product catalog")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent fetch workers (1 = serial)")
+    parser.add_argument("--rps", type=float, default=1.0, help="Maximum requests per second per host")
+    parser.add_argument("--burst", type=int, default=1, help="Token bucket burst size")
+    parser.add_argument("--parse-processes", type=int, default=0, help="Parse pages in this many processes (0 = in the fetch threads)")
+    parser.add_argument("--queue-depth", type=int, default=None, help="Max pages fetched or parsed ahead of the writer (default: 2x workers)")
+    parser.add_argument("--output", default="shl_products.json", help="Output JSON file")
+    parser.add_argument("--jsonl", default="shl_products.jsonl", help="Incremental JSONL output (--resume continues from it)")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <jsonl>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted crawl from the JSONL output and checkpoint instead of starting over")
+    parser.add_argument("--compact-only", action="store_true", help="Only compact the JSONL into --output")
+    parser.add_argument("--cache-dir", default=None, help="On-disk page cache directory (enables conditional GETs)")
+    parser.add_argument("--offline", action="store_true", help="Replay pages from --cache-dir without network access")
+    args = parser.parse_args()
+
+    if not args.compact_only:
+        checkpoint_path = args.checkpoint or f"{args.jsonl}.checkpoint"
+        existing = [path for path in (args.jsonl, checkpoint_path) if os.path.exists(path)]
+        if args.resume and existing:
+            print(f"WARNING: resuming from {', '.join(existing)}; products already scraped are NOT fetched again. Drop --resume to refresh the catalog.")
+        elif existing:
+            # A plain run refreshes the whole catalog, so earlier results must not be reused
+            print(f"Starting a fresh crawl, discarding {', '.join(existing)}.")
+            for path in existing:
+                os.remove(path)
+        scraper = SHLScraper(
+            max_workers=args.workers, requests_per_second=args.rps, burst=args.burst,
+            cache_dir=args.cache_dir, offline=args.offline,
+            parse_processes=args.parse_processes, queue_depth=args.queue_depth
+        )
+        scraper.crawl_to_jsonl(args.jsonl, checkpoint_path)
+    compact_jsonl(args.jsonl, args.output)